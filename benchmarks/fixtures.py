@@ -0,0 +1,89 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Синтетические исходники для бенчмарков (источники lavfi в ffmpeg)"""
+
+import os
+import subprocess
+
+# Короткое зацикливаемое видео и длинное аудио, как у настоящих coub
+FIXTURES = [
+    {'name': 'loop2s_24fps', 'video_duration': 2.0, 'fps': 24, 'audio_duration': 15},
+    {'name': 'loop3.4s_25fps', 'video_duration': 3.4, 'fps': 25, 'audio_duration': 30},
+    {'name': 'loop5s_30fps', 'video_duration': 5.0, 'fps': 30, 'audio_duration': 45},
+    {'name': 'loop7.3s_29.97fps', 'video_duration': 7.3, 'fps': '30000/1001',
+     'audio_duration': 60},
+    {'name': 'loop10s_60fps', 'video_duration': 10.0, 'fps': 60, 'audio_duration': 120},
+]
+
+VIDEO_SIZE = '640x360'
+AUDIO_BITRATE = '128k'
+
+
+def build_video_cmd(spec, output_path):
+    """Команда генерации видео без звука (H.264, faststart)"""
+    source = (f"testsrc2=size={VIDEO_SIZE}:rate={spec['fps']}"
+              f":duration={spec['video_duration']}")
+    return [
+        'ffmpeg', '-f', 'lavfi', '-i', source,
+        '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p',
+        '-movflags', '+faststart',
+        '-y', output_path
+    ]
+
+
+def build_audio_cmd(spec, output_path):
+    """Команда генерации MP3 с тоном"""
+    source = f"sine=frequency=440:sample_rate=44100:duration={spec['audio_duration']}"
+    return [
+        'ffmpeg', '-f', 'lavfi', '-i', source,
+        '-c:a', 'libmp3lame', '-b:a', AUDIO_BITRATE,
+        '-y', output_path
+    ]
+
+
+def fixture_paths(spec, directory):
+    """Пути к видео и аудио исходника"""
+    return (os.path.join(directory, f"{spec['name']}.mp4"),
+            os.path.join(directory, f"{spec['name']}.mp3"))
+
+
+def generate_fixture(spec, directory):
+    """Создает файлы исходника, если их еще нет; возвращает (видео, аудио)"""
+    os.makedirs(directory, exist_ok=True)
+    video_path, audio_path = fixture_paths(spec, directory)
+
+    for path, build_cmd in ((video_path, build_video_cmd), (audio_path, build_audio_cmd)):
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            continue
+        # Пишем во временный файл, чтобы прерванная генерация не оставила мусор
+        tmp_path = f"{path}.tmp{os.path.splitext(path)[1]}"
+        subprocess.run(build_cmd(spec, tmp_path), check=True,
+                       stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.PIPE)
+        os.replace(tmp_path, path)
+
+    return video_path, audio_path
+
+
+def generate_fixtures(directory, names=None):
+    """Создает исходники; names ограничивает набор. Возвращает {имя: (видео, аудио)}"""
+    fixtures = {}
+    for spec in FIXTURES:
+        if names and spec['name'] not in names:
+            continue
+        fixtures[spec['name']] = generate_fixture(spec, directory)
+    return fixtures
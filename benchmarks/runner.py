@@ -0,0 +1,266 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Прогон конвейера на локальном стенде и сравнение с эталоном"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config.settings import (CACHE_DIR, QUALITY_SETTINGS, METADATA_CACHE, MEDIA_CACHE,
+                             DOWNLOAD_INDEX)
+from benchmarks.fixtures import FIXTURES, generate_fixtures
+from benchmarks.server import BenchmarkServer
+
+DEFAULT_WORK_DIR = os.path.join(CACHE_DIR, 'benchmarks')
+
+
+def parse_args(argv=None):
+    """Разбирает аргументы командной строки"""
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description="Офлайн-бенчмарк полного конвейера на синтетических исходниках. "
+                    "Результаты по каждому варианту выводятся в stdout в формате JSON Lines.",
+    )
+    parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR,
+                        help="каталог для исходников (переиспользуются между запусками)")
+    parser.add_argument('--fixtures', nargs='+', choices=[spec['name'] for spec in FIXTURES],
+                        help="ограничить набор исходников")
+    parser.add_argument('--repeat', type=int, default=2,
+                        help="заданий на каждый исходник в одном варианте")
+    parser.add_argument('--sync-methods', type=int, nargs='+', choices=(1, 2), default=[1, 2])
+    parser.add_argument('--loop-detection', choices=('on', 'off', 'both'), default='both')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4],
+                        help="уровни параллельности")
+    parser.add_argument('--engines', nargs='+', choices=('threads', 'async'),
+                        default=['threads'])
+    parser.add_argument('--passes', nargs='+', choices=('single', 'multi'), default=['single'],
+                        help="single - один проход ffmpeg, multi - склейка, синхронизация "
+                             "и метаданные отдельными запусками")
+    parser.add_argument('--bandwidth', type=float, default=0,
+                        help="ограничение сервера, МБ/с на соединение (0 - без ограничения)")
+    parser.add_argument('--api-latency', type=float, default=0,
+                        help="задержка ответа API, секунды")
+    parser.add_argument('--cache', action='store_true',
+                        help="не отключать кэши метаданных и исходников и индекс готовых загрузок")
+    parser.add_argument('--warmup', type=int, default=1,
+                        help="заданий до замеров (не учитываются)")
+    parser.add_argument('--save', help="сохранить сводку как эталон")
+    parser.add_argument('--baseline', help="сравнить с эталоном, код возврата 1 при регрессии")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="допустимое замедление относительно эталона (доля)")
+    return parser.parse_args(argv)
+
+
+def build_cases(args):
+    """Все сочетания параметров из аргументов"""
+    loop_modes = {'on': [True], 'off': [False], 'both': [True, False]}[args.loop_detection]
+    cases = []
+    for engine in args.engines:
+        for passes in args.passes:
+            for sync_method in args.sync_methods:
+                for loop_detection in loop_modes:
+                    for workers in args.workers:
+                        cases.append({
+                            'engine': engine,
+                            'passes': passes,
+                            'sync_method': sync_method,
+                            'loop_detection': loop_detection,
+                            'workers': max(1, workers),
+                        })
+    return cases
+
+
+def case_key(case):
+    """Стабильное имя варианта для сравнения с эталоном"""
+    return (f"{case['engine']}/{case['passes']}/sync{case['sync_method']}/"
+            f"loop-{'on' if case['loop_detection'] else 'off'}/w{case['workers']}")
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def _make_pipeline(case, server, output_dir, use_cache, errors):
+    from core.pipeline import MediaPipeline
+
+    return MediaPipeline(
+        case['sync_method'], case['loop_detection'], output_dir=output_dir,
+        use_cache=use_cache, api_base_url=server.api_base_url, on_error=errors.append,
+    )
+
+
+def _run_threads(urls, make_pipeline, workers):
+    pipelines = [make_pipeline() for _ in urls]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(
+            lambda item: item[0].download_media_high_quality(item[1]), zip(pipelines, urls)
+        ))
+    return pipelines, results
+
+
+def _run_async(urls, make_pipeline, workers):
+    from core.async_engine import AsyncEngine
+
+    pipelines = {}
+
+    def create(index):
+        pipelines[index] = make_pipeline()
+        return pipelines[index]
+
+    results = AsyncEngine(max_jobs=workers).run(list(enumerate(urls)), create)
+    return ([pipelines[index] for index in range(len(urls))],
+            [results[index] for index in range(len(urls))])
+
+
+def run_case(case, server, urls, use_cache=False):
+    """Прогоняет задания одного варианта, возвращает сводку"""
+    QUALITY_SETTINGS['PROCESSING']['SINGLE_PASS'] = case['passes'] == 'single'
+    output_dir = tempfile.mkdtemp(prefix='loader_bench_')
+    errors = []
+
+    def make_pipeline():
+        return _make_pipeline(case, server, output_dir, use_cache, errors)
+
+    run = _run_async if case['engine'] == 'async' else _run_threads
+    started = time.monotonic()
+    try:
+        pipelines, results = run(urls, make_pipeline, case['workers'])
+        wall = time.monotonic() - started
+        output_bytes = sum(os.path.getsize(path) for path in results if path)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    durations = [pipeline.record.duration for pipeline in pipelines]
+    stages = {}
+    for pipeline in pipelines:
+        for stage, value in pipeline.record.stage_durations().items():
+            stages.setdefault(stage, []).append(value)
+
+    failed = sum(1 for path in results if not path)
+    return {
+        'case': case_key(case),
+        'params': case,
+        'jobs': len(urls),
+        'failed': failed,
+        'errors': errors[:10],
+        'wall': round(wall, 4),
+        'jobs_per_sec': round(len(urls) / wall, 4) if wall > 0 else 0,
+        'job_p50': round(_percentile(durations, 0.5), 4),
+        'job_p95': round(_percentile(durations, 0.95), 4),
+        'stages_p50': {stage: round(statistics.median(values), 4)
+                       for stage, values in sorted(stages.items())},
+        'output_bytes': output_bytes,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Варианты, ставшие медленнее эталона больше чем на tolerance"""
+    regressions = []
+    for result in results:
+        reference = baseline.get(result['case'])
+        if not reference:
+            continue
+        for metric in ('wall', 'job_p50'):
+            if reference.get(metric, 0) <= 0:
+                continue
+            ratio = result[metric] / reference[metric]
+            if ratio > 1 + tolerance:
+                regressions.append({
+                    'case': result['case'],
+                    'metric': metric,
+                    'baseline': reference[metric],
+                    'current': result[metric],
+                    'ratio': round(ratio, 3),
+                })
+    return regressions
+
+
+def _format_row(result):
+    stages = ', '.join(f"{stage} {value:.2f}" for stage, value in result['stages_p50'].items())
+    return (f"{result['case']:<36} {result['wall']:>8.2f} с  {result['jobs_per_sec']:>6.2f} "
+            f"зад/с  p50 {result['job_p50']:.2f} с  p95 {result['job_p95']:.2f} с  "
+            f"ошибок {result['failed']}  [{stages}]")
+
+
+def main(argv=None):
+    """Точка входа бенчмарка"""
+    args = parse_args(argv)
+
+    from core.utils import check_ffmpeg
+
+    if not check_ffmpeg():
+        print("Ошибка: ffmpeg не найден. Установите ffmpeg и добавьте в PATH.", file=sys.stderr)
+        return 1
+
+    if not args.cache:
+        # Иначе повторные задания измеряли бы чтение из кэша, а не конвейер
+        METADATA_CACHE['ENABLED'] = False
+        MEDIA_CACHE['ENABLED'] = False
+        DOWNLOAD_INDEX['ENABLED'] = False
+
+    print(f"Исходники: {args.work_dir}", file=sys.stderr)
+    fixtures = generate_fixtures(args.work_dir, args.fixtures)
+
+    server = BenchmarkServer(fixtures, bandwidth=args.bandwidth * 1024 * 1024,
+                             api_latency=args.api_latency).start()
+    single_pass = QUALITY_SETTINGS['PROCESSING']['SINGLE_PASS']
+    results = []
+    try:
+        urls = [server.media_url(name, index)
+                for index in range(max(1, args.repeat)) for name in fixtures]
+
+        cases = build_cases(args)
+        if args.warmup > 0 and cases:
+            run_case(dict(cases[0], workers=1), server, urls[:args.warmup], args.cache)
+
+        for case in cases:
+            result = run_case(case, server, urls, args.cache)
+            results.append(result)
+            print(json.dumps(result, ensure_ascii=False), flush=True)
+            print(_format_row(result), file=sys.stderr, flush=True)
+    finally:
+        QUALITY_SETTINGS['PROCESSING']['SINGLE_PASS'] = single_pass
+        server.stop()
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({result['case']: result for result in results}, f,
+                      ensure_ascii=False, indent=2)
+
+    exit_code = 0 if all(result['failed'] == 0 for result in results) else 1
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Регрессия {regression['case']} {regression['metric']}: "
+                  f"{regression['baseline']} -> {regression['current']} "
+                  f"(x{regression['ratio']})", file=sys.stderr)
+        if regressions:
+            exit_code = 1
+
+    return exit_code
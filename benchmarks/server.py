@@ -0,0 +1,242 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Локальная замена API и файлового сервера для бенчмарков"""
+
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote
+
+API_PATH = '/api/v2/coubs/'
+MEDIA_PATH = '/media/'
+# Разделитель имени исходника и номера задания в ID: loop2s_24fps--3
+ID_SEPARATOR = '--'
+CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+def build_media_info(media_id, fixture_name, base_url, video_size, audio_size):
+    """Ответ API в том же виде, что и у coub.com (поля, которые читает API)
+
+    Ссылки на файлы содержат ID задания в строке запроса: у копий одного
+    исходника (--repeat) разные URL, поэтому их загрузки не ждут друг друга
+    на блокировке докачки и не попадают в кэш исходников.
+    """
+    query = f"?job={quote(media_id)}"
+    video = {'url': f"{base_url}{MEDIA_PATH}{fixture_name}.mp4{query}", 'size': video_size}
+    return {
+        'id': media_id,
+        'permalink': media_id,
+        'title': f"Benchmark {media_id}",
+        'tags': [{'title': 'benchmark'}, {'title': fixture_name}],
+        'music': {
+            'title': f"Tone {fixture_name}",
+            'album_name': 'Benchmarks',
+            'artist_title': 'lavfi',
+        },
+        'file_versions': {
+            'html5': {
+                'video': {'high': dict(video), 'med': dict(video)},
+                'audio': {
+                    'high': {'url': f"{base_url}{MEDIA_PATH}{fixture_name}.mp3{query}",
+                             'size': audio_size},
+                },
+            },
+        },
+    }
+
+
+def parse_range(header, size):
+    """Разбирает заголовок Range, возвращает (start, end) включительно или None"""
+    match = _RANGE_RE.match(header.strip())
+    if not match or size == 0:
+        return None
+
+    start, end = match.groups()
+    if start:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    elif end:
+        # Последние N байт
+        start = max(size - int(end), 0)
+        end = size - 1
+    else:
+        return None
+
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._handle(send_body=False)
+
+    def do_GET(self):
+        self._handle(send_body=True)
+
+    def _handle(self, send_body):
+        path = unquote(self.path.split('?', 1)[0])
+        if path.startswith(API_PATH):
+            self._send_api(path[len(API_PATH):], send_body)
+        elif path.startswith(MEDIA_PATH):
+            self._send_file(os.path.basename(path[len(MEDIA_PATH):]), send_body)
+        else:
+            self._send_error(404)
+
+    def _send_error(self, code):
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _send_api(self, media_id, send_body):
+        server = self.server
+        fixture_name = media_id.split(ID_SEPARATOR, 1)[0]
+        paths = server.fixtures.get(fixture_name)
+        if paths is None:
+            self._send_error(404)
+            return
+
+        server.count('api')
+        data = build_media_info(media_id, fixture_name, server.base_url,
+                                os.path.getsize(paths[0]), os.path.getsize(paths[1]))
+        body = json.dumps(data).encode('utf-8')
+        if server.api_latency:
+            time.sleep(server.api_latency)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _send_file(self, name, send_body):
+        server = self.server
+        path = server.files.get(name)
+        if path is None:
+            self._send_error(404)
+            return
+
+        stat = os.stat(path)
+        size = stat.st_size
+        start, end = 0, size - 1
+        status = 200
+
+        range_header = self.headers.get('Range')
+        if range_header:
+            byte_range = parse_range(range_header, size)
+            if byte_range is None:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            start, end = byte_range
+            status = 206
+
+        server.count('range' if status == 206 else 'file')
+        length = end - start + 1
+        self.send_response(status)
+        self.send_header('Content-Type', 'video/mp4' if name.endswith('.mp4') else 'audio/mpeg')
+        self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', f'"{size:x}-{stat.st_mtime_ns:x}"')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        if not send_body:
+            return
+
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                try:
+                    self.wfile.write(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                remaining -= len(chunk)
+                if server.bandwidth:
+                    # Грубая имитация пропускной способности на одно соединение
+                    time.sleep(len(chunk) / server.bandwidth)
+
+
+class BenchmarkServer(ThreadingHTTPServer):
+    """HTTP-сервер с ответами API и раздачей исходников с поддержкой Range
+
+    fixtures - {имя: (видео, аудио)}; bandwidth - байт/с на соединение
+    (0 - без ограничения); api_latency - задержка ответа API в секундах.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, fixtures, host='127.0.0.1', port=0, bandwidth=0, api_latency=0):
+        super().__init__((host, port), _Handler)
+        self.fixtures = dict(fixtures)
+        self.files = {}
+        for video_path, audio_path in self.fixtures.values():
+            self.files[os.path.basename(video_path)] = video_path
+            self.files[os.path.basename(audio_path)] = audio_path
+        self.bandwidth = bandwidth
+        self.api_latency = api_latency
+        self.requests = {}
+        self._requests_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_base_url(self):
+        """Значение для API(base_url=...)"""
+        return f"{self.base_url}{API_PATH}"
+
+    def media_url(self, fixture_name, index=0):
+        """Ссылка на «страницу» видео; ID уникален для каждого задания"""
+        return f"{self.base_url}/view/{fixture_name}{ID_SEPARATOR}{index}"
+
+    def count(self, kind):
+        with self._requests_lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    def start(self):
+        """Запускает сервер в фоновом потоке"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
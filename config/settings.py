@@ -16,6 +16,8 @@
 
 """Настройки качества и обработки"""
 
+import os
+
 QUALITY_SETTINGS = {
     'VIDEO_QUALITY': {
         'priority': ['higher', 'high', 'med'],
@@ -28,18 +30,134 @@ QUALITY_SETTINGS = {
         'OUTPUT_FORMAT': 'mp4',
         'ENABLE_LOOP_DETECTION': True,
         'USE_CONCAT_METHOD': True,
-        'SYNC_PRECISION': 0.001
+        'SINGLE_PASS': True,
+        'LOOP_DURATION_METHOD': 'analytic',  # 'analytic' или 'concat' (пробная склейка)
+        'STREAM_AUDIO': False,  # подавать аудио в ffmpeg во время загрузки
+        'STREAM_PROBE_BYTES': 256 * 1024,  # максимум байт для поиска заголовка MP3
+        'SYNC_PRECISION': 0.001,
+        'VARIANT_WORKERS': 4  # одновременных сборок вариантов одного задания
     }
 }
 
+# Контейнеры итоговых файлов (см. core/variants.py)
+OUTPUT_CONTAINERS = ('mp4', 'mkv', 'mov')
+
+# Профили перекодирования на процессоре (без профиля потоки копируются как есть).
+# Вариант может сочетать видео- и аудиопрофиль: 'h265+opus'
+ENCODE_PROFILES = {
+    'h264': {'VIDEO_CODEC': 'libx264', 'CRF': 23, 'PRESET': 'medium'},
+    'h265': {'VIDEO_CODEC': 'libx265', 'CRF': 28, 'PRESET': 'medium'},
+    'opus': {'AUDIO_CODEC': 'libopus', 'AUDIO_BITRATE': '96k'},
+    'aac': {'AUDIO_CODEC': 'aac', 'AUDIO_BITRATE': '128k'},
+}
+
+# Выбор качества видео по размеру версий (см. core/quality.py).
+# Без бюджета берется первое доступное качество из VIDEO_QUALITY['priority']
+QUALITY_POLICY = {
+    'MAX_BYTES': 0,  # бюджет задания (видео + аудио), байт; 0 - без ограничения
+    'TARGET_SECONDS': 0,  # целевое время загрузки задания, с; 0 - без ограничения
+    'RATE': 0,  # ожидаемая скорость для TARGET_SECONDS, байт/с; 0 - BANDWIDTH_LIMIT
+    'HEAD_WORKERS': 4,  # одновременных HEAD-запросов за размерами версий
+}
+
+# Планировщик перекодирований: ядра делятся между одновременными ffmpeg
+ENCODE = {
+    'CORES': 0,  # ядер для перекодирования, 0 - все
+    'MAX_ENCODES': 0,  # одновременных перекодирований, 0 - CORES // MIN_THREADS
+    'MIN_THREADS': 2,  # потоков на одно перекодирование при расчете MAX_ENCODES
+}
+
 # Версия приложения
 APP_VERSION = "2.0.0"
 APP_NAME = "Loader"
 
 # Настройки API
 API_BASE_URL = "https://coub.com/api/v2/coubs/"
+API_TIMELINE_URL = "https://coub.com/api/v2/timeline/"
+MEDIA_VIEW_URL = "https://coub.com/view/"
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
 
+# Локальный кэш
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'loader')
+
+METADATA_CACHE = {
+    'ENABLED': True,
+    'TTL': 24 * 60 * 60,  # секунды
+    'MAX_ENTRIES': 10000
+}
+
+MEDIA_CACHE = {
+    'ENABLED': True,
+    'MAX_BYTES': 2 * 1024 * 1024 * 1024
+}
+
+# Индекс готовых загрузок: уже скачанные видео пропускаются
+DOWNLOAD_INDEX = {
+    'ENABLED': True,
+    'VERIFY_HASH': False  # сверять хеш, если у файла изменилось время, но не размер
+}
+
+# Рабочий каталог для промежуточных файлов: 'auto' - RAM-диск (tmpfs), если
+# на нем достаточно места с учетом других заданий, затем файловая система
+# кэша исходников (попадания и запись в кэш - жесткие ссылки), иначе
+# системный временный каталог; '' - всегда системный временный каталог;
+# либо явный путь
+WORK_DIR = 'auto'
+WORK_DIR_CANDIDATES = ['/dev/shm']
+WORK_DIR_PREFER_CACHE = False  # файловая система кэша исходников раньше RAM-диска
+WORK_DIR_MIN_FREE = 512 * 1024 * 1024  # байт на задание, если размеры файлов неизвестны
+# Место на задание - размер исходников с запасом на зацикленное видео и сборки
+WORK_DIR_SIZE_FACTOR = 4
+
 # Настройки загрузки
 DOWNLOAD_CHUNK_SIZE = 8192
-DOWNLOAD_TIMEOUT = 30
\ No newline at end of file
+DOWNLOAD_TIMEOUT = 30
+# Повторы при временных ошибках: экспоненциальная задержка со случайным разбросом
+DOWNLOAD_RETRIES = 5
+DOWNLOAD_BACKOFF_BASE = 0.5  # секунды
+DOWNLOAD_BACKOFF_MAX = 30
+# Недописанные файлы и журналы докачки (переживают перезапуск)
+RESUME_DIR = os.path.join(CACHE_DIR, 'partial')
+RESUME_MAX_AGE = 7 * 24 * 60 * 60  # секунды
+# ffmpeg останавливается, если прогресс не меняется столько секунд (0 - не следить)
+FFMPEG_STALL_TIMEOUT = 60
+
+# Метрики этапов: JSON Lines на каждое задание и textfile для Prometheus
+METRICS = {
+    'JSONL_PATH': '',
+    'PROMETHEUS_PATH': '',
+    'WINDOW': 10000  # замеров на этап для расчета квантилей
+}
+
+# Частота обновления прогресса (раз в секунду)
+PROGRESS_UPDATE_HZ = 10
+
+# Сегментированная загрузка (несколько соединений на файл)
+DOWNLOAD_SEGMENTS = 4
+DOWNLOAD_SEGMENT_MIN_SIZE = 1024 * 1024
+
+# Общий лимит скорости всех загрузок, байт/с (0 - без ограничения)
+BANDWIDTH_LIMIT = 0
+BANDWIDTH_BURST = 0  # байт; 0 - четверть секундного лимита
+# Одновременных соединений к одному хосту (CDN) у всех заданий вместе
+HOST_MAX_CONNECTIONS = 8
+
+# Пул HTTP-соединений (общий для API и загрузчика)
+HTTP_POOL_CONNECTIONS = 10  # количество хостов в пуле
+HTTP_POOL_MAXSIZE = 16  # соединений на хост
+HTTP_MAX_RETRIES = 0
+
+# Пакетная загрузка
+BATCH_MAX_WORKERS = 3
+
+# Загрузка каналов, тегов и разделов целиком
+INGEST = {
+    'PER_PAGE': 25,
+    'PREFETCH_PAGES': 4,  # страниц ленты запрашивается одновременно
+    'MAX_PAGES': 0  # 0 - без ограничения
+}
+
+# Асинхронный движок (python -m loader --engine async)
+ASYNC_MAX_JOBS = 100  # одновременных заданий
+ASYNC_MAX_PROCESSES = os.cpu_count() or 2  # одновременных ffmpeg/ffprobe
+ASYNC_MAX_DOWNLOADS = 16  # одновременных загрузок заданий
\ No newline at end of file
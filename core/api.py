@@ -16,31 +16,76 @@
 
 """Работа с API"""
 
-import requests
 import json
-from config.settings import API_BASE_URL, USER_AGENT
+from urllib.parse import urlsplit
+from config.settings import (API_BASE_URL, API_TIMELINE_URL, USER_AGENT, METADATA_CACHE,
+                             DOWNLOAD_TIMEOUT)
+from core.http_session import get_session
+from core.metadata_cache import get_metadata_cache
 
 
 class API:
     """Класс для работы с API"""
 
-    def __init__(self):
+    def __init__(self, use_cache=True, base_url=None, timeline_url=None):
         self.headers = {'User-Agent': USER_AGENT}
+        self.use_cache = use_cache and METADATA_CACHE['ENABLED']
+        # Другой адрес API, например локальный стенд бенчмарков
+        self.base_url = base_url or API_BASE_URL
+        self.timeline_url = timeline_url or API_TIMELINE_URL
 
-    def get_media_info(self, media_id):
-        """Получает информацию о видео по ID"""
-        api_url = f"{API_BASE_URL}{media_id}"
-        response = requests.get(api_url, headers=self.headers)
+    def get_media_info(self, media_id, use_cache=None):
+        """Получает информацию о видео по ID
+
+        Ответ берется из локального кэша, если он там есть и не устарел.
+        use_cache=False принудительно запрашивает API.
+        """
+        if use_cache is None:
+            use_cache = self.use_cache
+
+        if use_cache:
+            data = get_metadata_cache().get(media_id)
+            if data is not None:
+                return data
+
+        api_url = f"{self.base_url}{media_id}"
+        response = get_session().get(api_url, headers=self.headers, timeout=DOWNLOAD_TIMEOUT)
         response.raise_for_status()
-        return response.json()
+        data = response.json()
+
+        # Свежий ответ сохраняем даже при обходе кэша
+        if METADATA_CACHE['ENABLED']:
+            get_metadata_cache().put(media_id, data)
+        return data
 
     def extract_media_id(self, url):
-        """Извлекает ID из URL"""
-        return url.split('/')[-1]
+        """Извлекает ID из URL (без параметров запроса и завершающего /)"""
+        return urlsplit(url).path.rstrip('/').split('/')[-1]
+
+    def get_timeline_page(self, path, page, per_page):
+        """Получает страницу ленты: канала, тега или раздела
+
+        path - путь ленты относительно API_TIMELINE_URL, например 'tag/cats'.
+        """
+        response = get_session().get(
+            f"{self.timeline_url}{path}",
+            params={'page': page, 'per_page': per_page},
+            headers=self.headers,
+            timeout=DOWNLOAD_TIMEOUT,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def get_video_qualities(self, data):
+        """Качества, в которых есть видео"""
+        return [quality for quality, version in data['file_versions']['html5']['video'].items()
+                if version.get('url')]
 
-    def get_video_urls(self, data):
-        """Получает URL видео в максимальном качестве"""
+    def get_video_urls(self, data, quality=None):
+        """Получает URL видео в заданном (если есть) или максимальном качестве"""
         video_versions = data['file_versions']['html5']['video']
+        if quality in video_versions:
+            return video_versions[quality]['url'], quality
 
         from config.settings import QUALITY_SETTINGS
         priority = QUALITY_SETTINGS['VIDEO_QUALITY']['priority']
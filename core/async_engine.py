@@ -0,0 +1,295 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Асинхронный движок обработки на asyncio"""
+
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from core.media_headers import parse_duration
+from core.probe import build_probe_cmd, parse_probe_output, get_cached_probe, store_probe
+from core.ffmpeg_runner import FfmpegProgressParser, with_progress_args, get_progress_sink
+from core.steps import Call, Ffmpeg, Duration, Probe, AcquireEncoder, Parallel
+from core.metrics import record_process
+from config.settings import (ASYNC_MAX_JOBS, ASYNC_MAX_PROCESSES, ASYNC_MAX_DOWNLOADS,
+                             FFMPEG_STALL_TIMEOUT)
+
+# Как часто проверять, освободилось ли место для перекодирования, с
+_ENCODE_POLL_INTERVAL = 0.1
+
+
+class AsyncEngine:
+    """Один цикл событий ведет множество заданий одновременно
+
+    ffmpeg и ffprobe запускаются как асинхронные подпроцессы, их число
+    ограничено семафором. Блокирующие HTTP-запросы выполняются в
+    ограниченном пуле потоков, не занимая цикл событий.
+    """
+
+    def __init__(self, max_jobs=ASYNC_MAX_JOBS, max_processes=ASYNC_MAX_PROCESSES,
+                 max_downloads=ASYNC_MAX_DOWNLOADS):
+        self.max_jobs = max(1, max_jobs)
+        self.max_processes = max(1, max_processes)
+        self.max_downloads = max(1, max_downloads)
+        self._process_semaphore = None
+        self._download_executor = None
+
+    async def run_process(self, cmd):
+        """Запускает процесс, возвращает (код возврата, stdout)"""
+        async with self._process_semaphore:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            started = time.monotonic()
+            try:
+                stdout, _ = await process.communicate()
+            except asyncio.CancelledError:
+                process.kill()
+                await process.wait()
+                raise
+            record_process(cmd[0], 'probe', process.returncode, time.monotonic() - started)
+            return process.returncode, stdout.decode('utf-8', errors='replace')
+
+    async def run_ffmpeg(self, cmd, stage='', duration=0, sink=None,
+                         stall_timeout=FFMPEG_STALL_TIMEOUT):
+        """Запускает ffmpeg с разбором -progress, возвращает True при успехе
+
+        sink(stage, info) получает прогресс; процесс, чей прогресс не
+        меняется дольше stall_timeout секунд, принудительно завершается.
+        """
+        parser = FfmpegProgressParser(duration)
+        async with self._process_semaphore:
+            started = time.monotonic()
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *with_progress_args(cmd),
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.DEVNULL,
+                )
+            except OSError:
+                return False
+
+            last_position = None
+            last_advance = time.monotonic()
+            try:
+                while True:
+                    remaining = None
+                    if stall_timeout:
+                        remaining = max(stall_timeout - (time.monotonic() - last_advance), 0.1)
+                    try:
+                        line = await asyncio.wait_for(process.stdout.readline(), remaining)
+                    except asyncio.TimeoutError:
+                        # Прогресс остановился
+                        process.kill()
+                        await process.wait()
+                        record_process('ffmpeg', stage, process.returncode,
+                                       time.monotonic() - started)
+                        return False
+                    if not line:
+                        break
+
+                    info = parser.feed(line.decode('utf-8', errors='replace'))
+                    if info is None:
+                        continue
+                    position = (info['out_time'], info['total_size'])
+                    if position != last_position:
+                        last_position = position
+                        last_advance = time.monotonic()
+                    if sink is not None:
+                        sink(stage, info)
+
+                returncode = await process.wait()
+            except asyncio.CancelledError:
+                process.kill()
+                await process.wait()
+                raise
+            record_process('ffmpeg', stage, returncode, time.monotonic() - started)
+        return returncode == 0
+
+    async def probe(self, path):
+        """Асинхронный аналог core.probe.probe"""
+        result = get_cached_probe(path)
+        if result is not None:
+            return result
+
+        try:
+            returncode, output = await self.run_process(build_probe_cmd(path))
+        except OSError:
+            return None
+        if returncode != 0:
+            return None
+
+        result = parse_probe_output(path, output)
+        if result is not None:
+            store_probe(path, result)
+        return result
+
+    async def get_duration(self, path):
+        """Длительность по заголовкам, иначе через асинхронный ffprobe"""
+        duration = await self._in_thread(parse_duration, path)
+        if duration > 0:
+            return duration
+
+        result = await self.probe(path)
+        return result.duration if result is not None else 0
+
+    async def _in_thread(self, func, *args):
+        loop = asyncio.get_running_loop()
+        # Копия контекста: замеры и прогресс ffmpeg остаются у этого задания
+        return await loop.run_in_executor(None, contextvars.copy_context().run, func, *args)
+
+    async def _download(self, func, *args):
+        """Выполняет загрузку в пуле, ограниченном max_downloads"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._download_executor,
+                                          contextvars.copy_context().run, func, *args)
+
+    async def process(self, media_url, pipeline):
+        """Обрабатывает одно видео, возвращает путь к результату или None
+
+        pipeline - MediaPipeline с настройками и колбэками задания; этапы
+        берутся из pipeline.steps(), поэтому итоги те же, что у
+        download_media_high_quality: пути ко всем вариантам - в
+        pipeline.outputs, замеры этапов - в pipeline.record.
+        """
+        # Каждое задание выполняется в своей задаче asyncio со своим контекстом
+        return await self.run_steps(pipeline.steps(media_url))
+
+    async def run_steps(self, steps):
+        """Выполняет шаги генератора (см. core.steps), возвращает его итог"""
+        result = None
+        error = None
+        try:
+            while True:
+                try:
+                    step = steps.send(result) if error is None else steps.throw(error)
+                except StopIteration as e:
+                    return e.value
+                result = error = None
+                try:
+                    result = await self._execute(step)
+                except Exception as e:
+                    error = e
+        finally:
+            steps.close()
+
+    async def _execute(self, step):
+        """Выполняет один шаг, не блокируя цикл событий"""
+        if isinstance(step, Call):
+            if step.download:
+                return await self._download(step.func, *step.args)
+            return await self._in_thread(step.func, *step.args)
+
+        if isinstance(step, Ffmpeg):
+            return await self.run_ffmpeg(step.cmd, step.stage, step.duration,
+                                         get_progress_sink())
+
+        if isinstance(step, Duration):
+            return await self.get_duration(step.path)
+
+        if isinstance(step, Probe):
+            return await self.probe(step.path)
+
+        if isinstance(step, AcquireEncoder):
+            return await self._acquire_encoder(step.scheduler)
+
+        if isinstance(step, Parallel):
+            semaphore = asyncio.Semaphore(step.max_workers) if step.max_workers else None
+
+            async def run_limited(generator):
+                if semaphore is None:
+                    return await self.run_steps(generator)
+                async with semaphore:
+                    return await self.run_steps(generator)
+
+            return await asyncio.gather(
+                *(run_limited(generator) for generator in step.generators),
+                return_exceptions=True
+            )
+
+        raise TypeError(f"Неизвестный шаг: {step!r}")
+
+    async def _acquire_encoder(self, scheduler):
+        """Ждет места в планировщике перекодирований
+
+        Опрос вместо блокирующего ожидания: ждущие задания не занимают
+        потоки пула, нужные заданиям, которые уже перекодируют.
+        """
+        while True:
+            threads = scheduler.try_acquire()
+            if threads:
+                return threads
+            await asyncio.sleep(_ENCODE_POLL_INTERVAL)
+
+    async def run_many(self, items, make_pipeline, on_result=None, on_error=None):
+        """Обрабатывает задания, не более max_jobs одновременно
+
+        items - пары (ключ, ссылка), в том числе генератор, который выдает их
+        по мере появления (следующая пара берется, когда есть свободное место);
+        make_pipeline(ключ) создает MediaPipeline;
+        on_result(ключ, путь или None) вызывается по завершении каждого задания;
+        on_error(ключ, исключение) - если задание не удалось даже начать
+        (например, make_pipeline выбросил исключение), on_result затем
+        получает None.
+        Возвращает словарь ключ -> путь или None.
+        """
+        self._process_semaphore = asyncio.Semaphore(self.max_processes)
+        job_semaphore = asyncio.Semaphore(self.max_jobs)
+        results = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_downloads) as executor:
+            self._download_executor = executor
+
+            async def run_one(key, url):
+                result = None
+                try:
+                    result = await self.process(url, make_pipeline(key))
+                except Exception as e:
+                    # Ошибка одного задания не отменяет остальные
+                    if on_error:
+                        on_error(key, e)
+                finally:
+                    job_semaphore.release()
+                results[key] = result
+                if on_result:
+                    on_result(key, result)
+
+            tasks = []
+            iterator = iter(items)
+            try:
+                while True:
+                    await job_semaphore.acquire()
+                    # Генератор может ждать новых ссылок: не блокируем цикл событий
+                    item = await self._in_thread(next, iterator, None)
+                    if item is None:
+                        job_semaphore.release()
+                        break
+                    tasks.append(asyncio.ensure_future(run_one(*item)))
+                await asyncio.gather(*tasks, return_exceptions=True)
+            finally:
+                self._download_executor = None
+
+        return results
+
+    def run(self, items, make_pipeline, on_result=None, on_error=None):
+        """Синхронная обертка над run_many"""
+        return asyncio.run(self.run_many(items, make_pipeline, on_result, on_error))
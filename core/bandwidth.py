@@ -0,0 +1,212 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Общий планировщик загрузок: лимит скорости и соединений к хосту"""
+
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from config.settings import BANDWIDTH_LIMIT, BANDWIDTH_BURST, HOST_MAX_CONNECTIONS
+
+# Как часто ожидающие потоки проверяют отмену, секунды
+_WAIT_STEP = 0.25
+
+
+class Priority:
+    """Приоритеты загрузок: интерактивные задания вытесняют пакетные"""
+    INTERACTIVE = 'interactive'
+    BATCH = 'batch'
+
+    ALL = (INTERACTIVE, BATCH)
+
+
+class DownloadCancelled(Exception):
+    """Загрузка отменена, пока ждала своей очереди"""
+
+
+def _is_cancelled(cancel_event):
+    return cancel_event is not None and cancel_event.is_set()
+
+
+class TokenBucket:
+    """Маркерная корзина: не больше rate байт/с в среднем, всплеск до burst
+
+    Пакетные потребители ждут, пока маркеров ждет хоть один интерактивный,
+    поэтому интерактивная загрузка забирает всю полосу, а остаток достается
+    пакетным. rate=0 - без ограничения.
+    """
+
+    def __init__(self, rate=0, burst=0):
+        self._cond = threading.Condition()
+        self._waiting = {priority: 0 for priority in Priority.ALL}
+        self.configure(rate, burst)
+
+    def configure(self, rate, burst=0):
+        """Меняет лимит на лету"""
+        with self._cond:
+            self.rate = max(0, rate)
+            self.burst = max(burst, 1) if burst else max(int(self.rate / 4), 64 * 1024)
+            self._tokens = self.burst
+            self._updated = time.monotonic()
+            self._cond.notify_all()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def consume(self, amount, priority=Priority.BATCH, cancel_event=None):
+        """Блокирует поток, пока не наберется amount байт полосы"""
+        if self.rate <= 0 or amount <= 0:
+            return
+
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                # Большие куски забираются частями, не превышая burst
+                remaining = amount
+                while remaining > 0:
+                    if _is_cancelled(cancel_event):
+                        raise DownloadCancelled()
+                    if self.rate <= 0:
+                        return
+
+                    self._refill()
+                    need = min(remaining, self.burst)
+                    if priority == Priority.INTERACTIVE:
+                        # Интерактивные забирают маркеры по мере появления
+                        taken = min(need, self._tokens)
+                        if taken > 0:
+                            self._tokens -= taken
+                            remaining -= taken
+                            continue
+                    elif not self._waiting[Priority.INTERACTIVE] and self._tokens >= need:
+                        # Пакетным достается только то, что не успели забрать
+                        # интерактивные
+                        self._tokens -= need
+                        remaining -= need
+                        continue
+
+                    delay = min((need - self._tokens) / self.rate, _WAIT_STEP)
+                    self._cond.wait(max(delay, 0.001))
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+
+
+class HostLimiter:
+    """Ограничение одновременных соединений к одному хосту
+
+    Освободившееся место достается интерактивной загрузке, если она ждет.
+    limit=0 - без ограничения. Открытые соединения учитываются при любом
+    лимите, поэтому его можно менять на ходу (configure).
+    """
+
+    def __init__(self, limit=0):
+        self.limit = max(0, limit)
+        self._cond = threading.Condition()
+        self._active = {}
+        self._waiting_interactive = {}
+
+    def configure(self, limit):
+        """Меняет лимит; ждущие загрузки проверяют его заново"""
+        with self._cond:
+            self.limit = max(0, limit)
+            self._cond.notify_all()
+
+    def acquire(self, host, priority=Priority.BATCH, cancel_event=None):
+        with self._cond:
+            if self.limit <= 0:
+                self._active[host] = self._active.get(host, 0) + 1
+                return
+            interactive = priority == Priority.INTERACTIVE
+            if interactive:
+                self._waiting_interactive[host] = self._waiting_interactive.get(host, 0) + 1
+            try:
+                while True:
+                    if _is_cancelled(cancel_event):
+                        raise DownloadCancelled()
+                    free = self.limit <= 0 or self._active.get(host, 0) < self.limit
+                    if free and (interactive or not self._waiting_interactive.get(host)):
+                        self._active[host] = self._active.get(host, 0) + 1
+                        return
+                    self._cond.wait(_WAIT_STEP)
+            finally:
+                if interactive:
+                    self._waiting_interactive[host] -= 1
+                    if not self._waiting_interactive[host]:
+                        del self._waiting_interactive[host]
+
+    def release(self, host):
+        with self._cond:
+            self._active[host] = self._active.get(host, 0) - 1
+            if self._active[host] <= 0:
+                del self._active[host]
+            self._cond.notify_all()
+
+    def active(self, host):
+        """Число открытых соединений к хосту"""
+        with self._cond:
+            return self._active.get(host, 0)
+
+
+class DownloadScheduler:
+    """Точка, через которую проходят все загрузки процесса"""
+
+    def __init__(self, rate=BANDWIDTH_LIMIT, burst=BANDWIDTH_BURST,
+                 host_limit=HOST_MAX_CONNECTIONS):
+        self.bucket = TokenBucket(rate, burst)
+        self.hosts = HostLimiter(host_limit)
+
+    def configure(self, rate=None, host_limit=None):
+        """Меняет лимиты; None оставляет прежнее значение"""
+        if rate is not None:
+            self.bucket.configure(rate)
+        if host_limit is not None:
+            self.hosts.configure(host_limit)
+
+    @contextmanager
+    def connection(self, url, priority=Priority.BATCH, cancel_event=None):
+        """Занимает место в лимите соединений хоста на время запроса"""
+        host = urlsplit(url).netloc.lower()
+        self.hosts.acquire(host, priority, cancel_event)
+        try:
+            yield
+        finally:
+            self.hosts.release(host)
+
+    def throttle(self, chunks, priority=Priority.BATCH, cancel_event=None):
+        """Пропускает куски данных не быстрее общего лимита"""
+        for chunk in chunks:
+            if chunk:
+                self.bucket.consume(len(chunk), priority, cancel_event)
+            yield chunk
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Возвращает общий для процесса планировщик загрузок"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = DownloadScheduler()
+    return _scheduler
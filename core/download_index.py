@@ -0,0 +1,235 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Индекс готовых загрузок: пропуск уже скачанных видео"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config.settings import CACHE_DIR, DOWNLOAD_INDEX
+
+# Сколько ID передавать в одном запросе без json_each (лимит параметров SQLite)
+_IN_CHUNK = 500
+_HASH_CHUNK = 1024 * 1024
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_download_index():
+    """Возвращает общий для процесса индекс готовых загрузок"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = DownloadIndex(os.path.join(CACHE_DIR, 'downloads.sqlite3'))
+    return _index
+
+
+def file_hash(path):
+    """SHA-256 содержимого файла"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadIndex:
+    """SQLite-индекс готовых файлов по (media_id, метод синхронизации, вариант)
+
+    Вариант - OutputVariant.key: контейнер и качество ('' по умолчанию).
+
+    Запись считается действительной, пока файл на месте и его размер и
+    время изменения совпадают с записанными. При verify_hash=True файл с
+    тем же размером, но другим временем изменения сверяется по хешу;
+    хеш считается только в этом режиме.
+
+    Если индекс недоступен (нет прав на каталог и т.п.), все видео
+    считаются не скачанными.
+    """
+
+    def __init__(self, path, verify_hash=DOWNLOAD_INDEX['VERIFY_HASH']):
+        self.path = path
+        self.verify_hash = verify_hash
+        self._lock = threading.Lock()
+        self._initialized = False
+        self._json_each = True
+
+    def _connect(self):
+        """Открывает соединение, при первом вызове создает таблицу"""
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS downloads (
+                    media_id TEXT NOT NULL,
+                    sync_method INTEGER NOT NULL,
+                    variant TEXT NOT NULL DEFAULT '',
+                    quality TEXT NOT NULL,
+                    output_path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    completed_at REAL NOT NULL,
+                    PRIMARY KEY (media_id, sync_method, variant)
+                )
+            ''')
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def add(self, media_id, sync_method, quality, output_path, variant=''):
+        """Записывает готовый файл; возвращает True при успехе"""
+        try:
+            stat = os.stat(output_path)
+            content_hash = file_hash(output_path) if self.verify_hash else ''
+        except OSError:
+            return False
+
+        try:
+            with self._lock:
+                conn = self._connect()
+                try:
+                    conn.execute(
+                        'INSERT OR REPLACE INTO downloads (media_id, sync_method, variant, '
+                        'quality, output_path, size, mtime_ns, content_hash, completed_at) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (media_id, sync_method, variant, quality or '',
+                         os.path.abspath(output_path),
+                         stat.st_size, stat.st_mtime_ns, content_hash, time.time())
+                    )
+                    conn.commit()
+                finally:
+                    conn.close()
+            return True
+        except (sqlite3.Error, OSError):
+            return False
+
+    def _select(self, conn, media_ids, sync_method, variant):
+        columns = ('SELECT media_id, quality, output_path, size, mtime_ns, content_hash '
+                   'FROM downloads WHERE sync_method = ? AND variant = ? AND media_id IN ')
+        if self._json_each:
+            try:
+                # Один запрос по первичному ключу на любое число ID
+                return conn.execute(columns + '(SELECT value FROM json_each(?))',
+                                    (sync_method, variant, json.dumps(media_ids))).fetchall()
+            except sqlite3.OperationalError:
+                # SQLite собран без JSON1
+                self._json_each = False
+
+        rows = []
+        for start in range(0, len(media_ids), _IN_CHUNK):
+            chunk = media_ids[start:start + _IN_CHUNK]
+            rows.extend(conn.execute(
+                columns + f"({', '.join('?' * len(chunk))})", [sync_method, variant] + chunk
+            ).fetchall())
+        return rows
+
+    def _is_valid(self, path, size, mtime_ns, content_hash):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if stat.st_size != size:
+            return False
+        if stat.st_mtime_ns == mtime_ns:
+            return True
+        if not (self.verify_hash and content_hash):
+            return False
+        try:
+            return file_hash(path) == content_hash
+        except OSError:
+            return False
+
+    def find_completed(self, media_ids, sync_method, variant=''):
+        """Готовые и целые на диске файлы: {media_id: путь}
+
+        Записи о пропавших или измененных файлах удаляются.
+        """
+        media_ids = list(dict.fromkeys(media_ids))
+        if not media_ids:
+            return {}
+
+        try:
+            with self._lock:
+                conn = self._connect()
+                try:
+                    rows = self._select(conn, media_ids, sync_method, variant)
+                finally:
+                    conn.close()
+        except (sqlite3.Error, OSError):
+            return {}
+
+        completed = {}
+        stale = []
+        for media_id, quality, path, size, mtime_ns, content_hash in rows:
+            if self._is_valid(path, size, mtime_ns, content_hash):
+                completed[media_id] = path
+            else:
+                stale.append(media_id)
+
+        for media_id in stale:
+            self.forget(media_id, sync_method, variant)
+        return completed
+
+    def get(self, media_id, sync_method, variant=''):
+        """Путь к готовому файлу или None"""
+        return self.find_completed([media_id], sync_method, variant).get(media_id)
+
+    def forget(self, media_id, sync_method, variant=''):
+        """Удаляет запись из индекса"""
+        try:
+            with self._lock:
+                conn = self._connect()
+                try:
+                    conn.execute('DELETE FROM downloads WHERE media_id = ? AND sync_method = ? '
+                                 'AND variant = ?', (media_id, sync_method, variant))
+                    conn.commit()
+                finally:
+                    conn.close()
+        except (sqlite3.Error, OSError):
+            pass
+
+    def split_completed(self, urls, variants, extract_media_id):
+        """Делит ссылки на новые и готовые, по запросу к индексу на вариант
+
+        variants - список OutputVariant; ссылка готова, когда в индексе есть
+        все ее варианты. Возвращает (список новых ссылок,
+        {ссылка: путь к файлу первого варианта}).
+        """
+        ids = {url: extract_media_id(url) for url in urls}
+        media_ids = list(ids.values())
+        completed = [
+            self.find_completed(media_ids, variant.sync_method, variant.key)
+            for variant in variants
+        ]
+
+        pending = []
+        done = {}
+        for url in urls:
+            paths = [found.get(ids[url]) for found in completed]
+            if paths and all(paths):
+                done[url] = paths[0]
+            else:
+                pending.append(url)
+        return pending, done
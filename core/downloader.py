@@ -16,34 +16,324 @@
 
 """Загрузка файлов"""
 
-import requests
 import os
-from PyQt5.QtWidgets import QApplication
-from config.settings import DOWNLOAD_CHUNK_SIZE, DOWNLOAD_TIMEOUT
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from core.http_session import get_session
+from core.events import ProgressThrottle
+from core.bandwidth import Priority, DownloadCancelled, get_scheduler
+from core.errors import DownloadError, ErrorKind, check_response, classify_error
+from core.resume import PartialDownload, resume_dir_for
+from config.settings import (DOWNLOAD_CHUNK_SIZE, DOWNLOAD_TIMEOUT,
+                             DOWNLOAD_SEGMENTS, DOWNLOAD_SEGMENT_MIN_SIZE,
+                             DOWNLOAD_RETRIES, DOWNLOAD_BACKOFF_BASE, DOWNLOAD_BACKOFF_MAX)
+
+
+class _RangeIgnored(Exception):
+    """Сервер ответил целиком на запрос диапазона"""
 
 
 class FileDownloader:
-    """Класс для загрузки файлов"""
+    """Класс для загрузки файлов
+
+    Все соединения и байты проходят через общий планировщик
+    (core.bandwidth): лимит скорости и соединений к хосту с приоритетами.
+    """
+
+    @staticmethod
+    def download_file(url, filename, desc, progress_callback=None, cancel_event=None,
+                      remote_info=None, priority=Priority.INTERACTIVE):
+        """Скачивает файл с отображением прогресса, докачкой и повторами
+
+        Данные пишутся в .part-файл на файловой системе filename (см.
+        core.resume.resume_dir_for), чтобы готовый файл не копировался;
+        журнал рядом с ним позволяет продолжить загрузку после обрыва или
+        перезапуска.
+        Временные ошибки (сеть, таймаут, 5xx, 429) повторяются с
+        экспоненциальной задержкой. Возвращает True, иначе бросает
+        DownloadError; при установленном cancel_event - с ErrorKind.CANCELLED.
+        remote_info - уже полученный результат get_remote_info.
+        progress_callback вызывается не чаще PROGRESS_UPDATE_HZ раз в секунду.
+        priority - Priority.INTERACTIVE или Priority.BATCH.
+        """
+        if progress_callback is not None:
+            progress_callback = ProgressThrottle(progress_callback)
+
+        with PartialDownload(url, resume_dir_for(filename)) as partial:
+            attempt = 0
+            while True:
+                try:
+                    FileDownloader._transfer(url, partial, desc, progress_callback,
+                                             cancel_event, remote_info, priority)
+                    partial.finish(filename)
+                    return True
+                except Exception as e:
+                    error = classify_error(e)
+
+                if FileDownloader._is_cancelled(cancel_event):
+                    raise DownloadError(ErrorKind.CANCELLED, "загрузка отменена")
+                if error.kind == ErrorKind.CLIENT:
+                    # Ссылка недействительна: докачивать нечего
+                    partial.reset()
+                if not error.retryable or attempt >= DOWNLOAD_RETRIES:
+                    raise error
+                if error.kind == ErrorKind.REMOTE_CHANGED:
+                    partial.reset()
+
+                delay = FileDownloader._backoff_delay(attempt, error.retry_after)
+                attempt += 1
+                # Сведения о файле могли устареть
+                remote_info = None
+                if cancel_event is not None:
+                    if cancel_event.wait(delay):
+                        raise DownloadError(ErrorKind.CANCELLED, "загрузка отменена")
+                else:
+                    time.sleep(delay)
+
+    @staticmethod
+    def _backoff_delay(attempt, retry_after=None):
+        """Экспоненциальная задержка с полным случайным разбросом"""
+        delay = random.uniform(0, min(DOWNLOAD_BACKOFF_MAX, DOWNLOAD_BACKOFF_BASE * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, DOWNLOAD_BACKOFF_MAX))
+        return delay
+
+    @staticmethod
+    def _is_cancelled(cancel_event):
+        return cancel_event is not None and cancel_event.is_set()
 
     @staticmethod
-    def download_file(url, filename, desc, progress_callback=None):
-        """Скачивает файл с отображением прогресса"""
+    def _transfer(url, partial, desc, progress_callback, cancel_event, remote_info, priority):
+        """Одна попытка: продолжает загрузку по журналу или начинает новую"""
+        if remote_info is None:
+            remote_info = FileDownloader.get_remote_info(url, priority)
+        etag = remote_info['etag'] if remote_info else ''
+        size = remote_info['size'] if remote_info else 0
+
+        if partial.ranges and not partial.matches(etag, size):
+            raise DownloadError(ErrorKind.REMOTE_CHANGED, "файл на сервере изменился")
+        if partial.is_complete():
+            return
+
+        if not partial.ranges:
+            total_size = FileDownloader._get_ranged_size(remote_info)
+            if DOWNLOAD_SEGMENTS > 1 and total_size:
+                partial.plan(etag, size, FileDownloader._split_ranges(total_size))
+            else:
+                partial.plan(etag, size, [(0, size - 1 if size else None)])
+
+        if len(partial.ranges) > 1:
+            try:
+                FileDownloader._download_segmented(
+                    url, partial, desc, progress_callback, cancel_event, priority
+                )
+                return
+            except _RangeIgnored:
+                # Откат на обычную загрузку одним потоком
+                partial.plan(etag, size, [(0, size - 1 if size else None)])
+
+        FileDownloader._download_single(
+            url, partial, desc, progress_callback, cancel_event, priority
+        )
+
+    @staticmethod
+    def get_remote_info(url, priority=Priority.INTERACTIVE):
+        """Запрашивает заголовки файла: размер, ETag и поддержку Range
+
+        Возвращает None, если сервер не ответил.
+        """
         try:
-            response = requests.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT)
+            with get_scheduler().connection(url, priority):
+                response = get_session().head(url, allow_redirects=True,
+                                              timeout=DOWNLOAD_TIMEOUT)
             response.raise_for_status()
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded = 0
+        except Exception as e:
+            return None
 
-            with open(filename, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
+        return {
+            'size': int(response.headers.get('content-length', 0)),
+            'etag': response.headers.get('etag', ''),
+            'accept_ranges': 'bytes' in response.headers.get('accept-ranges', '').lower(),
+        }
 
-                        if progress_callback and total_size > 0:
-                            progress = (downloaded / total_size) * 100
-                            progress_callback(desc, progress, downloaded, total_size)
+    @staticmethod
+    def open_stream(url):
+        """Открывает потоковый ответ для чтения по мере загрузки
 
-            return True
-        except Exception as e:
-            return False
\ No newline at end of file
+        Вызывающий код обязан закрыть ответ. Ошибки HTTP - DownloadError.
+        """
+        response = get_session().get(url, stream=True, timeout=DOWNLOAD_TIMEOUT)
+        check_response(response)
+        return response
+
+    @staticmethod
+    def _progress_reporter(partial, desc, progress_callback):
+        """Сообщает общий прогресс файла с учетом уже скачанного ранее"""
+        def report():
+            if progress_callback and partial.size > 0:
+                done = partial.downloaded
+                progress_callback(desc, (done / partial.size) * 100, done, partial.size)
+        return report
+
+    @staticmethod
+    def _download_single(url, partial, desc, progress_callback=None, cancel_event=None,
+                         priority=Priority.INTERACTIVE):
+        """Скачивает (или докачивает) файл одним потоком"""
+        FileDownloader._fetch_range(
+            url, partial, 0, priority, cancel_event,
+            lambda: FileDownloader._is_cancelled(cancel_event),
+            FileDownloader._progress_reporter(partial, desc, progress_callback),
+        )
+
+    @staticmethod
+    def _fetch_range(url, partial, index, priority, cancel_event, is_cancelled, on_data):
+        """Качает диапазон index журнала с места остановки в файл .part"""
+        start, end, done = partial.ranges[index]
+        position = start + done
+        segmented = len(partial.ranges) > 1
+
+        headers = {}
+        if position > 0 or segmented:
+            headers['Range'] = f"bytes={position}-{'' if end is None else end}"
+
+        scheduler = get_scheduler()
+        with scheduler.connection(url, priority, cancel_event):
+            if is_cancelled():
+                raise DownloadCancelled()
+            response = get_session().get(url, headers=headers, stream=True,
+                                         timeout=DOWNLOAD_TIMEOUT)
+            try:
+                check_response(response)
+
+                response_etag = response.headers.get('etag', '')
+                if partial.etag and response_etag and response_etag != partial.etag:
+                    raise DownloadError(ErrorKind.REMOTE_CHANGED, "файл на сервере изменился")
+
+                truncate = False
+                if headers and response.status_code != 206:
+                    # Сервер проигнорировал Range
+                    if segmented:
+                        raise _RangeIgnored()
+                    partial.restart_range(index)
+                    position = start
+                    truncate = True
+                elif headers:
+                    content_range = response.headers.get('content-range', '')
+                    if not content_range.startswith(f"bytes {position}-"):
+                        raise DownloadError(ErrorKind.REMOTE_CHANGED,
+                                            f"сервер вернул другой диапазон: {content_range}")
+
+                if end is None and not segmented:
+                    length = int(response.headers.get('content-length', 0))
+                    if length and position == 0:
+                        end = length - 1
+                        partial.set_total(index, end)
+
+                offset = position
+                chunks = scheduler.throttle(
+                    response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE), priority, cancel_event
+                )
+                with open(partial.part_path, 'r+b') as f:
+                    if truncate:
+                        f.truncate(partial.size)
+                    for chunk in chunks:
+                        if is_cancelled():
+                            raise DownloadCancelled()
+                        if not chunk:
+                            continue
+                        if end is not None and offset + len(chunk) > end + 1:
+                            chunk = chunk[:end + 1 - offset]
+
+                        FileDownloader._write_at(f, chunk, offset)
+                        offset += len(chunk)
+                        partial.advance(index, len(chunk))
+                        on_data()
+                        if end is not None and offset > end:
+                            break
+            finally:
+                response.close()
+
+        if end is None:
+            # Размер не был известен: файл закончился вместе с ответом
+            partial.set_total(index, offset - 1)
+        elif offset <= end:
+            raise DownloadError(ErrorKind.NETWORK,
+                                f"соединение закрыто на {offset} из {end + 1} байт")
+
+    @staticmethod
+    def _get_ranged_size(remote_info):
+        """Возвращает размер файла, если сервер поддерживает Range, иначе 0"""
+        if not remote_info or not remote_info['accept_ranges']:
+            return 0
+
+        total_size = remote_info['size']
+        if total_size < DOWNLOAD_SEGMENT_MIN_SIZE * 2:
+            return 0
+        return total_size
+
+    @staticmethod
+    def _split_ranges(total_size):
+        """Делит файл на диапазоны байтов [start, end]"""
+        segments = min(DOWNLOAD_SEGMENTS, total_size // DOWNLOAD_SEGMENT_MIN_SIZE)
+        segment_size = total_size // segments
+
+        ranges = []
+        for i in range(segments):
+            start = i * segment_size
+            end = total_size - 1 if i == segments - 1 else start + segment_size - 1
+            ranges.append((start, end))
+        return ranges
+
+    @staticmethod
+    def _download_segmented(url, partial, desc, progress_callback=None, cancel_event=None,
+                            priority=Priority.INTERACTIVE):
+        """Качает недокачанные диапазоны журнала параллельными соединениями
+
+        Каждый сегмент занимает отдельное место в лимите соединений хоста.
+        Ошибка одного сегмента останавливает остальные и пробрасывается.
+        """
+        stop_event = threading.Event()
+        errors = []
+        on_data = FileDownloader._progress_reporter(partial, desc, progress_callback)
+
+        def is_cancelled():
+            return stop_event.is_set() or FileDownloader._is_cancelled(cancel_event)
+
+        def fetch_range(index):
+            try:
+                FileDownloader._fetch_range(
+                    url, partial, index, priority, cancel_event, is_cancelled, on_data
+                )
+            except Exception as e:
+                if not stop_event.is_set():
+                    errors.append(e)
+                stop_event.set()
+
+        pending = [index for index, _, _ in partial.pending()]
+        if not pending:
+            return
+        with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+            list(executor.map(fetch_range, pending))
+
+        if errors:
+            raise errors[0]
+        if stop_event.is_set() or not partial.is_complete():
+            raise DownloadCancelled()
+
+    @staticmethod
+    def _write_at(f, data, offset):
+        """Записывает данные по смещению без перемещения общей позиции"""
+        if hasattr(os, 'pwrite'):
+            # pwrite может записать меньше, чем передано: дописываем остаток
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(f.fileno(), view, offset)
+                if written <= 0:
+                    raise OSError("не удалось записать данные в файл")
+                view = view[written:]
+                offset += written
+        else:
+            f.seek(offset)
+            f.write(data)
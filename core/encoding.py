@@ -0,0 +1,180 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Профили перекодирования и распределение ядер между ними"""
+
+import os
+import threading
+from contextlib import contextmanager
+
+from config.settings import ENCODE_PROFILES, ENCODE
+
+# Без перекодирования все потоки копируются
+COPY_ARGS = ['-c', 'copy']
+
+
+def parse_profile(spec):
+    """Разбирает профиль вида 'h265' или 'h265+opus' в кортеж имен
+
+    Пустая строка или 'copy' - без перекодирования (пустой кортеж).
+    Неизвестное имя или два профиля одного потока - ValueError.
+    """
+    if not spec or spec == 'copy':
+        return ()
+
+    names = [name.strip() for name in spec.split('+')]
+    has_video = has_audio = False
+    for name in names:
+        profile = ENCODE_PROFILES.get(name)
+        if profile is None:
+            raise ValueError(f"Неизвестный профиль перекодирования: {name}")
+        if 'VIDEO_CODEC' in profile:
+            if has_video:
+                raise ValueError(f"Два видеопрофиля: {spec}")
+            has_video = True
+        if 'AUDIO_CODEC' in profile:
+            if has_audio:
+                raise ValueError(f"Два аудиопрофиля: {spec}")
+            has_audio = True
+    return tuple(names)
+
+
+def build_codec_args(profile, threads=0, container='mp4'):
+    """Аргументы кодеков ffmpeg для профиля (кортеж из parse_profile)
+
+    threads ограничивает число потоков кодировщика; потоки, для которых
+    в профиле нет кодека, копируются.
+    """
+    if not profile:
+        return list(COPY_ARGS)
+
+    video = ['-c:v', 'copy']
+    audio = ['-c:a', 'copy']
+    for name in profile:
+        settings = ENCODE_PROFILES[name]
+        codec = settings.get('VIDEO_CODEC')
+        if codec:
+            video = ['-c:v', codec]
+            if 'CRF' in settings:
+                video.extend(['-crf', str(settings['CRF'])])
+            if 'PRESET' in settings:
+                video.extend(['-preset', settings['PRESET']])
+            if codec == 'libx265':
+                # x265 берет потоки из своих пулов, -threads на них не влияет
+                params = 'log-level=error'
+                if threads:
+                    params += f':pools={threads}'
+                video.extend(['-x265-params', params])
+                if container in ('mp4', 'mov'):
+                    # Иначе HEVC в MP4 не воспроизводится плеерами Apple
+                    video.extend(['-tag:v', 'hvc1'])
+            if threads:
+                video.extend(['-threads', str(threads)])
+
+        codec = settings.get('AUDIO_CODEC')
+        if codec:
+            audio = ['-c:a', codec]
+            if 'AUDIO_BITRATE' in settings:
+                audio.extend(['-b:a', settings['AUDIO_BITRATE']])
+    return video + audio
+
+
+class EncodeScheduler:
+    """Делит ядра процессора между одновременными перекодированиями
+
+    Одновременно идет не больше max_encodes перекодирований, каждое
+    получает бюджет cores // max_encodes потоков: N процессов ffmpeg
+    не занимают каждый все ядра и не мешают друг другу.
+    """
+
+    def __init__(self, cores=None, max_encodes=None):
+        self._condition = threading.Condition()
+        self._active = 0
+        self.cores = 1
+        self.max_encodes = 1
+        self.configure(cores or ENCODE['CORES'] or os.cpu_count() or 1,
+                       max_encodes or ENCODE['MAX_ENCODES'] or None)
+
+    def configure(self, cores=None, max_encodes=None):
+        """Меняет лимиты; None оставляет прежнее значение
+
+        Без явного max_encodes оно пересчитывается из числа ядер.
+        """
+        with self._condition:
+            if cores is not None:
+                self.cores = max(1, cores)
+            if max_encodes:
+                self.max_encodes = max(1, max_encodes)
+            elif cores is not None:
+                self.max_encodes = max(1, self.cores // max(1, ENCODE['MIN_THREADS']))
+            self._condition.notify_all()
+
+    @property
+    def threads(self):
+        """Бюджет потоков одного перекодирования"""
+        return max(1, self.cores // self.max_encodes)
+
+    def acquire(self):
+        """Ждет свободного места, возвращает бюджет потоков"""
+        with self._condition:
+            while self._active >= self.max_encodes:
+                self._condition.wait()
+            self._active += 1
+            return self.threads
+
+    def try_acquire(self):
+        """Занимает место без ожидания; возвращает бюджет потоков или 0"""
+        with self._condition:
+            if self._active >= self.max_encodes:
+                return 0
+            self._active += 1
+            return self.threads
+
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+    @contextmanager
+    def slot(self):
+        """Занимает место на время перекодирования, отдает бюджет потоков"""
+        threads = self.acquire()
+        try:
+            yield threads
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'active': self._active,
+                'max_encodes': self.max_encodes,
+                'threads': self.threads,
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_encode_scheduler():
+    """Возвращает общий для процесса планировщик перекодирований"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = EncodeScheduler()
+    return _scheduler
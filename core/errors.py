@@ -0,0 +1,114 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Классификация ошибок загрузки"""
+
+from core.bandwidth import DownloadCancelled
+
+
+class ErrorKind:
+    """Виды ошибок загрузки"""
+    NETWORK = 'network'  # соединение не установлено или разорвано
+    TIMEOUT = 'timeout'
+    RATE_LIMITED = 'rate_limited'  # HTTP 429
+    SERVER = 'server'  # HTTP 5xx
+    CLIENT = 'client'  # HTTP 4xx: ссылка недействительна, доступ запрещен
+    REMOTE_CHANGED = 'remote_changed'  # файл на сервере изменился во время докачки
+    DISK = 'disk'  # ошибка записи на диск
+    CANCELLED = 'cancelled'
+    UNKNOWN = 'unknown'
+
+    # Повтор имеет смысл: ошибка может исчезнуть сама
+    RETRYABLE = (NETWORK, TIMEOUT, RATE_LIMITED, SERVER, REMOTE_CHANGED)
+
+
+class DownloadError(Exception):
+    """Ошибка загрузки с видом, HTTP-статусом и подсказкой Retry-After"""
+
+    def __init__(self, kind, message, status=0, retry_after=None):
+        super().__init__(message)
+        self.kind = kind
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        return self.kind in ErrorKind.RETRYABLE
+
+    def to_dict(self):
+        return {
+            'kind': self.kind,
+            'message': str(self),
+            'status': self.status,
+        }
+
+
+def _parse_retry_after(value):
+    """Retry-After в секундах; дата вместо числа не поддерживается"""
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def http_error(response):
+    """DownloadError по ответу с кодом ошибки"""
+    status = response.status_code
+    retry_after = _parse_retry_after(response.headers.get('retry-after'))
+
+    if status == 429:
+        return DownloadError(ErrorKind.RATE_LIMITED, "сервер ограничил частоту запросов (429)",
+                             status, retry_after)
+    if status == 408:
+        return DownloadError(ErrorKind.TIMEOUT, "сервер закрыл запрос по таймауту (408)", status)
+    if status >= 500:
+        return DownloadError(ErrorKind.SERVER, f"ошибка сервера ({status})", status, retry_after)
+    return DownloadError(ErrorKind.CLIENT, f"сервер отклонил запрос ({status})", status)
+
+
+def check_response(response):
+    """Бросает DownloadError, если ответ - ошибка HTTP"""
+    if response.status_code >= 400:
+        response.close()
+        raise http_error(response)
+
+
+def classify_error(error):
+    """Приводит любое исключение загрузки к DownloadError"""
+    if isinstance(error, DownloadError):
+        return error
+    if isinstance(error, DownloadCancelled):
+        return DownloadError(ErrorKind.CANCELLED, "загрузка отменена")
+
+    try:
+        import requests
+    except ImportError:
+        requests = None
+
+    if requests is not None and isinstance(error, requests.RequestException):
+        if isinstance(error, requests.Timeout):
+            return DownloadError(ErrorKind.TIMEOUT, f"таймаут соединения: {error}")
+        if isinstance(error, requests.HTTPError) and error.response is not None:
+            return http_error(error.response)
+        return DownloadError(ErrorKind.NETWORK, f"ошибка сети: {error}")
+
+    if isinstance(error, TimeoutError):
+        return DownloadError(ErrorKind.TIMEOUT, f"таймаут соединения: {error}")
+    if isinstance(error, ConnectionError):
+        return DownloadError(ErrorKind.NETWORK, f"ошибка сети: {error}")
+    if isinstance(error, OSError):
+        return DownloadError(ErrorKind.DISK, f"ошибка записи: {error}")
+    return DownloadError(ErrorKind.UNKNOWN, str(error) or error.__class__.__name__)
@@ -0,0 +1,108 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Шина событий прогресса"""
+
+import threading
+import time
+
+from config.settings import PROGRESS_UPDATE_HZ
+
+
+class ProgressThrottle:
+    """Пропускает обновления прогресса не чаще заданной частоты
+
+    Последнее обновление (100%) передается всегда.
+    """
+
+    def __init__(self, callback, hz=PROGRESS_UPDATE_HZ):
+        self.callback = callback
+        self.interval = 1.0 / hz if hz > 0 else 0.0
+        self._last = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, desc, percent, downloaded, total):
+        now = time.monotonic()
+        with self._lock:
+            if percent < 100 and now - self._last < self.interval:
+                return
+            self._last = now
+        self.callback(desc, percent, downloaded, total)
+
+
+class ProgressBus:
+    """Хранит последнее состояние каждого задания и отдает сводку по запросу
+
+    Публикация только перезаписывает запись задания, поэтому частые
+    обновления схлопываются; потребители (GUI, CLI, метрики) сами
+    опрашивают снимок с нужной им частотой.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._version = 0
+
+    def publish(self, job_id, **fields):
+        """Обновляет поля задания (desc, percent, downloaded, total, stage...)"""
+        with self._lock:
+            state = self._jobs.get(job_id)
+            if state is None:
+                state = self._jobs[job_id] = {}
+            state.update(fields)
+            state['updated_at'] = time.monotonic()
+            self._version += 1
+
+    def progress_callback(self, job_id):
+        """Колбэк прогресса в формате FileDownloader для задания"""
+        def callback(desc, percent, downloaded, total):
+            self.publish(job_id, desc=desc, percent=percent, downloaded=downloaded, total=total)
+        return callback
+
+    def remove(self, job_id):
+        """Удаляет задание из шины"""
+        with self._lock:
+            if self._jobs.pop(job_id, None) is not None:
+                self._version += 1
+
+    @property
+    def version(self):
+        """Номер изменения; растет при каждой публикации"""
+        with self._lock:
+            return self._version
+
+    def snapshot(self, since_version=None):
+        """Снимок всех заданий со сводкой или None, если изменений не было
+
+        Возвращает словарь: version, jobs (job_id -> поля), downloaded,
+        total, percent, active.
+        """
+        with self._lock:
+            if since_version is not None and since_version == self._version:
+                return None
+            jobs = {job_id: dict(state) for job_id, state in self._jobs.items()}
+            version = self._version
+
+        downloaded = sum(state.get('downloaded', 0) for state in jobs.values())
+        total = sum(state.get('total', 0) for state in jobs.values())
+        return {
+            'version': version,
+            'jobs': jobs,
+            'downloaded': downloaded,
+            'total': total,
+            'percent': downloaded * 100 / total if total else 0.0,
+            'active': len(jobs),
+        }
@@ -0,0 +1,225 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Запуск ffmpeg с разбором прогресса и контролем зависаний"""
+
+import contextvars
+import subprocess
+import threading
+import time
+from collections import deque
+
+from core.metrics import record_process
+from config.settings import FFMPEG_STALL_TIMEOUT
+
+# Получатель прогресса ffmpeg для текущего задания: callback(stage, info)
+_progress_sink = contextvars.ContextVar('ffmpeg_progress_sink', default=None)
+
+
+def set_progress_sink(callback):
+    """Назначает получателя прогресса ffmpeg для текущего потока/задачи"""
+    return _progress_sink.set(callback)
+
+
+def reset_progress_sink(token):
+    """Восстанавливает предыдущего получателя прогресса"""
+    _progress_sink.reset(token)
+
+
+def get_progress_sink():
+    """Получатель прогресса ffmpeg текущего задания или None"""
+    return _progress_sink.get()
+
+
+# Конец источника stdin в run_ffmpeg
+_END = object()
+
+
+class FfmpegStallError(subprocess.CalledProcessError):
+    """ffmpeg остановлен: прогресс не менялся дольше допустимого"""
+
+
+def with_progress_args(cmd):
+    """Добавляет в команду ffmpeg машиночитаемый вывод прогресса в stdout"""
+    return [cmd[0], '-progress', 'pipe:1', '-nostats'] + list(cmd[1:])
+
+
+def _parse_time(value):
+    """Разбирает out_time вида 00:01:02.345678"""
+    try:
+        hours, minutes, seconds = value.split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except ValueError:
+        return 0.0
+
+
+class FfmpegProgressParser:
+    """Построчный разбор вывода ffmpeg -progress
+
+    feed() возвращает словарь с out_time (сек), speed (x), total_size
+    (байт), frame и percent, когда блок прогресса завершен, иначе None.
+    """
+
+    def __init__(self, duration=0):
+        self.duration = duration
+        self._block = {}
+
+    def feed(self, line):
+        line = line.strip()
+        if '=' not in line:
+            return None
+
+        key, value = line.split('=', 1)
+        self._block[key] = value
+        if key != 'progress':
+            return None
+
+        block, self._block = self._block, {}
+        out_time = _parse_time(block.get('out_time', '')) if 'out_time' in block else 0.0
+        if not out_time and block.get('out_time_us', 'N/A').isdigit():
+            out_time = int(block['out_time_us']) / 1000000
+
+        speed = block.get('speed', '').rstrip('x').strip()
+        try:
+            speed = float(speed)
+        except ValueError:
+            speed = 0.0
+
+        total_size = block.get('total_size', '0')
+        info = {
+            'out_time': out_time,
+            'speed': speed,
+            'total_size': int(total_size) if total_size.isdigit() else 0,
+            'frame': int(block['frame']) if block.get('frame', '').isdigit() else 0,
+            'percent': 0.0,
+            'done': value == 'end',
+        }
+        if self.duration > 0:
+            info['percent'] = min(out_time / self.duration * 100, 100.0)
+        if info['done']:
+            info['percent'] = 100.0
+        return info
+
+
+def run_ffmpeg(cmd, stage='', duration=0, stall_timeout=None, stdin=None):
+    """Запускает ffmpeg, сообщая прогресс получателю текущего задания
+
+    duration - ожидаемая длительность результата для расчета процента.
+    Если out_time и размер не меняются дольше stall_timeout секунд,
+    процесс убивается и выбрасывается FfmpegStallError. При ненулевом
+    коде возврата выбрасывается subprocess.CalledProcessError.
+    stdin - итерируемый источник байтов для входа pipe:0; он читается
+    до конца, даже если ffmpeg закрыл канал раньше, а его исключение
+    завершает ffmpeg и выбрасывается вместо ошибки процесса. Время, пока
+    источник ждет данных, не считается остановкой ffmpeg.
+    """
+    if stall_timeout is None:
+        stall_timeout = FFMPEG_STALL_TIMEOUT
+
+    sink = _progress_sink.get()
+    parser = FfmpegProgressParser(duration)
+    full_cmd = with_progress_args(cmd)
+    stderr_tail = deque(maxlen=20)
+    last_advance = [time.monotonic()]
+    last_position = [None]
+    waiting_input = [False]
+
+    started = time.monotonic()
+    process = subprocess.Popen(full_cmd,
+                               stdin=subprocess.DEVNULL if stdin is None else subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    feed_error = []
+
+    def read_progress():
+        for raw in process.stdout:
+            info = parser.feed(raw.decode('utf-8', errors='replace'))
+            if info is None:
+                continue
+            position = (info['out_time'], info['total_size'])
+            if position != last_position[0]:
+                last_position[0] = position
+                last_advance[0] = time.monotonic()
+            if sink is not None:
+                sink(stage, info)
+
+    def read_stderr():
+        for raw in process.stderr:
+            stderr_tail.append(raw.decode('utf-8', errors='replace'))
+
+    def feed_stdin():
+        pipe_open = True
+        chunks = iter(stdin)
+        try:
+            while True:
+                # Пока вход ждет данных (загрузка, лимит скорости), ffmpeg не завис
+                waiting_input[0] = True
+                try:
+                    chunk = next(chunks, _END)
+                finally:
+                    waiting_input[0] = False
+                    last_advance[0] = time.monotonic()
+                if chunk is _END:
+                    break
+                if not (pipe_open and chunk):
+                    continue
+                try:
+                    process.stdin.write(chunk)
+                except OSError:
+                    # ffmpeg дочитал нужную длительность
+                    pipe_open = False
+        except Exception as e:
+            feed_error.append(e)
+            process.kill()
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    readers = [threading.Thread(target=read_progress, daemon=True),
+               threading.Thread(target=read_stderr, daemon=True)]
+    if stdin is not None:
+        readers.append(threading.Thread(target=feed_stdin, daemon=True))
+    for reader in readers:
+        reader.start()
+
+    stalled = False
+    while True:
+        try:
+            process.wait(timeout=0.5)
+            break
+        except subprocess.TimeoutExpired:
+            if (stall_timeout and not waiting_input[0]
+                    and time.monotonic() - last_advance[0] > stall_timeout):
+                stalled = True
+                process.kill()
+                process.wait()
+                break
+
+    for reader in readers:
+        # После kill потомки процесса могут держать каналы открытыми
+        reader.join(1.0 if stalled else None)
+
+    record_process('ffmpeg', stage, process.returncode, time.monotonic() - started)
+
+    if feed_error:
+        raise feed_error[0]
+    if stalled:
+        raise FfmpegStallError(process.returncode, cmd, stderr=''.join(stderr_tail))
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd,
+                                            stderr=''.join(stderr_tail))
+    return process.returncode
@@ -0,0 +1,200 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Операции с файлами: жесткие ссылки, reflink и копирование"""
+
+import os
+import shutil
+import tempfile
+import threading
+
+from config.settings import WORK_DIR, WORK_DIR_CANDIDATES, WORK_DIR_MIN_FREE
+
+# ioctl FICLONE (Linux): копирование с разделением блоков (btrfs, xfs)
+_FICLONE = 0x40049409
+
+# Место, зарезервированное рабочими каталогами заданий: устройство -> байт
+_reserved = {}
+# Рабочий каталог -> (устройство, байт)
+_work_dirs = {}
+_reserved_lock = threading.Lock()
+
+
+def reflink(src, dst):
+    """Создает reflink-копию файла, возвращает True при успехе"""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        return True
+    except OSError:
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+        return False
+
+
+def link_or_copy(src, dst):
+    """Размещает src по пути dst без копирования данных, если это возможно
+
+    Пробует жесткую ссылку, затем reflink и только потом обычное копирование.
+    Возвращает способ: 'link', 'reflink' или 'copy'.
+    """
+    try:
+        os.link(src, dst)
+        return 'link'
+    except OSError:
+        pass
+
+    if reflink(src, dst):
+        return 'reflink'
+
+    shutil.copy2(src, dst)
+    return 'copy'
+
+
+def _free_space(path):
+    try:
+        return shutil.disk_usage(path).free
+    except OSError:
+        return 0
+
+
+def make_work_dir(prefix="media_", required_bytes=WORK_DIR_MIN_FREE, preferred=(), fallback=()):
+    """Создает рабочий каталог задания
+
+    В режиме WORK_DIR='auto' перебираются каталоги preferred, затем RAM-диски
+    из WORK_DIR_CANDIDATES, затем каталоги fallback (preferred и fallback -
+    например, на файловой системе кэша исходников, создаются при
+    необходимости). Выбирается первый, где свободное место за вычетом
+    зарезервированного другими заданиями не меньше required_bytes; это место
+    резервируется до release_work_dir. Если подходящего нет, используется
+    системный временный каталог.
+    """
+    if WORK_DIR == 'auto':
+        for candidate in preferred:
+            work_dir = _reserve_work_dir(candidate, prefix, required_bytes, create=True)
+            if work_dir:
+                return work_dir
+        for candidate in WORK_DIR_CANDIDATES:
+            work_dir = _reserve_work_dir(candidate, prefix, required_bytes)
+            if work_dir:
+                return work_dir
+        for candidate in fallback:
+            work_dir = _reserve_work_dir(candidate, prefix, required_bytes, create=True)
+            if work_dir:
+                return work_dir
+        return tempfile.mkdtemp(prefix=prefix)
+
+    if WORK_DIR:
+        os.makedirs(WORK_DIR, exist_ok=True)
+        return tempfile.mkdtemp(prefix=prefix, dir=WORK_DIR)
+    return tempfile.mkdtemp(prefix=prefix)
+
+
+def _reserve_work_dir(candidate, prefix, required_bytes, create=False):
+    """Рабочий каталог в candidate с резервом места или None"""
+    try:
+        if create:
+            os.makedirs(candidate, exist_ok=True)
+        if not (os.path.isdir(candidate) and os.access(candidate, os.W_OK)):
+            return None
+        device = os.stat(candidate).st_dev
+        with _reserved_lock:
+            if _free_space(candidate) - _reserved.get(device, 0) < required_bytes:
+                return None
+            work_dir = tempfile.mkdtemp(prefix=prefix, dir=candidate)
+            _reserved[device] = _reserved.get(device, 0) + required_bytes
+            _work_dirs[work_dir] = (device, required_bytes)
+        return work_dir
+    except OSError:
+        return None
+
+
+def release_work_dir(work_dir):
+    """Снимает резерв места рабочего каталога (сам каталог не удаляется)"""
+    with _reserved_lock:
+        device, reserved = _work_dirs.pop(work_dir, (None, 0))
+        if device is not None:
+            _reserved[device] = max(_reserved.get(device, 0) - reserved, 0)
+
+
+def partial_path(path):
+    """Путь для недописанного файла рядом с итоговым (сохраняет расширение)"""
+    base, ext = os.path.splitext(path)
+    return f"{base}.part{ext}"
+
+
+def _copy_file_range(src, dst):
+    """Копирование средствами ядра (copy_file_range), True при успехе"""
+    if not hasattr(os, 'copy_file_range'):
+        return False
+
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            remaining = os.fstat(fsrc.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        return remaining == 0
+    except OSError:
+        return False
+
+
+def finalize_file(src, dst):
+    """Переносит готовый файл на итоговое место
+
+    На одной файловой системе - атомарное переименование без копирования.
+    Иначе файл копируется (reflink, copy_file_range или обычное копирование)
+    во временный файл рядом с dst, который затем атомарно переименовывается.
+    Возвращает способ: 'rename', 'reflink', 'copy_file_range' или 'copy'.
+    """
+    try:
+        os.replace(src, dst)
+        return 'rename'
+    except OSError:
+        pass
+
+    tmp_path = partial_path(dst)
+    try:
+        if reflink(src, tmp_path):
+            method = 'reflink'
+        elif _copy_file_range(src, tmp_path):
+            method = 'copy_file_range'
+        else:
+            shutil.copyfile(src, tmp_path)
+            method = 'copy'
+        shutil.copystat(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    try:
+        os.remove(src)
+    except OSError:
+        pass
+    return method
@@ -0,0 +1,66 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Общий пул HTTP-соединений"""
+
+import threading
+from config.settings import (USER_AGENT, HTTP_POOL_CONNECTIONS,
+                             HTTP_POOL_MAXSIZE, HTTP_MAX_RETRIES)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Возвращает общую для процесса сессию с пулом keep-alive соединений
+
+    Соединения к одному хосту переиспользуются между запросами и заданиями,
+    поэтому TCP/TLS-рукопожатие и разрешение имени выполняются один раз
+    на соединение пула.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _create_session()
+    return _session
+
+
+def close_session():
+    """Закрывает общую сессию и все соединения пула"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def _create_session():
+    """Создает сессию с настроенным пулом соединений"""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    session.headers.update({'User-Agent': USER_AGENT})
+
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=HTTP_MAX_RETRIES,
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
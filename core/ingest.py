@@ -0,0 +1,202 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Загрузка каналов, тегов и разделов: обход постраничных лент API"""
+
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, unquote
+
+from core.api import API
+from core.metadata_cache import get_metadata_cache
+from config.settings import MEDIA_VIEW_URL, METADATA_CACHE, INGEST
+
+
+class SourceKind:
+    """Виды ссылок"""
+    MEDIA = 'media'  # одно видео: coub.com/view/<id>
+    CHANNEL = 'channel'  # coub.com/<канал>
+    TAG = 'tag'  # coub.com/tags/<тег>
+    TIMELINE = 'timeline'  # coub.com/hot, coub.com/explore/<раздел>
+
+    FEEDS = (CHANNEL, TAG, TIMELINE)
+
+
+# Разделы сайта с собственной лентой в API
+_TIMELINE_SECTIONS = ('hot', 'rising', 'fresh', 'random', 'explore')
+# Первые части пути, которые не являются каналами
+_RESERVED_PATHS = ('view', 'tags', 'api', 'embed', 'search', 'community', 'stories',
+                   'account', 'settings', 'notifications', 'bookmarks', 'likes')
+_HOST_RE = re.compile(r'(^|\.)coub\.com$')
+
+
+def parse_source(url):
+    """Определяет вид ссылки: (SourceKind, имя) или None для чужих ссылок
+
+    Для ленты имя - путь относительно API_TIMELINE_URL.
+    """
+    parts = urlsplit(url.strip() if '://' in url else f"https://{url.strip()}")
+    if not _HOST_RE.search(parts.hostname or ''):
+        return None
+
+    segments = [unquote(segment) for segment in parts.path.split('/') if segment]
+    if not segments:
+        return None
+
+    head = segments[0].lower()
+    if head == 'view' and len(segments) > 1:
+        return SourceKind.MEDIA, segments[1]
+    if head == 'tags' and len(segments) > 1:
+        return SourceKind.TAG, f"tag/{segments[1]}"
+    if head in _TIMELINE_SECTIONS:
+        return SourceKind.TIMELINE, '/'.join(segments)
+    if head not in _RESERVED_PATHS and len(segments) == 1:
+        return SourceKind.CHANNEL, f"channel/{segments[0]}"
+    return None
+
+
+def _is_cancelled(cancel_event):
+    return cancel_event is not None and cancel_event.is_set()
+
+
+def is_supported_url(url):
+    """Ссылка на видео или ленту, которую можно загрузить"""
+    return parse_source(url) is not None
+
+
+class FeedIngestor:
+    """Обходит ленты и выдает ссылки на видео по мере получения страниц
+
+    Первая страница сообщает число страниц, после чего следующие
+    запрашиваются параллельно (не больше prefetch одновременно), но
+    выдаются по порядку. Повторы ID отбрасываются, в том числе между
+    разными лентами одного обходчика. Элементы ленты с полными данными
+    сразу попадают в кэш метаданных, чтобы задания не запрашивали API снова.
+    """
+
+    def __init__(self, api=None, prefetch=INGEST['PREFETCH_PAGES'],
+                 per_page=INGEST['PER_PAGE'], max_pages=INGEST['MAX_PAGES'], on_error=None):
+        self.api = api or API()
+        self.prefetch = max(1, prefetch)
+        self.per_page = per_page
+        self.max_pages = max_pages
+        self.on_error = on_error
+        self._seen = set()
+        self._seen_lock = threading.Lock()
+
+    def _report(self, message):
+        if self.on_error:
+            self.on_error(message)
+
+    def mark_seen(self, media_ids):
+        """Исключает ID из выдачи (например, уже стоящие в очереди)"""
+        with self._seen_lock:
+            self._seen.update(media_ids)
+
+    def _fetch_page(self, path, page):
+        return self.api.get_timeline_page(path, page, self.per_page)
+
+    def iter_pages(self, path, cancel_event=None):
+        """Выдает списки элементов ленты по страницам
+
+        При установленном cancel_event обход прекращается, новые страницы
+        не запрашиваются.
+        """
+        if _is_cancelled(cancel_event):
+            return
+        try:
+            first = self._fetch_page(path, 1)
+        except Exception as e:
+            self._report(f"Не удалось получить ленту {path}: {str(e)}")
+            return
+
+        if _is_cancelled(cancel_event):
+            return
+        yield first.get('coubs', [])
+
+        total_pages = first.get('total_pages', 1) or 1
+        if self.max_pages:
+            total_pages = min(total_pages, self.max_pages)
+        if total_pages < 2:
+            return
+
+        next_page = 2
+        futures = deque()
+        with ThreadPoolExecutor(max_workers=self.prefetch) as executor:
+            try:
+                while futures or next_page <= total_pages:
+                    if _is_cancelled(cancel_event):
+                        return
+                    while next_page <= total_pages and len(futures) < self.prefetch:
+                        if _is_cancelled(cancel_event):
+                            return
+                        futures.append((next_page, executor.submit(self._fetch_page, path,
+                                                                   next_page)))
+                        next_page += 1
+
+                    page, future = futures.popleft()
+                    try:
+                        data = future.result()
+                    except Exception as e:
+                        self._report(f"Лента {path}, страница {page}: {str(e)}")
+                        continue
+
+                    if _is_cancelled(cancel_event):
+                        return
+                    yield data.get('coubs', [])
+            finally:
+                for _, future in futures:
+                    future.cancel()
+
+    def _accept(self, item):
+        """Ссылка на видео из элемента ленты или None для повтора"""
+        media_id = item.get('permalink')
+        if not media_id:
+            return None
+
+        with self._seen_lock:
+            if media_id in self._seen:
+                return None
+            self._seen.add(media_id)
+
+        if METADATA_CACHE['ENABLED'] and 'file_versions' in item:
+            try:
+                get_metadata_cache().put(media_id, item)
+            except (TypeError, ValueError) as e:
+                # Элемент не сериализуется в JSON: задание запросит API само
+                self._report(f"Видео {media_id} не сохранено в кэш: {str(e)}")
+        return f"{MEDIA_VIEW_URL}{media_id}"
+
+    def iter_batches(self, url, cancel_event=None):
+        """Выдает списки новых ссылок на видео, по одному на страницу ленты"""
+        source = parse_source(url)
+        if source is None:
+            self._report(f"Неподдерживаемая ссылка: {url}")
+            return
+
+        kind, name = source
+        if kind == SourceKind.MEDIA:
+            media_url = self._accept({'permalink': name})
+            if media_url:
+                yield [media_url]
+            return
+
+        for items in self.iter_pages(name, cancel_event):
+            batch = [media_url for media_url in map(self._accept, items) if media_url]
+            if batch:
+                yield batch
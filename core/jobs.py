@@ -0,0 +1,221 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Очередь заданий на загрузку"""
+
+import threading
+import time
+from collections import deque
+
+from core.bandwidth import Priority
+
+
+class JobState:
+    """Состояния задания"""
+    QUEUED = 'queued'
+    DOWNLOADING = 'downloading'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    ALL = (QUEUED, DOWNLOADING, PROCESSING, DONE, FAILED)
+    FINAL = (DONE, FAILED)
+
+
+class Job:
+    """Задание на загрузку одного видео"""
+
+    def __init__(self, job_id, url, priority=Priority.BATCH, quality_policy=None):
+        self.job_id = job_id
+        self.url = url
+        self.priority = priority
+        # QualityPolicy пакета; None - политика из настроек
+        self.quality_policy = quality_policy
+        self.state = JobState.QUEUED
+        self.result_path = ''
+        self.error = ''
+        self.downloaded = 0
+        self.total = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        """Возвращает задание в виде словаря"""
+        return {
+            'job_id': self.job_id,
+            'url': self.url,
+            'priority': self.priority,
+            'quality_policy': self.quality_policy.to_dict() if self.quality_policy else None,
+            'state': self.state,
+            'result_path': self.result_path,
+            'error': self.error,
+            'downloaded': self.downloaded,
+            'total': self.total,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobQueue:
+    """Потокобезопасная очередь заданий со статистикой"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Ожидание новых заданий, пока источники еще добавляют ссылки
+        self._changed = threading.Condition(self._lock)
+        self._producers = 0
+        self._jobs = {}
+        self._pending = deque()
+        self._next_id = 1
+        self._started_at = None
+
+    def add_urls(self, urls, priority=Priority.BATCH, quality_policy=None):
+        """Добавляет ссылки в очередь, возвращает созданные задания
+
+        Интерактивные задания встают впереди пакетных; quality_policy
+        задает выбор качества для всех заданий пакета.
+        """
+        created = []
+        with self._lock:
+            for url in urls:
+                job = Job(self._next_id, url, priority, quality_policy)
+                self._next_id += 1
+                self._jobs[job.job_id] = job
+                created.append(job)
+
+            if priority == Priority.INTERACTIVE:
+                # После уже ожидающих интерактивных, в исходном порядке
+                position = 0
+                while (position < len(self._pending)
+                       and self._jobs[self._pending[position]].priority == Priority.INTERACTIVE):
+                    position += 1
+                for offset, job in enumerate(created):
+                    self._pending.insert(position + offset, job.job_id)
+            else:
+                self._pending.extend(job.job_id for job in created)
+            self._changed.notify_all()
+        return created
+
+    def add_producer(self):
+        """Регистрирует источник, который еще будет добавлять ссылки"""
+        with self._lock:
+            self._producers += 1
+
+    def producer_done(self):
+        """Источник закончил добавлять ссылки"""
+        with self._lock:
+            self._producers = max(self._producers - 1, 0)
+            self._changed.notify_all()
+
+    def is_producing(self):
+        """Есть ли источники, которые еще добавляют ссылки"""
+        with self._lock:
+            return self._producers > 0
+
+    def take_next(self, priority=None, wait=False):
+        """Извлекает следующее задание из очереди или возвращает None
+
+        priority - брать задание, только если у первого в очереди такой приоритет.
+        wait=True - ждать новых заданий, пока есть активные источники.
+        """
+        with self._lock:
+            while wait and not self._pending and self._producers > 0:
+                self._changed.wait()
+            if not self._pending:
+                return None
+            if priority is not None and self._jobs[self._pending[0]].priority != priority:
+                return None
+            return self._start(self._pending.popleft())
+
+    def start(self, job_id):
+        """Запускает конкретное задание из очереди"""
+        with self._lock:
+            if job_id in self._pending:
+                self._pending.remove(job_id)
+            return self._start(job_id)
+
+    def _start(self, job_id):
+        job = self._jobs[job_id]
+        job.state = JobState.DOWNLOADING
+        job.started_at = time.monotonic()
+        if self._started_at is None:
+            self._started_at = job.started_at
+        return job
+
+    def get(self, job_id):
+        """Возвращает задание по ID"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        """Возвращает список всех заданий"""
+        with self._lock:
+            return list(self._jobs.values())
+
+    def has_pending(self):
+        """Есть ли задания, ожидающие запуска"""
+        with self._lock:
+            return bool(self._pending)
+
+    def set_state(self, job_id, state, result_path='', error=''):
+        """Обновляет состояние задания"""
+        with self._lock:
+            job = self._jobs[job_id]
+            job.state = state
+            if result_path:
+                job.result_path = result_path
+            if error:
+                job.error = error
+            if state in JobState.FINAL:
+                job.finished_at = time.monotonic()
+
+    def update_progress(self, job_id, downloaded, total):
+        """Обновляет количество загруженных байт задания"""
+        with self._lock:
+            job = self._jobs[job_id]
+            job.downloaded = downloaded
+            job.total = total
+
+    def clear_finished(self):
+        """Удаляет завершенные задания"""
+        with self._lock:
+            for job_id in [j for j, job in self._jobs.items() if job.state in JobState.FINAL]:
+                del self._jobs[job_id]
+            if not self._jobs:
+                self._started_at = None
+
+    def stats(self):
+        """Возвращает сводную статистику по очереди"""
+        with self._lock:
+            counts = {state: 0 for state in JobState.ALL}
+            total_bytes = 0
+            for job in self._jobs.values():
+                counts[job.state] += 1
+                total_bytes += job.downloaded
+
+            elapsed = 0.0
+            if self._started_at is not None:
+                elapsed = time.monotonic() - self._started_at
+
+        finished = counts[JobState.DONE] + counts[JobState.FAILED]
+        return {
+            'total': sum(counts.values()),
+            'counts': counts,
+            'bytes': total_bytes,
+            'elapsed': elapsed,
+            'bytes_per_sec': total_bytes / elapsed if elapsed > 0 else 0.0,
+            'jobs_per_min': finished * 60 / elapsed if elapsed > 0 else 0.0,
+        }
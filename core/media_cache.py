@@ -0,0 +1,170 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Кэш исходных файлов (видео и аудио) с адресацией по содержимому"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from core.fileops import link_or_copy
+from config.settings import CACHE_DIR, MEDIA_CACHE
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_media_cache():
+    """Возвращает общий для процесса кэш исходных файлов"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SourceMediaCache(
+                    os.path.join(CACHE_DIR, 'media'),
+                    max_bytes=MEDIA_CACHE['MAX_BYTES'],
+                )
+    return _cache
+
+
+def make_cache_key(url, etag='', size=0):
+    """Формирует ключ кэша из URL, ETag и размера"""
+    raw = f"{url}\n{etag or ''}\n{size or 0}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class SourceMediaCache:
+    """Каталог загруженных файлов с LRU-вытеснением по суммарному размеру
+
+    Файлы отдаются в рабочий каталог жесткой ссылкой или reflink,
+    поэтому попадание в кэш не копирует данные.
+    """
+
+    def __init__(self, directory, max_bytes=MEDIA_CACHE['MAX_BYTES']):
+        self.directory = directory
+        self.index_path = os.path.join(directory, 'index.sqlite3')
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        """Открывает индекс, при первом вызове создает таблицу"""
+        if not self._initialized:
+            os.makedirs(self.directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        if not self._initialized:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS media (
+                    key TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS media_accessed ON media (accessed_at)')
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def fetch(self, key, dst):
+        """Размещает файл из кэша по пути dst, возвращает True при попадании"""
+        path = self._path(key)
+        try:
+            with self._lock:
+                conn = self._connect()
+                try:
+                    row = conn.execute('SELECT size FROM media WHERE key = ?', (key,)).fetchone()
+                    if row is None:
+                        return False
+
+                    if not os.path.isfile(path) or os.path.getsize(path) != row[0]:
+                        # Файл удален или поврежден
+                        conn.execute('DELETE FROM media WHERE key = ?', (key,))
+                        conn.commit()
+                        self._remove(path)
+                        return False
+
+                    conn.execute('UPDATE media SET accessed_at = ? WHERE key = ?',
+                                 (time.time(), key))
+                    conn.commit()
+                finally:
+                    conn.close()
+
+            link_or_copy(path, dst)
+            return True
+        except (sqlite3.Error, OSError):
+            return False
+
+    def store(self, key, src, url=''):
+        """Добавляет загруженный файл в кэш"""
+        path = self._path(key)
+        try:
+            size = os.path.getsize(src)
+            if self.max_bytes and size > self.max_bytes:
+                return False
+
+            with self._lock:
+                conn = self._connect()
+                try:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                    self._remove(tmp_path)
+                    link_or_copy(src, tmp_path)
+                    os.replace(tmp_path, path)
+
+                    conn.execute(
+                        'INSERT OR REPLACE INTO media (key, url, size, accessed_at) '
+                        'VALUES (?, ?, ?, ?)',
+                        (key, url, size, time.time())
+                    )
+                    conn.commit()
+                    self._evict(conn)
+                finally:
+                    conn.close()
+            return True
+        except (sqlite3.Error, OSError):
+            return False
+
+    def _evict(self, conn):
+        """Удаляет давно не использованные файлы сверх лимита размера"""
+        if not self.max_bytes:
+            return
+
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM media').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = conn.execute('SELECT key, size FROM media ORDER BY accessed_at').fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._remove(self._path(key))
+            conn.execute('DELETE FROM media WHERE key = ?', (key,))
+            total -= size
+        conn.commit()
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
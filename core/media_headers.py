@@ -0,0 +1,383 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Разбор заголовков MP4 и MP3 без запуска ffprobe"""
+
+import mmap
+import os
+import struct
+
+# Контейнеры MP4, внутрь которых нужно заходить
+_MP4_CONTAINERS = {b'moov', b'trak', b'edts', b'mdia', b'minf', b'stbl'}
+
+# Битрейты MP3 (кбит/с): [версия MPEG1?][слой] -> таблица
+_MP3_BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+# Частоты дискретизации по версии MPEG: 3 - MPEG1, 2 - MPEG2, 0 - MPEG2.5
+_MP3_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    0: [11025, 12000, 8000],
+}
+
+
+class Mp4Track:
+    """Дорожка MP4: тип, шкала времени, длительность и число сэмплов"""
+
+    def __init__(self):
+        self.handler = ''
+        self.timescale = 0
+        self.duration_ts = 0
+        self.sample_count = 0
+        self.sample_delta_total = 0
+        self.edits = []  # элементы elst: (длительность в шкале mvhd, media_time, скорость)
+
+    @property
+    def duration(self):
+        """Длительность в секундах по таблице stts, иначе по mdhd"""
+        if not self.timescale:
+            return 0.0
+        if self.sample_delta_total:
+            return self.sample_delta_total / self.timescale
+        return self.duration_ts / self.timescale
+
+
+class Mp4Info:
+    """Сведения из moov: длительность фильма и дорожки"""
+
+    def __init__(self):
+        self.timescale = 0
+        self.duration_ts = 0
+        self.tracks = []
+
+    @property
+    def duration(self):
+        """Длительность контейнера: максимум по дорожкам или mvhd"""
+        durations = [track.duration for track in self.tracks]
+        if durations and max(durations) > 0:
+            return max(durations)
+        if self.timescale:
+            return self.duration_ts / self.timescale
+        return 0.0
+
+    def first_track(self, handler):
+        """Первая дорожка с заданным типом ('vide', 'soun') или None"""
+        for track in self.tracks:
+            if track.handler == handler:
+                return track
+        return None
+
+    @property
+    def video(self):
+        return self.first_track('vide')
+
+    @property
+    def audio(self):
+        return self.first_track('soun')
+
+
+class Mp3Info:
+    """Сведения о потоке MP3"""
+
+    def __init__(self, sample_rate, samples_per_frame, frame_count, bitrate, vbr_header):
+        self.sample_rate = sample_rate
+        self.samples_per_frame = samples_per_frame
+        self.frame_count = frame_count
+        self.bitrate = bitrate
+        self.vbr_header = vbr_header  # 'Xing', 'Info', 'VBRI' или ''
+
+    @property
+    def duration(self):
+        if not self.sample_rate:
+            return 0.0
+        return self.frame_count * self.samples_per_frame / self.sample_rate
+
+
+def _map_file(path):
+    """Открывает файл только для чтения через mmap, возвращает (file, mmap)"""
+    f = open(path, 'rb')
+    try:
+        if os.fstat(f.fileno()).st_size == 0:
+            f.close()
+            return None, None
+        return f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        f.close()
+        return None, None
+
+
+def _iter_boxes(data, start, end):
+    """Перебирает боксы MP4 в диапазоне: (тип, начало данных, конец бокса)"""
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size = struct.unpack_from('>Q', data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+
+        if size < header or pos + size > end:
+            return
+        yield box_type, pos + header, pos + size
+        pos += size
+
+
+def _read_time_header(data, pos):
+    """Читает timescale и duration из mvhd/mdhd"""
+    version = data[pos]
+    if version == 1:
+        return struct.unpack_from('>IQ', data, pos + 20)
+    return struct.unpack_from('>II', data, pos + 12)
+
+
+def _parse_mp4_boxes(data, start, end, info, track):
+    for box_type, body, box_end in _iter_boxes(data, start, end):
+        if box_type == b'trak':
+            track = Mp4Track()
+            info.tracks.append(track)
+            _parse_mp4_boxes(data, body, box_end, info, track)
+        elif box_type in _MP4_CONTAINERS:
+            _parse_mp4_boxes(data, body, box_end, info, track)
+        elif box_type == b'mvhd':
+            info.timescale, info.duration_ts = _read_time_header(data, body)
+        elif track is None:
+            continue
+        elif box_type == b'mdhd':
+            track.timescale, track.duration_ts = _read_time_header(data, body)
+        elif box_type == b'hdlr':
+            track.handler = data[body + 8:body + 12].decode('latin-1')
+        elif box_type == b'elst':
+            version = data[body]
+            entry_count = struct.unpack_from('>I', data, body + 4)[0]
+            entry_format = '>QqhH' if version == 1 else '>IihH'
+            entry_size = struct.calcsize(entry_format)
+            entries = body + 8
+            if entries + entry_count * entry_size > box_end:
+                raise ValueError('elst')
+            for i in range(entry_count):
+                segment, media_time, rate, _ = struct.unpack_from(
+                    entry_format, data, entries + i * entry_size
+                )
+                track.edits.append((segment, media_time, rate))
+        elif box_type == b'stts':
+            entry_count = struct.unpack_from('>I', data, body + 4)[0]
+            entries = body + 8
+            if entries + entry_count * 8 > box_end:
+                raise ValueError('stts')
+            for i in range(entry_count):
+                count, delta = struct.unpack_from('>II', data, entries + i * 8)
+                track.sample_count += count
+                track.sample_delta_total += count * delta
+
+
+def _has_edits(info, track):
+    """Меняет ли список правок (elst) воспроизводимую часть дорожки
+
+    Тривиальный список - одна правка с начала дорожки на всю ее длину.
+    Сдвиг, пустая правка (задержка), обрезка или несколько правок меняют
+    длительность и временные метки, их учитывает только ffprobe.
+    """
+    if not track.edits:
+        return False
+    if len(track.edits) > 1:
+        return True
+
+    segment, media_time, rate = track.edits[0]
+    if media_time != 0 or rate != 1:
+        return True
+    if not (segment and info.timescale and track.duration):
+        return False
+    # Расхождение меньше одного сэмпла - округление длительности
+    sample = track.duration / track.sample_count if track.sample_count else 0
+    tolerance = max(sample, 1 / info.timescale)
+    return abs(segment / info.timescale - track.duration) > tolerance
+
+
+def parse_mp4(path):
+    """Разбирает moov файла MP4, возвращает Mp4Info или None
+
+    None и при нетривиальном списке правок (elst): тогда длительность
+    нужно брать из ffprobe.
+    """
+    f, data = _map_file(path)
+    if data is None:
+        return None
+
+    try:
+        for box_type, body, box_end in _iter_boxes(data, 0, len(data)):
+            if box_type == b'moov':
+                info = Mp4Info()
+                _parse_mp4_boxes(data, body, box_end, info, None)
+                if any(_has_edits(info, track) for track in info.tracks):
+                    return None
+                return info
+        return None
+    except (struct.error, ValueError, IndexError):
+        return None
+    finally:
+        data.close()
+        f.close()
+
+
+def _parse_mp3_frame_header(data, pos):
+    """Разбирает заголовок кадра MP3: (частота, сэмплов в кадре, битрейт, длина кадра)"""
+    if pos + 4 > len(data):
+        return None
+    b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+    if data[pos] != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+
+    version = (b1 >> 3) & 0x03  # 3 - MPEG1, 2 - MPEG2, 0 - MPEG2.5
+    layer = 4 - ((b1 >> 1) & 0x03)  # 1, 2, 3
+    bitrate_index = (b2 >> 4) & 0x0F
+    rate_index = (b2 >> 2) & 0x03
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    mpeg1 = version == 3
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+    bitrate = _MP3_BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    padding = (b2 >> 1) & 0x01
+
+    if layer == 1:
+        samples = 384
+        frame_length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 2 or mpeg1:
+        samples = 1152
+        frame_length = 144 * bitrate // sample_rate + padding
+    else:
+        samples = 576
+        frame_length = 72 * bitrate // sample_rate + padding
+
+    mono = (b3 >> 6) & 0x03 == 3
+    return sample_rate, samples, bitrate, frame_length, mpeg1, mono
+
+
+def _skip_id3v2(data):
+    """Возвращает смещение после тега ID3v2"""
+    if len(data) >= 10 and data[:3] == b'ID3':
+        size = 0
+        for byte in data[6:10]:
+            size = (size << 7) | (byte & 0x7F)
+        footer = 10 if data[5] & 0x10 else 0
+        return 10 + size + footer
+    return 0
+
+
+def _find_mp3_sync(data, pos, limit=64 * 1024):
+    """Ищет первый корректный заголовок кадра, за которым следует еще один"""
+    end = min(len(data), pos + limit)
+    while pos < end:
+        pos = data.find(b'\xFF', pos, end)
+        if pos < 0:
+            return -1
+        header = _parse_mp3_frame_header(data, pos)
+        if header is not None:
+            next_pos = pos + header[3]
+            if next_pos >= len(data) or _parse_mp3_frame_header(data, next_pos) is not None:
+                return pos
+        pos += 1
+    return -1
+
+
+def parse_mp3_bytes(data, total_size=None):
+    """Разбирает MP3 по его началу (Xing/Info/VBRI или CBR)
+
+    total_size - размер всего файла, если data - только его начало. Без
+    VBR-заголовка кадры считаются по заголовкам, что требует файла
+    целиком: по размеру нельзя отличить аудио от тегов в конце (ID3v1,
+    APE), поэтому для начала файла возвращается None - длительность
+    определит ffprobe.
+    Возвращает Mp3Info или None.
+    """
+    pos = _find_mp3_sync(data, _skip_id3v2(data))
+    if pos < 0:
+        return None
+
+    sample_rate, samples, bitrate, frame_length, mpeg1, mono = _parse_mp3_frame_header(data, pos)
+
+    # Xing/Info после side info
+    if mpeg1:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    xing = pos + 4 + side_info
+    tag = bytes(data[xing:xing + 4])
+    if tag in (b'Xing', b'Info') and xing + 12 <= len(data):
+        flags = struct.unpack_from('>I', data, xing + 4)[0]
+        if flags & 0x01:
+            frames = struct.unpack_from('>I', data, xing + 8)[0]
+            return Mp3Info(sample_rate, samples, frames, bitrate, tag.decode('ascii'))
+
+    # VBRI всегда на смещении 32 от заголовка
+    vbri = pos + 4 + 32
+    if bytes(data[vbri:vbri + 4]) == b'VBRI' and vbri + 18 <= len(data):
+        frames = struct.unpack_from('>I', data, vbri + 14)[0]
+        return Mp3Info(sample_rate, samples, frames, bitrate, 'VBRI')
+
+    if total_size is not None and total_size > len(data):
+        return None
+
+    # Полный файл: считаем кадры по заголовкам, теги в конце их не содержат
+    frames = 0
+    while pos < len(data):
+        header = _parse_mp3_frame_header(data, pos)
+        if header is None or header[3] <= 0:
+            break
+        frames += 1
+        pos += header[3]
+    return Mp3Info(sample_rate, samples, frames, bitrate, '')
+
+
+def parse_mp3(path):
+    """Разбирает файл MP3, возвращает Mp3Info или None"""
+    f, data = _map_file(path)
+    if data is None:
+        return None
+
+    try:
+        return parse_mp3_bytes(data)
+    except (struct.error, ValueError, IndexError):
+        return None
+    finally:
+        data.close()
+        f.close()
+
+
+def parse_duration(path):
+    """Длительность по заголовкам файла или 0, если формат не распознан"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.mp4', '.m4a', '.m4v', '.mov'):
+        info = parse_mp4(path)
+    elif ext == '.mp3':
+        info = parse_mp3(path)
+    else:
+        return 0
+
+    if info is None:
+        return 0
+    return info.duration
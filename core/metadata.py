@@ -16,49 +16,52 @@
 
 """Работа с метаданными видео"""
 
-import subprocess
 import re
 import os
 
+from core.variants import container_args
+from core.encoding import COPY_ARGS
+
 
 class MetadataHandler:
     """Класс для работы с метаданными"""
 
     @staticmethod
-    def add_universal_metadata(input_path, output_path, media_title, tags_list, music_data=None):
-        """Добавляет универсальные метаданные, совместимые с Windows и Linux"""
+    def build_metadata_cmd(input_path, output_path, media_title, tags_list, music_data=None,
+                           codec_args=None):
+        """Команда ffmpeg для записи метаданных
+
+        codec_args - аргументы перекодирования (см. core.encoding),
+        по умолчанию потоки копируются.
+        """
+        cmd = ['ffmpeg', '-i', input_path]
+        cmd.extend(codec_args or COPY_ARGS)
+        cmd.extend(MetadataHandler.build_metadata_args(media_title, tags_list, music_data))
+        cmd.extend(container_args(output_path))
+        cmd.extend(['-y', output_path])
+        return cmd
+
+    @staticmethod
+    def build_metadata_args(media_title, tags_list, music_data=None):
+        """Формирует аргументы ffmpeg с метаданными"""
         # Формируем строку тегов
         tags_str = MetadataHandler._format_tags(tags_list)
 
         # Формируем основной заголовок
         main_title = MetadataHandler._format_main_title(media_title, music_data)
 
-        try:
-            cmd = [
-                'ffmpeg', '-i', input_path,
-                '-c', 'copy',
-                '-metadata', f'title={main_title[:200]}',
-            ]
-
-            if tags_str:
-                cmd.extend(['-metadata', f'comment=Tags: {tags_str[:500]}'])
+        args = ['-metadata', f'title={main_title[:200]}']
 
-            cmd.extend(['-metadata', f'description=CVideo: {media_title[:200]}'])
+        if tags_str:
+            args.extend(['-metadata', f'comment=Tags: {tags_str[:500]}'])
 
-            if music_data:
-                MetadataHandler._add_music_metadata(cmd, music_data)
+        args.extend(['-metadata', f'description=CVideo: {media_title[:200]}'])
 
-            cmd.extend([
-                '-metadata', 'encoder=ffmpeg',
-                '-movflags', '+faststart',
-                '-brand', 'mp42',
-                '-y', output_path
-            ])
+        if music_data:
+            MetadataHandler._add_music_metadata(args, music_data)
 
-            subprocess.run(cmd, check=True, capture_output=True, text=True)
-            return True
-        except Exception as e:
-            return False
+        args.extend(['-metadata', 'encoder=ffmpeg'])
+        return args
 
     @staticmethod
     def _format_tags(tags_list):
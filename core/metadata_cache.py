@@ -0,0 +1,194 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Кэш метаданных API на диске"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config.settings import CACHE_DIR, METADATA_CACHE
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_metadata_cache():
+    """Возвращает общий для процесса кэш метаданных"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = MetadataCache(
+                    os.path.join(CACHE_DIR, 'metadata.sqlite3'),
+                    ttl=METADATA_CACHE['TTL'],
+                    max_entries=METADATA_CACHE['MAX_ENTRIES'],
+                )
+    return _cache
+
+
+class MetadataCache:
+    """SQLite-кэш ответов API с TTL и вытеснением давно не использованных записей
+
+    У каждого потока свое соединение. Записи сверх max_entries удаляются
+    пачкой с запасом (EVICT_FRACTION от лимита), поэтому вытеснение
+    выполняется не при каждой записи.
+    """
+
+    EVICT_FRACTION = 0.1
+
+    def __init__(self, path, ttl=METADATA_CACHE['TTL'], max_entries=METADATA_CACHE['MAX_ENTRIES']):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._initialized = False
+        # Оценка числа записей сверху; None - еще не считали
+        self._entries = None
+
+    def _connect(self):
+        """Соединение текущего потока, при первом вызове создает таблицу"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+
+        with self._lock:
+            if not self._initialized:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+
+            conn = sqlite3.connect(self.path, timeout=30)
+            if not self._initialized:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS media_info (
+                        media_id TEXT PRIMARY KEY,
+                        data TEXT NOT NULL,
+                        fetched_at REAL NOT NULL,
+                        accessed_at REAL NOT NULL
+                    )
+                ''')
+                conn.execute('CREATE INDEX IF NOT EXISTS media_info_accessed '
+                             'ON media_info (accessed_at)')
+                conn.commit()
+                self._initialized = True
+        self._local.conn = conn
+        return conn
+
+    def _close(self):
+        """Закрывает соединение текущего потока (например, после ошибки)"""
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def get(self, media_id):
+        """Возвращает сохраненный JSON или None, если записи нет или она устарела"""
+        now = time.time()
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                'SELECT data, fetched_at FROM media_info WHERE media_id = ?',
+                (media_id,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            data, fetched_at = row
+            if self.ttl and now - fetched_at > self.ttl:
+                conn.execute('DELETE FROM media_info WHERE media_id = ?', (media_id,))
+                conn.commit()
+                return None
+
+            conn.execute('UPDATE media_info SET accessed_at = ? WHERE media_id = ?',
+                         (now, media_id))
+            conn.commit()
+            return json.loads(data)
+        except sqlite3.Error:
+            self._close()
+            return None
+        except (OSError, ValueError):
+            return None
+
+    def put(self, media_id, data):
+        """Сохраняет JSON, при превышении лимита вытесняет старые записи"""
+        now = time.time()
+        try:
+            conn = self._connect()
+            conn.execute(
+                'INSERT OR REPLACE INTO media_info '
+                '(media_id, data, fetched_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (media_id, json.dumps(data, ensure_ascii=False), now, now)
+            )
+            conn.commit()
+            if self.max_entries:
+                self._evict(conn)
+            return True
+        except sqlite3.Error:
+            self._close()
+            return False
+        except OSError:
+            return False
+
+    def _evict(self, conn):
+        """Удаляет давно не использованные записи, если их больше лимита"""
+        with self._lock:
+            if self._entries is not None:
+                self._entries += 1
+                if self._entries <= self.max_entries:
+                    return
+
+            # Оценка превысила лимит: считаем точно
+            count = conn.execute('SELECT COUNT(*) FROM media_info').fetchone()[0]
+            excess = count - self.max_entries
+            if excess > 0:
+                excess += int(self.max_entries * self.EVICT_FRACTION)
+                conn.execute(
+                    'DELETE FROM media_info WHERE media_id IN ('
+                    'SELECT media_id FROM media_info ORDER BY accessed_at LIMIT ?)',
+                    (excess,)
+                )
+                conn.commit()
+                count = max(count - excess, 0)
+            self._entries = count
+
+    def invalidate(self, media_id):
+        """Удаляет запись из кэша"""
+        try:
+            conn = self._connect()
+            conn.execute('DELETE FROM media_info WHERE media_id = ?', (media_id,))
+            conn.commit()
+        except sqlite3.Error:
+            self._close()
+        except OSError:
+            pass
+
+    def clear(self):
+        """Очищает кэш"""
+        try:
+            conn = self._connect()
+            conn.execute('DELETE FROM media_info')
+            conn.commit()
+            with self._lock:
+                self._entries = 0
+        except sqlite3.Error:
+            self._close()
+        except OSError:
+            pass
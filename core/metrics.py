@@ -0,0 +1,255 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Замеры этапов заданий и экспорт метрик"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from config.settings import METRICS
+
+# Запись текущего задания: в нее попадают запуски ffmpeg/ffprobe
+_current_record = contextvars.ContextVar('job_record', default=None)
+
+
+def set_current_record(record):
+    """Делает запись текущей для потока/задачи, возвращает токен"""
+    return _current_record.set(record)
+
+
+def reset_current_record(token):
+    _current_record.reset(token)
+
+
+def record_process(tool, stage, returncode, duration):
+    """Учитывает запуск внешнего процесса в записи текущего задания"""
+    record = _current_record.get()
+    if record is not None:
+        record.add_process(tool, stage, returncode, duration)
+
+
+class JobRecord:
+    """Замеры одного задания: этапы и запуски ffmpeg/ffprobe"""
+
+    def __init__(self, url):
+        self.url = url
+        self.media_id = ''
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.success = False
+        self.spans = []
+        self.processes = []
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage, **fields):
+        """Замеряет этап; в полученный словарь можно дописать bytes и т.п."""
+        span = {'stage': stage, 'bytes': 0}
+        span.update(fields)
+        start = time.monotonic()
+        span['offset'] = round(start - self._started, 6)
+        try:
+            yield span
+        finally:
+            span['duration'] = round(time.monotonic() - start, 6)
+            with self._lock:
+                self.spans.append(span)
+
+    def add_process(self, tool, stage, returncode, duration):
+        with self._lock:
+            self.processes.append({
+                'tool': tool,
+                'stage': stage,
+                'returncode': returncode,
+                'duration': round(duration, 6),
+            })
+
+    def finish(self, success):
+        self.success = success
+        self.duration = round(time.monotonic() - self._started, 6)
+
+    def stage_durations(self):
+        """Суммарная длительность по этапам"""
+        durations = defaultdict(float)
+        with self._lock:
+            for span in self.spans:
+                durations[span['stage']] += span['duration']
+        return {stage: round(value, 6) for stage, value in durations.items()}
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'url': self.url,
+                'media_id': self.media_id,
+                'started_at': self.started_at,
+                'duration': self.duration,
+                'success': self.success,
+                'spans': list(self.spans),
+                'processes': list(self.processes),
+            }
+
+
+_collector = None
+_collector_lock = threading.Lock()
+
+
+def get_metrics():
+    """Возвращает общий для процесса сборщик метрик"""
+    global _collector
+    if _collector is None:
+        with _collector_lock:
+            if _collector is None:
+                _collector = MetricsCollector(
+                    jsonl_path=METRICS['JSONL_PATH'],
+                    prometheus_path=METRICS['PROMETHEUS_PATH'],
+                )
+    return _collector
+
+
+def _quantile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(q * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class MetricsCollector:
+    """Собирает записи заданий, пишет JSON Lines и textfile для Prometheus
+
+    Для квантилей хранятся последние METRICS['WINDOW'] замеров каждого этапа.
+    """
+
+    def __init__(self, jsonl_path='', prometheus_path='', window=METRICS['WINDOW']):
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self._lock = threading.Lock()
+        self._stage_durations = defaultdict(lambda: deque(maxlen=window))
+        self._stage_totals = defaultdict(lambda: [0, 0.0, 0])  # count, seconds, bytes
+        self._process_counts = defaultdict(int)  # (tool, stage, ok) -> count
+        self._process_seconds = defaultdict(float)  # (tool, stage) -> seconds
+        self._jobs = defaultdict(int)  # success -> count
+        self._job_durations = deque(maxlen=window)
+        self._job_seconds = 0.0
+
+    def add(self, record):
+        """Учитывает завершенное задание и дописывает его в JSON Lines"""
+        data = record.to_dict()
+        with self._lock:
+            self._jobs[data['success']] += 1
+            self._job_durations.append(data['duration'])
+            self._job_seconds += data['duration']
+            for span in data['spans']:
+                self._stage_durations[span['stage']].append(span['duration'])
+                totals = self._stage_totals[span['stage']]
+                totals[0] += 1
+                totals[1] += span['duration']
+                totals[2] += span.get('bytes', 0)
+            for process in data['processes']:
+                key = (process['tool'], process['stage'])
+                self._process_counts[key + (process['returncode'] == 0,)] += 1
+                self._process_seconds[key] += process['duration']
+
+            if self.jsonl_path:
+                with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(data, ensure_ascii=False) + '\n')
+
+    def stage_summary(self):
+        """p50/p95 и суммы по этапам"""
+        with self._lock:
+            summary = {}
+            for stage, values in self._stage_durations.items():
+                ordered = sorted(values)
+                count, seconds, bytes_moved = self._stage_totals[stage]
+                summary[stage] = {
+                    'count': count,
+                    'sum': seconds,
+                    'bytes': bytes_moved,
+                    'p50': _quantile(ordered, 0.5),
+                    'p95': _quantile(ordered, 0.95),
+                }
+            return summary
+
+    def write_prometheus(self, path=None):
+        """Записывает метрики в формате textfile collector (атомарно)"""
+        path = path or self.prometheus_path
+        if not path:
+            return False
+
+        summary = self.stage_summary()
+        lines = [
+            '# HELP loader_stage_duration_seconds Длительность этапов задания',
+            '# TYPE loader_stage_duration_seconds summary',
+        ]
+        for stage, values in sorted(summary.items()):
+            for quantile in ('0.5', '0.95'):
+                key = 'p50' if quantile == '0.5' else 'p95'
+                lines.append(f'loader_stage_duration_seconds{{stage="{stage}",'
+                             f'quantile="{quantile}"}} {values[key]:.6f}')
+            lines.append(f'loader_stage_duration_seconds_sum{{stage="{stage}"}} '
+                         f'{values["sum"]:.6f}')
+            lines.append(f'loader_stage_duration_seconds_count{{stage="{stage}"}} '
+                         f'{values["count"]}')
+
+        lines.append('# HELP loader_stage_bytes_total Байт передано или записано на этапе')
+        lines.append('# TYPE loader_stage_bytes_total counter')
+        for stage, values in sorted(summary.items()):
+            lines.append(f'loader_stage_bytes_total{{stage="{stage}"}} {values["bytes"]}')
+
+        with self._lock:
+            process_counts = dict(self._process_counts)
+            process_seconds = dict(self._process_seconds)
+            jobs = dict(self._jobs)
+            job_durations = sorted(self._job_durations)
+            job_seconds = self._job_seconds
+
+        lines.append('# HELP loader_process_runs_total Запуски ffmpeg/ffprobe')
+        lines.append('# TYPE loader_process_runs_total counter')
+        for (tool, stage, ok), count in sorted(process_counts.items()):
+            result = 'ok' if ok else 'error'
+            lines.append(f'loader_process_runs_total{{tool="{tool}",stage="{stage}",'
+                         f'result="{result}"}} {count}')
+
+        lines.append('# HELP loader_process_seconds_total Время работы ffmpeg/ffprobe')
+        lines.append('# TYPE loader_process_seconds_total counter')
+        for (tool, stage), seconds in sorted(process_seconds.items()):
+            lines.append(f'loader_process_seconds_total{{tool="{tool}",stage="{stage}"}} '
+                         f'{seconds:.6f}')
+
+        lines.append('# HELP loader_jobs_total Завершенные задания')
+        lines.append('# TYPE loader_jobs_total counter')
+        for success, count in sorted(jobs.items()):
+            result = 'done' if success else 'failed'
+            lines.append(f'loader_jobs_total{{result="{result}"}} {count}')
+
+        lines.append('# HELP loader_job_duration_seconds Длительность задания')
+        lines.append('# TYPE loader_job_duration_seconds summary')
+        for quantile in (0.5, 0.95):
+            lines.append(f'loader_job_duration_seconds{{quantile="{quantile}"}} '
+                         f'{_quantile(job_durations, quantile):.6f}')
+        lines.append(f'loader_job_duration_seconds_sum {job_seconds:.6f}')
+        lines.append(f'loader_job_duration_seconds_count {sum(jobs.values())}')
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+        return True
@@ -0,0 +1,809 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Конвейер обработки видео"""
+
+import itertools
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from core.api import API
+from core.downloader import FileDownloader
+from core.video_processor import VideoProcessor
+from core.metadata import MetadataHandler
+from core.utils import sanitize_filename
+from core.jobs import JobState
+from core.media_cache import get_media_cache, make_cache_key
+from core.media_headers import parse_mp3_bytes
+from core.events import ProgressThrottle
+from core.bandwidth import Priority, get_scheduler
+from core.errors import DownloadError, classify_error
+from core.ffmpeg_runner import set_progress_sink, reset_progress_sink, run_ffmpeg
+from core.metrics import JobRecord, get_metrics, set_current_record, reset_current_record
+from core.fileops import make_work_dir, release_work_dir, partial_path, finalize_file
+from core.download_index import get_download_index
+from core.variants import OutputVariant, VideoSource, unique_variants
+from core.encoding import build_codec_args, get_encode_scheduler
+from core.quality import QualityPolicy, version_sizes, fetch_sizes
+from core.steps import Call, Ffmpeg, Duration, AcquireEncoder, Parallel, run_steps
+from config.settings import (QUALITY_SETTINGS, MEDIA_CACHE, DOWNLOAD_CHUNK_SIZE, DOWNLOAD_INDEX,
+                             WORK_DIR_PREFER_CACHE, WORK_DIR_MIN_FREE, WORK_DIR_SIZE_FACTOR)
+
+
+class MediaPipeline:
+    """Конвейер API → загрузка → цикл → синхронизация → метаданные
+
+    Не зависит от Qt: о ходе работы сообщает через необязательные колбэки.
+    """
+
+    def __init__(self, sync_method, enable_loop_detection=True, output_dir=None,
+                 use_cache=True, stream_audio=None, on_status=None, on_progress=None,
+                 on_error=None, on_stage=None, on_ffmpeg_progress=None, api_base_url=None,
+                 priority=Priority.INTERACTIVE, skip_completed=True, variants=None,
+                 quality_policy=None):
+        self.sync_method = sync_method  # 1 или 2
+        self.enable_loop_detection = enable_loop_detection
+        self.output_dir = output_dir or os.getcwd()
+        self.use_cache = use_cache
+        self.priority = priority  # Priority.INTERACTIVE или Priority.BATCH
+        # Не качать заново то, что есть в индексе готовых загрузок
+        self.skip_completed = skip_completed
+        # Варианты результата (OutputVariant); по умолчанию один с методом sync_method
+        self.variants = unique_variants(variants or [OutputVariant(sync_method)])
+        # Итог последнего задания: {вариант: путь или None}
+        self.outputs = {}
+        # Выбор качества для вариантов без явного качества
+        self.quality_policy = quality_policy or QualityPolicy.from_settings()
+        # Ответы HEAD текущего задания: url -> сведения get_remote_info
+        self._remote_info = {}
+        self.record = JobRecord('')
+        if stream_audio is None:
+            stream_audio = QUALITY_SETTINGS['PROCESSING']['STREAM_AUDIO']
+        self.stream_audio = stream_audio
+
+        self.on_status = on_status
+        self.on_progress = on_progress  # desc, percent, downloaded, total
+        self.on_error = on_error
+        self.on_stage = on_stage  # JobState
+        self.on_ffmpeg_progress = on_ffmpeg_progress  # stage, info (см. FfmpegProgressParser)
+
+        # Инициализация компонентов
+        self.api = API(use_cache=use_cache, base_url=api_base_url)
+        self.downloader = FileDownloader()
+        self.processor = VideoProcessor()
+        self.metadata_handler = MetadataHandler()
+
+    def _status(self, message):
+        if self.on_status:
+            self.on_status(message)
+
+    def _progress(self, desc, percent, downloaded, total):
+        if self.on_progress:
+            self.on_progress(desc, percent, downloaded, total)
+
+    def _error(self, message):
+        if self.on_error:
+            self.on_error(message)
+
+    def _stage(self, state):
+        if self.on_stage:
+            self.on_stage(state)
+
+    def _ffmpeg_progress(self, stage, info):
+        if self.on_ffmpeg_progress:
+            self.on_ffmpeg_progress(stage, info)
+
+    def download_media_high_quality(self, media_url):
+        """Скачивает видео с максимальным качеством и точной синхронизацией
+
+        Собирает все варианты из self.variants: метаданные, загрузки, замеры
+        и зацикленное видео общие, итоговые сборки идут параллельно. Пути
+        к результатам сохраняются в self.outputs; возвращается путь к
+        первому варианту, если готовы все, иначе None.
+        Замеры этапов сохраняются в self.record и передаются в get_metrics().
+        """
+        return run_steps(self.steps(media_url))
+
+    def steps(self, media_url):
+        """Этапы обработки одного видео в виде генератора шагов (см. core.steps)
+
+        Генератор отдает шаги (HTTP-запросы, загрузки, запуски ffmpeg и
+        ffprobe), а получает их результаты; выполняет шаги движок:
+        core.steps.run_steps в текущем потоке или AsyncEngine.run_steps в
+        цикле событий. Итог генератора - как у download_media_high_quality.
+        """
+        self.record = JobRecord(media_url)
+        self.outputs = dict.fromkeys(self.variants)
+        self._remote_info = {}
+        record_token = set_current_record(self.record)
+        result = None
+        try:
+            yield from self._job_steps(media_url, self.outputs)
+            if all(self.outputs.values()):
+                result = self.outputs[self.variants[0]]
+            return result
+        finally:
+            reset_current_record(record_token)
+            self.record.finish(bool(result))
+            try:
+                get_metrics().add(self.record)
+            except OSError:
+                pass
+
+    def _job_steps(self, media_url, outputs):
+        """Шаги одного задания (см. steps); записывает в outputs пути к вариантам"""
+        record = self.record
+        temp_dir = None
+        partial_outputs = []
+        sink_token = set_progress_sink(self._ffmpeg_progress)
+
+        try:
+            media_id = self.api.extract_media_id(media_url)
+            record.media_id = media_id
+            for variant in outputs:
+                existing = yield Call(self._find_completed, media_id, variant)
+                if existing:
+                    self._status(f"Уже скачано: {existing}")
+                    outputs[variant] = existing
+            pending = [variant for variant, path in outputs.items() if not path]
+            if not pending:
+                return
+
+            with record.span('api_fetch'):
+                data = yield Call(self.api.get_media_info, media_id)
+
+            # Извлекаем метаданные
+            metadata = self.api.extract_metadata(data)
+            metadata_args = self.metadata_handler.build_metadata_args(
+                metadata['title'], metadata['tags'], metadata['music']
+            )
+
+            # Вариант с явным качеством, которого у видео нет, не собирается:
+            # иначе в файл и индекс под этим качеством попало бы другое
+            available = self.api.get_video_qualities(data)
+            for variant in pending:
+                if variant.quality and variant.quality not in available:
+                    self._variant_error(f"Нет видео в качестве {variant.quality}", variant)
+            pending = [variant for variant in pending
+                       if not variant.quality or variant.quality in available]
+            if not pending:
+                return
+
+            # Формируем имена файлов
+            targets = {
+                variant: os.path.join(
+                    self.output_dir,
+                    self._generate_filename(media_id, metadata['title'], metadata['music'],
+                                            variant)
+                )
+                for variant in pending
+            }
+            # Результаты пишутся рядом с итоговыми файлами и атомарно переименовываются
+            partial_outputs.extend(partial_path(path) for path in targets.values())
+
+            # Получаем URL для загрузки: видео каждого качества скачивается один раз
+            default_quality = None
+            if any(variant.quality is None for variant in pending):
+                default_quality = yield Call(self._choose_quality, data)
+
+            # Рабочий каталог выбирается, когда известны размеры файлов
+            cache_dirs = self._work_dir_cache_dirs()
+            temp_dir = make_work_dir(
+                required_bytes=self._work_dir_bytes(data, pending, default_quality),
+                preferred=cache_dirs if WORK_DIR_PREFER_CACHE else [],
+                fallback=[] if WORK_DIR_PREFER_CACHE else cache_dirs
+            )
+            self._status(f"Рабочая директория: {temp_dir}")
+            sources = self._plan_sources(data, pending, temp_dir, default_quality)
+            audio_url = self.api.get_audio_url(data)
+            self._status(f"Качество видео: {', '.join(source.quality for source in sources)}")
+
+            # Скачиваем файлы
+            self._stage(JobState.DOWNLOADING)
+            audio_path = os.path.join(temp_dir, 'audio.mp3')
+
+            if (self.stream_audio and QUALITY_SETTINGS['PROCESSING']['SINGLE_PASS']
+                    and len(pending) == 1 and not pending[0].profile):
+                # Аудио подается в ffmpeg прямо во время загрузки
+                variant = pending[0]
+                source = sources[0]
+                final_output = targets[variant]
+                partial_output = partial_path(final_output)
+                with record.span('stream_single_pass') as span:
+                    streamed = yield Call(
+                        self._stream_single_pass, source.url, audio_url, source.path,
+                        audio_path, partial_output, metadata_args, temp_dir,
+                        variant.sync_method, download=True
+                    )
+                    if streamed is True:
+                        span['bytes'] = os.path.getsize(partial_output)
+                if streamed is True:
+                    with record.span('finalize'):
+                        os.replace(partial_output, final_output)
+                    yield Call(self._record_completed, media_id, variant, source.quality,
+                               final_output)
+                    self._status(f"Файл: {os.path.basename(final_output)}")
+                    outputs[variant] = final_output
+                    return
+                if streamed is False:
+                    return
+                # None: оба файла уже на диске, обрабатываем обычным путем
+            else:
+                sources = yield from self._download_steps(
+                    media_id, pending, sources, audio_url, audio_path, temp_dir, default_quality
+                )
+                if sources is None:
+                    return
+
+            self._stage(JobState.PROCESSING)
+
+            # Получаем длительности
+            with record.span('probe'):
+                audio_duration = yield Duration(audio_path)
+                for source in sources:
+                    source.duration = yield Duration(source.path)
+
+            if audio_duration == 0 or any(source.duration == 0 for source in sources):
+                self._error("Не удалось определить длительность файлов")
+                return
+
+            for source in sources:
+                # Определяем точную длительность цикла
+                with record.span('loop_detection'):
+                    source.loop_duration = yield from self.processor.loop_duration_steps(
+                        source.path, temp_dir
+                    )
+
+                # Находим оптимальное количество циклов
+                source.loops = self.processor.find_optimal_loop_count(
+                    audio_duration, source.loop_duration, self.enable_loop_detection
+                )
+
+                if not QUALITY_SETTINGS['PROCESSING']['SINGLE_PASS']:
+                    # Зацикленное видео одно на все варианты этого качества
+                    source.looped_path = os.path.join(temp_dir, f'looped_{source.quality}.mp4')
+                    concat_file = os.path.join(temp_dir, 'concat.txt')
+                    self.processor.write_concat_file(source.path, source.loops, concat_file)
+                    cmd = self.processor.build_concat_cmd(concat_file, source.looped_path)
+                    with record.span('concat') as span:
+                        if not (yield Ffmpeg(cmd, 'concat',
+                                             source.loops * source.loop_duration)):
+                            self._error("Ошибка создания зацикленного видео")
+                            return
+                        span['bytes'] = os.path.getsize(source.looped_path)
+
+            # Итоговые сборки вариантов идут одновременно
+            jobs = [
+                (variant, self._variant_steps(
+                    media_id, variant, source, audio_path, audio_duration, metadata,
+                    metadata_args, targets[variant], temp_dir
+                ))
+                for source in sources for variant in source.variants
+            ]
+            results = yield Parallel(
+                (job for _, job in jobs),
+                max(1, QUALITY_SETTINGS['PROCESSING']['VARIANT_WORKERS'])
+            )
+            for (variant, _), result in zip(jobs, results):
+                if isinstance(result, Exception):
+                    self._variant_error(f"Ошибка обработки: {str(result)}", variant)
+                    result = None
+                outputs[variant] = result
+
+        except Exception as e:
+            self._error(f"Ошибка обработки: {str(e)}")
+        finally:
+            reset_progress_sink(sink_token)
+            for partial_output in partial_outputs:
+                if os.path.exists(partial_output):
+                    os.remove(partial_output)
+            if temp_dir is not None:
+                release_work_dir(temp_dir)
+                if not QUALITY_SETTINGS['PROCESSING']['KEEP_TEMP_FILES']:
+                    try:
+                        shutil.rmtree(temp_dir)
+                    except:
+                        pass
+
+    def _work_dir_bytes(self, data, variants, default_quality=None):
+        """Место для рабочего каталога: исходники задания с запасом
+
+        Размеры берутся из ответа API и HEAD-запросов выбора качества; если
+        какой-то неизвестен, не меньше WORK_DIR_MIN_FREE.
+        """
+        video, (audio_url, audio_size) = version_sizes(data)
+        sizes = dict(video.values())
+        sizes[audio_url] = audio_size
+        urls = {self.api.get_video_urls(data, variant.quality or default_quality)[0]
+                for variant in variants}
+        urls.add(audio_url)
+
+        total = 0
+        known = True
+        for url in urls:
+            size = sizes.get(url) or (self._remote_info.get(url) or {}).get('size', 0)
+            known = known and size > 0
+            total += size
+        required = total * WORK_DIR_SIZE_FACTOR
+        return required if known else max(required, WORK_DIR_MIN_FREE)
+
+    def _work_dir_cache_dirs(self):
+        """Каталоги для рабочего каталога на файловой системе кэша исходников
+
+        Файлы оттуда попадают в кэш жесткими ссылками; с RAM-диска кэш их
+        копирует (link_or_copy).
+        """
+        if not MEDIA_CACHE['ENABLED']:
+            return []
+        return [os.path.join(os.path.dirname(get_media_cache().directory), 'work')]
+
+    def _download_steps(self, media_id, pending, sources, audio_url, audio_path, temp_dir,
+                        default_quality):
+        """Шаги загрузки файлов, итог - источники видео или None при ошибке
+
+        Ссылки из кэша метаданных могли устареть: если загрузка не удалась,
+        ответ API запрашивается заново (он же заменяет запись в кэше), и при
+        новых ссылках загрузка повторяется один раз.
+        """
+        error = yield Call(self._download_files, sources, audio_url, audio_path, download=True)
+        if error and self.api.use_cache:
+            try:
+                with self.record.span('api_refetch'):
+                    data = yield Call(self.api.get_media_info, media_id, False)
+                fresh_sources = self._plan_sources(data, pending, temp_dir, default_quality)
+                fresh_audio_url = self.api.get_audio_url(data)
+            except Exception:
+                fresh_sources = None
+
+            if fresh_sources is not None and (
+                    [source.url for source in fresh_sources] + [fresh_audio_url]
+                    != [source.url for source in sources] + [audio_url]):
+                self._status("Ссылки устарели, повторная загрузка")
+                sources = fresh_sources
+                error = yield Call(self._download_files, sources, fresh_audio_url, audio_path,
+                                   download=True)
+
+        if error:
+            self._error(error)
+            return None
+        return sources
+
+    def _choose_quality(self, data):
+        """Качество видео по политике выбора или None (обычный приоритет)
+
+        Размеры версий берутся из ответа API, недостающие - параллельными
+        HEAD-запросами; их ответы потом идут в ключ кэша исходников.
+        """
+        policy = self.quality_policy
+        if not policy.active:
+            return None
+
+        with self.record.span('quality_select') as span:
+            video, (audio_url, audio_size) = version_sizes(data)
+            priority = QUALITY_SETTINGS['VIDEO_QUALITY']['priority']
+            video = {quality: video[quality] for quality in priority if quality in video}
+
+            # Версии ниже первой подходящей по размеру из API не запрашиваются
+            missing = [] if audio_size else [audio_url]
+            budget = policy.budget()
+            for url, size in video.values():
+                if not size:
+                    missing.append(url)
+                elif audio_size and size + audio_size <= budget:
+                    break
+            if missing:
+                found = fetch_sizes(
+                    missing, lambda url: self.downloader.get_remote_info(url, self.priority)
+                )
+                self._remote_info.update((url, info) for url, info in found.items() if info)
+                span['head_requests'] = len(missing)
+
+            def size_of(url, size):
+                return size or (self._remote_info.get(url) or {}).get('size', 0)
+
+            sizes = {quality: size_of(url, size) for quality, (url, size) in video.items()}
+            audio_size = size_of(audio_url, audio_size)
+            quality = policy.choose(sizes, audio_size)
+            span['quality'] = quality or ''
+            span['planned_bytes'] = sizes.get(quality, 0) + audio_size
+
+        if quality:
+            self._status(f"Качество по бюджету: {quality}, "
+                         f"{span['planned_bytes'] / (1024 * 1024):.1f} MB")
+        return quality
+
+    def _plan_sources(self, data, variants, temp_dir, default_quality=None):
+        """Группирует варианты по видео, чтобы каждое качество скачать один раз
+
+        default_quality - качество для вариантов без явного (см. _choose_quality).
+        """
+        sources = {}
+        for variant in variants:
+            url, quality = self.api.get_video_urls(data, variant.quality or default_quality)
+            if quality not in sources:
+                name = f'video_{quality}.mp4' if sources else 'video.mp4'
+                sources[quality] = VideoSource(url, quality, os.path.join(temp_dir, name))
+            sources[quality].variants.append(variant)
+        return list(sources.values())
+
+    def _variant_error(self, message, variant):
+        """Сообщает об ошибке сборки, при нескольких вариантах - с его названием"""
+        if len(self.variants) > 1:
+            message = f"{message} [{variant}]"
+        self._error(message)
+
+    def _variant_steps(self, media_id, variant, source, audio_path, audio_duration, metadata,
+                       metadata_args, final_output, temp_dir):
+        """Шаги итоговой сборки одного варианта, итог - путь или None
+
+        Вариант с профилем перекодирования ждет места в планировщике
+        перекодирований и получает от него бюджет потоков.
+        """
+        if not variant.profile:
+            return (yield from self._build_variant_steps(
+                media_id, variant, source, audio_path, audio_duration, metadata,
+                metadata_args, final_output, temp_dir
+            ))
+
+        scheduler = get_encode_scheduler()
+        with self.record.span('encode_wait', variant=str(variant)):
+            threads = yield AcquireEncoder(scheduler)
+        try:
+            return (yield from self._build_variant_steps(
+                media_id, variant, source, audio_path, audio_duration, metadata,
+                metadata_args, final_output, temp_dir,
+                build_codec_args(variant.profile, threads, variant.container)
+            ))
+        finally:
+            scheduler.release()
+
+    def _build_variant_steps(self, media_id, variant, source, audio_path, audio_duration,
+                             metadata, metadata_args, final_output, temp_dir, codec_args=None):
+        """Команды ffmpeg сборки варианта (см. _variant_steps)"""
+        record = self.record
+        label = str(variant)
+        partial_output = partial_path(final_output)
+
+        if QUALITY_SETTINGS['PROCESSING']['SINGLE_PASS']:
+            # Зацикливание, синхронизация и метаданные одним проходом
+            cmd = self.processor.build_single_pass_cmd(
+                source.path, audio_path, source.loops, source.loop_duration,
+                audio_duration, partial_output, variant.sync_method, metadata_args,
+                codec_args=codec_args
+            )
+            output_duration = min(source.loops * source.loop_duration, audio_duration)
+            with record.span('single_pass', variant=label) as span:
+                if not (yield Ffmpeg(cmd, 'single_pass', output_duration)):
+                    self._variant_error("Ошибка обработки видео (один проход)", variant)
+                    return None
+                span['bytes'] = os.path.getsize(partial_output)
+
+            with record.span('finalize', variant=label):
+                os.replace(partial_output, final_output)
+            yield Call(self._record_completed, media_id, variant, source.quality, final_output)
+            self._status(f"Файл: {os.path.basename(final_output)}")
+            return final_output
+
+        # Синхронизируем видео и аудио
+        index = self.variants.index(variant)
+        sync_video_no_meta = os.path.join(temp_dir, f'sync_no_meta_{index}.mp4')
+        looped_duration = yield Duration(source.looped_path)
+        cmd = self.processor.build_sync_cmd(
+            variant.sync_method, source.looped_path, audio_path, sync_video_no_meta,
+            looped_duration, audio_duration
+        )
+        output_duration = min(looped_duration, audio_duration)
+        with record.span('sync', variant=label) as span:
+            if not (yield Ffmpeg(cmd, 'sync', output_duration)):
+                self._variant_error(f"Ошибка синхронизации (метод {variant.sync_method})",
+                                    variant)
+                return None
+            span['bytes'] = os.path.getsize(sync_video_no_meta)
+
+        # Добавляем метаданные (и перекодируем, если задан профиль)
+        sync_video_with_meta = os.path.join(temp_dir,
+                                            f'sync_with_meta_{index}.{variant.container}')
+        cmd = self.metadata_handler.build_metadata_cmd(
+            sync_video_no_meta, sync_video_with_meta,
+            metadata['title'], metadata['tags'], metadata['music'], codec_args
+        )
+        with record.span('metadata', variant=label) as span:
+            yield Ffmpeg(cmd, 'metadata', output_duration)
+            if os.path.exists(sync_video_with_meta):
+                span['bytes'] = os.path.getsize(sync_video_with_meta)
+
+        # Копируем результат
+        with record.span('finalize', variant=label) as span:
+            span['method'] = yield Call(finalize_file, sync_video_with_meta, final_output)
+            span['bytes'] = os.path.getsize(final_output)
+        yield Call(self._record_completed, media_id, variant, source.quality, final_output)
+
+        # Финальная информация
+        self._status(f"Файл: {os.path.basename(final_output)}")
+        return final_output
+
+    def _generate_filename(self, media_id, media_title, music_data, variant=None):
+        """Генерирует имя выходного файла"""
+        variant = variant or OutputVariant(self.sync_method)
+        sanitized_title = sanitize_filename(media_title)
+
+        music_info = ""
+        if music_data:
+            music_title = music_data.get('title', '').strip()
+            music_album = music_data.get('album_name', '').strip()
+
+            if music_title and music_album:
+                music_info = f"{music_title}; {music_album}"
+            elif music_title:
+                music_info = music_title
+            elif music_album:
+                music_info = music_album
+
+        if music_info:
+            file_title = sanitize_filename(music_info)
+        else:
+            file_title = sanitized_title
+
+        prefix = f'sync{variant.sync_method}_{media_id}'
+        if variant.quality:
+            prefix += f'_{variant.quality}'
+        if variant.profile:
+            prefix += f"_{'+'.join(variant.profile)}"
+
+        if file_title:
+            return f'{prefix}_{file_title}.{variant.container}'
+        else:
+            return f'{prefix}.{variant.container}'
+
+    def _download_files(self, sources, audio_url, audio_path):
+        """Скачивает видео всех нужных качеств и аудио одновременно
+
+        Возвращает None при успехе, иначе текст ошибки.
+        """
+        self._status("Загрузка видео и аудио...")
+
+        cancel_event = threading.Event()
+        progress_lock = threading.Lock()
+        # desc -> (downloaded, total)
+        progress_state = {}
+
+        def on_progress(desc, percent, downloaded, total):
+            with progress_lock:
+                progress_state[desc] = (downloaded, total)
+                all_downloaded = sum(d for d, _ in progress_state.values())
+                all_total = sum(t for _, t in progress_state.values())
+            if all_total > 0:
+                self._progress("видео и аудио", (all_downloaded / all_total) * 100,
+                               all_downloaded, all_total)
+
+        jobs = {}
+        for source in sources:
+            desc = f"видео {source.quality}" if len(sources) > 1 else "видео"
+            jobs[desc] = (source.url, source.path, "Ошибка загрузки видео", 'video_download')
+        jobs["аудио"] = (audio_url, audio_path, "Ошибка загрузки аудио", 'audio_download')
+
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            futures = {
+                executor.submit(
+                    self._fetch_file, url, path, desc, on_progress, cancel_event, stage
+                ): desc
+                for desc, (url, path, _, stage) in jobs.items()
+            }
+
+            failed = None
+            failure = None
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    if failed is None:
+                        # Останавливаем остальные загрузки
+                        failed = futures[future]
+                        failure = classify_error(e)
+                        cancel_event.set()
+
+        if failed is not None:
+            return f"{jobs[failed][2]}: {failure}"
+        return None
+
+    def _find_completed(self, media_id, variant):
+        """Путь к варианту, скачанному ранее, или None"""
+        if not (self.skip_completed and DOWNLOAD_INDEX['ENABLED']):
+            return None
+        with self.record.span('index_lookup'):
+            return get_download_index().get(media_id, variant.sync_method, variant.key)
+
+    def _record_completed(self, media_id, variant, quality, output_path):
+        """Записывает готовый вариант в индекс загрузок"""
+        if DOWNLOAD_INDEX['ENABLED']:
+            with self.record.span('index_update'):
+                get_download_index().add(media_id, variant.sync_method, quality, output_path,
+                                         variant.key)
+
+    def _media_cache_key(self, url):
+        """Ключ кэша исходников и сведения о файле на сервере"""
+        remote_info = (self._remote_info.get(url)
+                       or self.downloader.get_remote_info(url, self.priority))
+        if remote_info:
+            return make_cache_key(url, remote_info['etag'], remote_info['size']), remote_info
+        return make_cache_key(url), None
+
+    def _fetch_file(self, url, path, desc, progress_callback, cancel_event, stage='download'):
+        """Берет файл из кэша исходников или скачивает и кладет в кэш
+
+        Возвращает True, ошибки загрузки пробрасываются как DownloadError.
+        """
+        with self.record.span(stage) as span:
+            try:
+                return self._fetch_file_to(url, path, desc, progress_callback,
+                                           cancel_event, span)
+            except DownloadError as e:
+                span['error'] = e.kind
+                raise
+
+    def _fetch_file_to(self, url, path, desc, progress_callback, cancel_event, span):
+        if not MEDIA_CACHE['ENABLED']:
+            self.downloader.download_file(url, path, desc, progress_callback,
+                                          cancel_event, priority=self.priority)
+            span['bytes'] = os.path.getsize(path)
+            return True
+
+        key, remote_info = self._media_cache_key(url)
+        cache = get_media_cache()
+
+        if self.use_cache and cache.fetch(key, path):
+            size = os.path.getsize(path)
+            span['bytes'] = size
+            span['cached'] = True
+            progress_callback(desc, 100.0, size, size)
+            self._status(f"{desc}: из кэша")
+            return True
+
+        self.downloader.download_file(url, path, desc, progress_callback, cancel_event,
+                                      remote_info=remote_info, priority=self.priority)
+        span['bytes'] = os.path.getsize(path)
+        cache.store(key, path, url)
+        return True
+
+    def _stream_single_pass(self, video_url, audio_url, video_path, audio_path,
+                            final_output, metadata_args, temp_dir, sync_method):
+        """Один проход ffmpeg, читающий аудио из канала во время загрузки
+
+        Видео (короткое) скачивается целиком, затем открывается аудио; по
+        видео и по заголовку MP3 рассчитываются циклы, после чего байты
+        аудио из HTTP-ответа идут одновременно в ffmpeg и в файл для кэша.
+        Возвращает True/False по итогу или None, если потоковый режим
+        неприменим и оба файла просто скачаны в рабочий каталог.
+        """
+        # Видео качается до открытия аудио: место в лимите соединений хоста
+        # под аудио не держится, пока загрузка видео к тому же хосту ждет свое
+        try:
+            self._fetch_file(video_url, video_path, "видео", self._progress, None,
+                             'video_download')
+        except Exception as e:
+            self._error(f"Ошибка загрузки видео: {classify_error(e)}")
+            return False
+
+        # Аудио из кэша: поток не нужен
+        if MEDIA_CACHE['ENABLED'] and self.use_cache:
+            key, _ = self._media_cache_key(audio_url)
+            if get_media_cache().fetch(key, audio_path):
+                return None
+
+        # Соединение занимает место в лимите хоста до конца передачи
+        with get_scheduler().connection(audio_url, self.priority):
+            try:
+                response = self.downloader.open_stream(audio_url)
+            except Exception as e:
+                self._error(f"Ошибка загрузки аудио: {classify_error(e)}")
+                return False
+
+            try:
+                return self._stream_response(
+                    response, audio_url, video_path, audio_path,
+                    final_output, metadata_args, temp_dir, sync_method
+                )
+            finally:
+                response.close()
+
+    def _stream_response(self, response, audio_url, video_path, audio_path,
+                         final_output, metadata_args, temp_dir, sync_method):
+        """Передает открытый ответ с аудио в ffmpeg (см. _stream_single_pass)"""
+        total_size = int(response.headers.get('content-length', 0))
+        etag = response.headers.get('etag', '')
+        chunks = get_scheduler().throttle(
+            response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE), self.priority
+        )
+
+        # Читаем начало файла до заголовка с числом кадров (Xing/Info/VBRI)
+        prefix = b''
+        audio_info = None
+        probe_limit = QUALITY_SETTINGS['PROCESSING']['STREAM_PROBE_BYTES']
+        for chunk in chunks:
+            prefix += chunk
+            if total_size:
+                audio_info = parse_mp3_bytes(prefix, total_size)
+            if audio_info is not None or len(prefix) >= probe_limit:
+                break
+
+        if audio_info is None or audio_info.duration <= 0:
+            # Длительность заранее неизвестна: дописываем файл целиком
+            with open(audio_path, 'wb') as f:
+                f.write(prefix)
+                for chunk in chunks:
+                    f.write(chunk)
+            return None
+
+        self._stage(JobState.PROCESSING)
+        audio_duration = audio_info.duration
+        exact_loop_duration = self.processor.find_exact_loop_duration(video_path, temp_dir)
+        if exact_loop_duration <= 0:
+            self._error("Не удалось определить длительность файлов")
+            return False
+
+        loops = self.processor.find_optimal_loop_count(
+            audio_duration, exact_loop_duration, self.enable_loop_detection
+        )
+        cmd = self.processor.build_single_pass_cmd(
+            video_path, 'pipe:0', loops, exact_loop_duration, audio_duration,
+            final_output, sync_method, metadata_args, audio_format='mp3'
+        )
+
+        downloaded = 0
+        failure = []
+        progress = ProgressThrottle(self._progress)
+
+        def audio_chunks(f):
+            # Байты аудио идут одновременно в ffmpeg и в файл для кэша
+            nonlocal downloaded
+            try:
+                for chunk in itertools.chain([prefix], chunks):
+                    if not chunk:
+                        continue
+                    f.write(chunk)
+                    downloaded += len(chunk)
+                    if total_size > 0:
+                        progress("аудио", (downloaded / total_size) * 100,
+                                 downloaded, total_size)
+                    yield chunk
+            except Exception as e:
+                failure.append(e)
+                raise
+
+        processed = False
+        with open(audio_path, 'wb') as f:
+            try:
+                run_ffmpeg(cmd, stage='stream_single_pass',
+                           duration=min(loops * exact_loop_duration, audio_duration),
+                           stdin=audio_chunks(f))
+                processed = True
+            except Exception:
+                pass
+
+        if failure:
+            self._error(f"Ошибка загрузки аудио: {classify_error(failure[0])}")
+            return False
+
+        if MEDIA_CACHE['ENABLED'] and (not total_size or downloaded == total_size):
+            get_media_cache().store(make_cache_key(audio_url, etag, total_size), audio_path,
+                                    audio_url)
+
+        if not processed:
+            self._error("Ошибка обработки видео (один проход)")
+            return False
+        return True
@@ -0,0 +1,196 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Анализ медиафайлов через ffprobe с кэшированием результатов"""
+
+import json
+import os
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from fractions import Fraction
+
+from core.metrics import record_process
+
+PROBE_CACHE_SIZE = 256
+
+_probe_cache = OrderedDict()
+_probe_lock = threading.Lock()
+
+
+def _to_float(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _to_int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _to_fraction(value):
+    """Преобразует строку вида '1/12800' или '30000/1001' в Fraction"""
+    try:
+        result = Fraction(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return Fraction(0)
+    return result
+
+
+class StreamInfo:
+    """Сведения об одном потоке медиафайла"""
+
+    def __init__(self, data):
+        self.index = _to_int(data.get('index'))
+        self.codec_type = data.get('codec_type', '')
+        self.codec_name = data.get('codec_name', '')
+        self.time_base = _to_fraction(data.get('time_base'))
+        self.start_pts = _to_int(data.get('start_pts'))
+        self.duration = _to_float(data.get('duration'))
+        self.duration_ts = _to_int(data.get('duration_ts'))
+        self.nb_frames = _to_int(data.get('nb_frames'))
+        self.nb_read_packets = _to_int(data.get('nb_read_packets'))
+        self.avg_frame_rate = _to_fraction(data.get('avg_frame_rate'))
+        self.r_frame_rate = _to_fraction(data.get('r_frame_rate'))
+        self.sample_rate = _to_int(data.get('sample_rate'))
+        self.bit_rate = _to_int(data.get('bit_rate'))
+
+    @property
+    def packet_count(self):
+        """Количество пакетов: подсчитанное или из заголовка"""
+        return self.nb_read_packets or self.nb_frames
+
+
+class ProbeResult:
+    """Сведения о медиафайле: контейнер и потоки"""
+
+    def __init__(self, path, data):
+        fmt = data.get('format', {})
+        self.path = path
+        self.format_name = fmt.get('format_name', '')
+        self.duration = _to_float(fmt.get('duration'))
+        self.size = _to_int(fmt.get('size'))
+        self.bit_rate = _to_int(fmt.get('bit_rate'))
+        self.streams = [StreamInfo(stream) for stream in data.get('streams', [])]
+
+    def first_stream(self, codec_type):
+        """Первый поток заданного типа или None"""
+        for stream in self.streams:
+            if stream.codec_type == codec_type:
+                return stream
+        return None
+
+    @property
+    def video(self):
+        return self.first_stream('video')
+
+    @property
+    def audio(self):
+        return self.first_stream('audio')
+
+
+def probe(path):
+    """Возвращает ProbeResult для файла или None при ошибке
+
+    ffprobe запускается один раз на файл; результат кэшируется по
+    (путь, размер, время изменения), поэтому повторные вызовы бесплатны.
+    """
+    key = _cache_key(path)
+    if key is None:
+        return None
+
+    result = get_cached_probe(path, key)
+    if result is not None:
+        return result
+
+    started = time.monotonic()
+    try:
+        completed = subprocess.run(build_probe_cmd(path), capture_output=True,
+                                   text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        record_process('ffprobe', 'probe', e.returncode, time.monotonic() - started)
+        return None
+    except FileNotFoundError:
+        return None
+    record_process('ffprobe', 'probe', completed.returncode, time.monotonic() - started)
+
+    result = parse_probe_output(path, completed.stdout)
+    if result is not None:
+        store_probe(path, result, key)
+    return result
+
+
+def build_probe_cmd(path):
+    """Команда ffprobe с выводом в JSON"""
+    return [
+        'ffprobe', '-v', 'error',
+        '-count_packets',
+        '-show_format', '-show_streams',
+        '-of', 'json',
+        path
+    ]
+
+
+def parse_probe_output(path, output):
+    """Преобразует JSON-вывод ffprobe в ProbeResult или None"""
+    try:
+        return ProbeResult(path, json.loads(output or '{}'))
+    except ValueError:
+        return None
+
+
+def _cache_key(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+
+def get_cached_probe(path, key=None):
+    """Возвращает сохраненный результат для неизмененного файла или None"""
+    key = key or _cache_key(path)
+    if key is None:
+        return None
+
+    with _probe_lock:
+        result = _probe_cache.get(key)
+        if result is not None:
+            _probe_cache.move_to_end(key)
+        return result
+
+
+def store_probe(path, result, key=None):
+    """Сохраняет результат ffprobe в кэше"""
+    key = key or _cache_key(path)
+    if key is None:
+        return
+
+    with _probe_lock:
+        _probe_cache[key] = result
+        while len(_probe_cache) > PROBE_CACHE_SIZE:
+            _probe_cache.popitem(last=False)
+
+
+def clear_probe_cache():
+    """Очищает кэш результатов ffprobe"""
+    with _probe_lock:
+        _probe_cache.clear()
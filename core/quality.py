@@ -0,0 +1,112 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Выбор качества видео по размерам версий и бюджету задания"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from core.bandwidth import get_scheduler
+from config.settings import QUALITY_SETTINGS, QUALITY_POLICY
+
+
+class QualityPolicy:
+    """Политика выбора качества видео для пакета заданий
+
+    Берется лучшее по приоритету качество, которое укладывается в бюджет
+    задания: max_bytes и/или target_seconds загрузки при скорости rate
+    (байт/с; 0 - общий лимит планировщика загрузок). Бюджет включает аудио.
+    Если не укладывается ни одна версия, берется самая маленькая.
+    """
+
+    def __init__(self, max_bytes=0, target_seconds=0, rate=0):
+        self.max_bytes = max(0, max_bytes or 0)
+        self.target_seconds = max(0, target_seconds or 0)
+        self.rate = max(0, rate or 0)
+
+    @classmethod
+    def from_settings(cls):
+        """Политика из QUALITY_POLICY"""
+        return cls(QUALITY_POLICY['MAX_BYTES'], QUALITY_POLICY['TARGET_SECONDS'],
+                   QUALITY_POLICY['RATE'])
+
+    def budget(self):
+        """Бюджет задания в байтах, 0 - без ограничения"""
+        limits = []
+        if self.max_bytes:
+            limits.append(self.max_bytes)
+        rate = self.rate or get_scheduler().bucket.rate
+        if self.target_seconds and rate:
+            limits.append(int(self.target_seconds * rate))
+        return min(limits) if limits else 0
+
+    @property
+    def active(self):
+        """Нужны ли размеры версий для выбора"""
+        return self.budget() > 0
+
+    def choose(self, video_sizes, audio_size=0):
+        """Выбирает качество по размерам {качество: байт (0 - неизвестен)}
+
+        Возвращает None, если выбирать не из чего: тогда действует
+        обычный порядок приоритета.
+        """
+        budget = self.budget()
+        priority = [quality for quality in QUALITY_SETTINGS['VIDEO_QUALITY']['priority']
+                    if quality in video_sizes]
+        if not budget or not priority:
+            return None
+
+        for quality in priority:
+            size = video_sizes[quality]
+            if size and size + audio_size <= budget:
+                return quality
+
+        known = [quality for quality in priority if video_sizes[quality]]
+        if not known:
+            return None
+        return min(known, key=lambda quality: video_sizes[quality])
+
+    def to_dict(self):
+        return {
+            'max_bytes': self.max_bytes,
+            'target_seconds': self.target_seconds,
+            'rate': self.rate,
+        }
+
+
+def version_sizes(data):
+    """Ссылки и размеры версий из ответа API
+
+    Возвращает ({качество: (url, байт)}, (url аудио, байт)); размер 0,
+    если API его не прислал.
+    """
+    versions = data['file_versions']['html5']
+    video = {
+        quality: (version['url'], int(version.get('size') or 0))
+        for quality, version in versions['video'].items()
+        if version.get('url')
+    }
+    audio = versions['audio']['high']
+    return video, (audio['url'], int(audio.get('size') or 0))
+
+
+def fetch_sizes(urls, get_remote_info, workers=QUALITY_POLICY['HEAD_WORKERS']):
+    """Параллельно запрашивает заголовки; {url: сведения get_remote_info или None}"""
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(urls)))) as executor:
+        return dict(zip(urls, executor.map(get_remote_info, urls)))
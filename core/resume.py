@@ -0,0 +1,273 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Недописанные загрузки: файл .part и журнал для докачки после перезапуска"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from core.fileops import finalize_file
+from config.settings import RESUME_DIR, RESUME_MAX_AGE
+
+# Журнал сохраняется не чаще, чем раз в столько секунд
+JOURNAL_INTERVAL = 1.0
+
+# Каталог .part-файлов в рабочем каталоге задания, если RESUME_DIR на другой
+# файловой системе: удаляется вместе с рабочим каталогом
+_LOCAL_DIRNAME = '.partial'
+
+_url_locks = {}
+_url_locks_guard = threading.Lock()
+_cleaned = set()
+
+
+def _url_lock(key):
+    """Одна загрузка одного URL на процесс: иначе задания испортят общий .part"""
+    with _url_locks_guard:
+        return _url_locks.setdefault(key, threading.Lock())
+
+
+def resume_dir_for(dst):
+    """Каталог недописанных файлов на той же файловой системе, что и dst
+
+    Тогда готовый .part переносится в dst переименованием. RESUME_DIR
+    подходит, если он на той же файловой системе; иначе используется
+    каталог внутри рабочего каталога задания (dst лежит в нем): докачка
+    работает, пока идет задание, а недописанные файлы не остаются на
+    RAM-диске после него.
+    """
+    dst_dir = os.path.dirname(os.path.abspath(dst))
+    try:
+        os.makedirs(RESUME_DIR, exist_ok=True)
+        if os.stat(RESUME_DIR).st_dev == os.stat(dst_dir).st_dev:
+            return RESUME_DIR
+    except OSError:
+        pass
+    return os.path.join(dst_dir, _LOCAL_DIRNAME)
+
+
+def cleanup_stale(directory=RESUME_DIR, max_age=RESUME_MAX_AGE):
+    """Удаляет недописанные файлы, к которым давно не обращались"""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return 0
+
+    removed = 0
+    deadline = time.time() - max_age
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) < deadline:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+class PartialDownload:
+    """Файл .part и журнал (URL, ETag, размер, скачанные диапазоны)
+
+    ranges - список [start, end, done]: end=None для ответа без размера,
+    done - байт, уже записанных от start. Пока объект открыт (контекстный
+    менеджер), этот URL в процессе больше никто не качает.
+    """
+
+    def __init__(self, url, directory=RESUME_DIR):
+        self.url = url
+        self.directory = directory
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        self.part_path = os.path.join(directory, f"{key}.part")
+        self.journal_path = os.path.join(directory, f"{key}.json")
+        self.etag = ''
+        self.size = 0
+        self.ranges = []
+        self._lock = _url_lock(key)
+        self._state_lock = threading.Lock()
+        self._journal_lock = threading.Lock()
+        self._saved_at = 0.0
+
+        with _url_locks_guard:
+            # Каталоги в рабочих каталогах удаляются вместе с ними
+            cleanup = (directory not in _cleaned
+                       and os.path.basename(directory) != _LOCAL_DIRNAME)
+            if cleanup:
+                _cleaned.add(directory)
+        if cleanup:
+            cleanup_stale(directory)
+
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._load()
+        except BaseException:
+            self._lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if os.path.exists(self.part_path):
+                self.save(force=True)
+        finally:
+            self._lock.release()
+
+    def _load(self):
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            part_size = os.path.getsize(self.part_path)
+        except (OSError, ValueError):
+            self.reset()
+            return
+
+        if data.get('url') != self.url:
+            self.reset()
+            return
+
+        self.etag = data.get('etag', '')
+        self.size = data.get('size', 0)
+        self.ranges = [list(item) for item in data.get('ranges', [])]
+        # Журнал мог отстать от файла, но не опередить его
+        for start, end, done in self.ranges:
+            if start + done > max(part_size, self.size):
+                self.reset()
+                return
+
+    @property
+    def downloaded(self):
+        with self._state_lock:
+            return sum(done for _, _, done in self.ranges)
+
+    @property
+    def started(self):
+        return self.downloaded > 0
+
+    def reset(self):
+        """Начинает загрузку заново"""
+        with self._state_lock:
+            self.etag = ''
+            self.size = 0
+            self.ranges = []
+        for path in (self.part_path, self.journal_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def matches(self, etag, size):
+        """Совпадает ли файл на сервере с тем, что начали качать"""
+        if self.etag and etag and self.etag != etag:
+            return False
+        if self.size and size and self.size != size:
+            return False
+        return True
+
+    def plan(self, etag, size, ranges):
+        """Задает диапазоны новой загрузки и создает файл .part"""
+        with self._state_lock:
+            self.etag = etag or ''
+            self.size = size or 0
+            self.ranges = [[start, end, 0] for start, end in ranges]
+        with open(self.part_path, 'wb') as f:
+            if self.size:
+                f.truncate(self.size)
+        self.save(force=True)
+
+    def pending(self):
+        """Недокачанные диапазоны: (индекс, позиция продолжения, end)"""
+        with self._state_lock:
+            result = []
+            for index, (start, end, done) in enumerate(self.ranges):
+                if end is None or start + done <= end:
+                    result.append((index, start + done, end))
+            return result
+
+    def is_complete(self):
+        with self._state_lock:
+            if not self.ranges:
+                return False
+            return all(end is not None and start + done > end
+                       for start, end, done in self.ranges)
+
+    def advance(self, index, amount):
+        """Учитывает amount записанных байт диапазона"""
+        with self._state_lock:
+            self.ranges[index][2] += amount
+        self.save()
+
+    def restart_range(self, index):
+        """Диапазон придется качать с начала (сервер не продолжил)"""
+        with self._state_lock:
+            self.ranges[index][2] = 0
+        self.save(force=True)
+
+    def set_total(self, index, end):
+        """Уточняет конец диапазона, когда размер стал известен"""
+        with self._state_lock:
+            self.ranges[index][1] = end
+        self.save(force=True)
+
+    def save(self, force=False):
+        """Атомарно записывает журнал
+
+        Потоки диапазонов пишут журнал по очереди: снимок состояния и запись
+        под одной блокировкой, поэтому более старый снимок не заменит более
+        новый. Плановое сохранение пропускается, если журнал уже пишется.
+        """
+        if not self._journal_lock.acquire(blocking=force):
+            return
+        try:
+            now = time.monotonic()
+            with self._state_lock:
+                if not force and now - self._saved_at < JOURNAL_INTERVAL:
+                    return
+                self._saved_at = now
+                data = {
+                    'url': self.url,
+                    'etag': self.etag,
+                    'size': self.size,
+                    'ranges': [list(item) for item in self.ranges],
+                    'updated': time.time(),
+                }
+
+            tmp_path = f"{self.journal_path}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.journal_path)
+            except OSError:
+                pass
+        finally:
+            self._journal_lock.release()
+
+    def finish(self, dst):
+        """Переносит готовый файл в dst и удаляет журнал
+
+        Переименованием, если каталог выбран по resume_dir_for(dst).
+        """
+        finalize_file(self.part_path, dst)
+        try:
+            os.remove(self.journal_path)
+        except OSError:
+            pass
+        with self._state_lock:
+            self.ranges = []
@@ -0,0 +1,156 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Шаги обработки задания и их выполнение в текущем потоке
+
+MediaPipeline.steps() - генератор: отдает шаги, движок выполняет их и
+возвращает результат в генератор (send), ошибку - через throw. Так
+синхронный конвейер и асинхронный движок проходят одну и ту же
+последовательность этапов, различаясь только тем, как запускают шаги.
+"""
+
+import contextvars
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from core.ffmpeg_runner import run_ffmpeg
+from core.probe import probe
+from core.utils import get_accurate_duration
+
+
+class Call:
+    """Блокирующий вызов func(*args): HTTP, файлы, индекс
+
+    download=True - загрузка, выполняется в пуле загрузок движка.
+    """
+
+    def __init__(self, func, *args, download=False):
+        self.func = func
+        self.args = args
+        self.download = download
+
+
+class Ffmpeg:
+    """Запуск ffmpeg; результат - True при успехе, иначе False"""
+
+    def __init__(self, cmd, stage, duration=0):
+        self.cmd = cmd
+        self.stage = stage
+        self.duration = duration
+
+
+class Duration:
+    """Длительность файла по заголовкам или ffprobe, 0 - не удалось"""
+
+    def __init__(self, path):
+        self.path = path
+
+
+class Probe:
+    """Результат ffprobe (core.probe.ProbeResult) или None"""
+
+    def __init__(self, path):
+        self.path = path
+
+
+class AcquireEncoder:
+    """Место в планировщике перекодирований; результат - бюджет потоков
+
+    Освобождает место сам генератор: scheduler.release().
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+
+class Parallel:
+    """Генераторы шагов, выполняемые одновременно
+
+    Результат - список их итогов по порядку; исключение генератора
+    оказывается в списке на его месте.
+    """
+
+    def __init__(self, generators, max_workers=0):
+        self.generators = list(generators)
+        self.max_workers = max_workers
+
+
+def run_steps(steps):
+    """Выполняет шаги генератора в текущем потоке, возвращает его итог"""
+    result = None
+    error = None
+    try:
+        while True:
+            try:
+                step = steps.send(result) if error is None else steps.throw(error)
+            except StopIteration as e:
+                return e.value
+            result = error = None
+            try:
+                result = execute_step(step)
+            except Exception as e:
+                error = e
+    finally:
+        steps.close()
+
+
+def execute_step(step):
+    """Выполняет один шаг синхронно"""
+    if isinstance(step, Call):
+        return step.func(*step.args)
+
+    if isinstance(step, Ffmpeg):
+        try:
+            run_ffmpeg(step.cmd, stage=step.stage, duration=step.duration)
+            return True
+        except (subprocess.CalledProcessError, OSError):
+            return False
+
+    if isinstance(step, Duration):
+        return get_accurate_duration(step.path)
+
+    if isinstance(step, Probe):
+        return probe(step.path)
+
+    if isinstance(step, AcquireEncoder):
+        return step.scheduler.acquire()
+
+    if isinstance(step, Parallel):
+        return _run_parallel(step)
+
+    raise TypeError(f"Неизвестный шаг: {step!r}")
+
+
+def _run_parallel(step):
+    if len(step.generators) == 1:
+        return [_capture(run_steps, step.generators[0])]
+
+    workers = step.max_workers or len(step.generators)
+    with ThreadPoolExecutor(max_workers=min(workers, len(step.generators))) as executor:
+        # Копия контекста: замеры и прогресс ffmpeg остаются у этого задания
+        futures = [
+            executor.submit(contextvars.copy_context().run, _capture, run_steps, generator)
+            for generator in step.generators
+        ]
+        return [future.result() for future in futures]
+
+
+def _capture(func, *args):
+    """Результат func или выброшенное ею исключение"""
+    try:
+        return func(*args)
+    except Exception as e:
+        return e
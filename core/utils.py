@@ -20,6 +20,9 @@ import re
 import os
 import subprocess
 
+from core.probe import probe
+from core.media_headers import parse_duration
+
 
 def sanitize_filename(filename):
     """Очищает строку для использования в имени файла"""
@@ -32,22 +35,19 @@ def sanitize_filename(filename):
 
 
 def get_accurate_duration(filename):
-    """Получает точную длительность медиафайла"""
-    try:
-        result = subprocess.run([
-            'ffprobe', '-v', 'error',
-            '-show_entries', 'format=duration',
-            '-of', 'default=noprint_wrappers=1:nokey=1',
-            filename
-        ], capture_output=True, text=True, check=True)
-
-        if result.returncode == 0:
-            duration = result.stdout.strip()
-            if duration:
-                return float(duration)
-    except Exception as e:
+    """Получает точную длительность медиафайла
+
+    Сначала разбирает заголовки MP4/MP3 без запуска процессов,
+    ffprobe используется только если разбор не удался.
+    """
+    duration = parse_duration(filename)
+    if duration > 0:
+        return duration
+
+    result = probe(filename)
+    if result is None:
         return 0
-    return 0
+    return result.duration
 
 
 def check_ffmpeg():
@@ -0,0 +1,141 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Варианты итогового файла одного задания"""
+
+import os
+
+from core.encoding import parse_profile
+from config.settings import QUALITY_SETTINGS, OUTPUT_CONTAINERS, ENCODE_PROFILES
+
+
+class OutputVariant:
+    """Вариант результата: метод синхронизации, контейнер, качество видео
+    и профиль перекодирования
+
+    quality=None - лучшее доступное качество по приоритету из настроек;
+    profile - строка или кортеж имен из ENCODE_PROFILES ('h265+opus'),
+    пустой - потоки копируются без перекодирования.
+    Варианты одного задания делят метаданные, загрузки, замеры и
+    зацикленное видео; отдельно для каждого выполняется только сборка.
+    """
+
+    def __init__(self, sync_method=1, container=None, quality=None, profile=None):
+        if sync_method not in (1, 2):
+            raise ValueError(f"Неизвестный метод синхронизации: {sync_method}")
+        container = container or QUALITY_SETTINGS['PROCESSING']['OUTPUT_FORMAT']
+        if container not in OUTPUT_CONTAINERS:
+            raise ValueError(f"Неподдерживаемый контейнер: {container}")
+        if quality is not None and quality not in QUALITY_SETTINGS['VIDEO_QUALITY']['priority']:
+            raise ValueError(f"Неизвестное качество видео: {quality}")
+        if isinstance(profile, str) or profile is None:
+            profile = parse_profile(profile)
+        if container == 'mov' and any(
+                ENCODE_PROFILES[name].get('AUDIO_CODEC') == 'libopus' for name in profile
+        ):
+            raise ValueError("Контейнер mov не поддерживает Opus")
+
+        self.sync_method = sync_method
+        self.container = container
+        self.quality = quality
+        self.profile = tuple(profile)
+
+    @property
+    def key(self):
+        """Ключ в индексе готовых загрузок ('' у варианта по умолчанию)"""
+        parts = []
+        if self.container != 'mp4':
+            parts.append(self.container)
+        if self.quality:
+            parts.append(self.quality)
+        if self.profile:
+            parts.append('+'.join(self.profile))
+        return '/'.join(parts)
+
+    def _fields(self):
+        return self.sync_method, self.container, self.quality, self.profile
+
+    def __eq__(self, other):
+        return isinstance(other, OutputVariant) and self._fields() == other._fields()
+
+    def __hash__(self):
+        return hash(self._fields())
+
+    def __str__(self):
+        key = self.key
+        return f"sync{self.sync_method}/{key}" if key else f"sync{self.sync_method}"
+
+    def __repr__(self):
+        return (f"OutputVariant({self.sync_method}, {self.container!r}, {self.quality!r}, "
+                f"{'+'.join(self.profile)!r})")
+
+    def to_dict(self):
+        return {
+            'sync_method': self.sync_method,
+            'container': self.container,
+            'quality': self.quality,
+            'profile': '+'.join(self.profile),
+        }
+
+
+def parse_variant(spec):
+    """Разбирает вариант вида 'метод[:контейнер[:качество[:профиль]]]'
+
+    Например '2', '1:mkv', '2:mp4:high', '1:mkv::h265+opus'. Пустые части
+    берутся по умолчанию. Ошибки сообщаются через ValueError.
+    """
+    parts = [part.strip() for part in str(spec).split(':')]
+    if len(parts) > 4 or not parts[0].isdigit():
+        raise ValueError(f"Неверный вариант: {spec}")
+    parts.extend([''] * (4 - len(parts)))
+
+    return OutputVariant(int(parts[0]), parts[1] or None, parts[2] or None, parts[3])
+
+
+def unique_variants(variants):
+    """Варианты без повторов в исходном порядке"""
+    return list(dict.fromkeys(variants))
+
+
+def container_args(output_path):
+    """Параметры мультиплексора по расширению итогового файла
+
+    Флаги MP4 (faststart, brand) для других контейнеров ffmpeg отвергает.
+    """
+    container = os.path.splitext(output_path)[1].lstrip('.').lower()
+    if container == 'mp4':
+        return ['-movflags', '+faststart', '-brand', 'mp42']
+    if container == 'mov':
+        return ['-movflags', '+faststart']
+    return []
+
+
+class VideoSource:
+    """Видео одного качества и собираемые из него варианты
+
+    Длительности, число циклов и зацикленное видео заполняются
+    конвейером один раз для всех вариантов этого видео.
+    """
+
+    def __init__(self, url, quality, path):
+        self.url = url
+        self.quality = quality
+        self.path = path
+        self.variants = []
+        self.duration = 0
+        self.loop_duration = 0
+        self.loops = 0
+        self.looped_path = ''
@@ -16,46 +16,83 @@
 
 """Обработка видео (циклы, синхронизация)"""
 
-import subprocess
 import os
 import math
-from core.utils import get_accurate_duration
+from core.media_headers import parse_mp4
+from core.steps import Call, Duration, Ffmpeg, Probe, run_steps
+from core.variants import container_args
+from core.encoding import COPY_ARGS
 from config.settings import QUALITY_SETTINGS
 
 
 class VideoProcessor:
-    """Класс для обработки видео"""
+    """Класс для обработки видео
+
+    Команды ffmpeg формируются методами build_*, чтобы их могли
+    запускать как синхронный конвейер, так и асинхронный движок.
+    """
 
     @staticmethod
-    def find_exact_loop_duration(video_path, temp_dir):
-        """Определяет ТОЧНУЮ длительность одного цикла после конкатенации"""
+    def find_exact_loop_duration(video_path, temp_dir, method=None):
+        """Определяет ТОЧНУЮ длительность одного цикла после конкатенации
+
+        Синхронно выполняет шаги loop_duration_steps.
+        """
+        return run_steps(VideoProcessor.loop_duration_steps(video_path, temp_dir, method))
+
+    @staticmethod
+    def loop_duration_steps(video_path, temp_dir, method=None):
+        """Шаги определения длительности цикла (см. core.steps)
+
+        method: 'analytic' - расчет по временным меткам потока: таблица stts
+        из заголовка MP4, затем ffprobe. Демуксер concat сдвигает каждую
+        следующую копию на длительность потока, т.е. на duration_ts в
+        единицах time_base. 'concat' - пробная склейка двух циклов; она же
+        используется, если расчет не удался.
+        """
+        if method is None:
+            method = QUALITY_SETTINGS['PROCESSING']['LOOP_DURATION_METHOD']
+
+        if method == 'analytic':
+            # Таблица stts из заголовка MP4: без запуска ffprobe
+            header = yield Call(parse_mp4, video_path)
+            if header is not None and header.video is not None and header.video.duration > 0:
+                return header.video.duration
+
+            loop_duration = VideoProcessor.loop_duration_from_probe((yield Probe(video_path)))
+            if loop_duration > 0:
+                return loop_duration
+
+        # Пробная склейка двух копий
         test_loops = 2
         test_output = os.path.join(temp_dir, 'test_loop.mp4')
         concat_file = os.path.join(temp_dir, 'test_concat.txt')
+        VideoProcessor.write_concat_file(video_path, test_loops, concat_file)
+        cmd = VideoProcessor.build_concat_cmd(concat_file, test_output)
+        if (yield Ffmpeg(cmd, 'loop_test')):
+            two_loops_duration = yield Duration(test_output)
+            if two_loops_duration > 0:
+                return two_loops_duration / test_loops
 
-        with open(concat_file, 'w', encoding='utf-8') as f:
-            for i in range(test_loops):
-                f.write(f"file '{os.path.abspath(video_path)}'\n")
+        return (yield Duration(video_path))
 
-        cmd = [
-            'ffmpeg', '-f', 'concat', '-safe', '0',
-            '-i', concat_file,
-            '-c', 'copy',
-            '-fflags', '+genpts',
-            '-vsync', 'cfr',
-            '-avoid_negative_ts', 'make_zero',
-            '-y', test_output
-        ]
+    @staticmethod
+    def loop_duration_from_probe(info):
+        """Длительность цикла по результату ffprobe или 0"""
+        if info is None:
+            return 0
 
-        try:
-            subprocess.run(cmd, check=True, capture_output=True, text=True)
-            two_loops_duration = get_accurate_duration(test_output)
-            if two_loops_duration > 0:
-                return two_loops_duration / test_loops
-        except Exception as e:
-            pass
+        stream = info.video
+        if stream is None:
+            return info.duration
 
-        return get_accurate_duration(video_path)
+        if stream.duration_ts > 0 and stream.time_base > 0:
+            return float(stream.duration_ts * stream.time_base)
+
+        if stream.packet_count > 0 and stream.avg_frame_rate > 0:
+            return float(stream.packet_count / stream.avg_frame_rate)
+
+        return stream.duration or info.duration
 
     @staticmethod
     def find_optimal_loop_count(audio_duration, video_duration, enable_loop_detection=True):
@@ -78,14 +115,16 @@ class VideoProcessor:
         return best_loops
 
     @staticmethod
-    def create_looped_video_concat(video_path, loops, output_path, temp_dir):
-        """Создает зацикленное видео методом конкатенации"""
-        concat_file = os.path.join(temp_dir, 'concat.txt')
+    def write_concat_file(video_path, loops, concat_file):
+        """Записывает список файлов для демуксера concat"""
         with open(concat_file, 'w', encoding='utf-8') as f:
             for i in range(loops):
                 f.write(f"file '{os.path.abspath(video_path)}'\n")
 
-        cmd = [
+    @staticmethod
+    def build_concat_cmd(concat_file, output_path):
+        """Команда склейки видео демуксером concat"""
+        return [
             'ffmpeg', '-f', 'concat', '-safe', '0',
             '-i', concat_file,
             '-c', 'copy',
@@ -95,101 +134,83 @@ class VideoProcessor:
             '-y', output_path
         ]
 
-        try:
-            subprocess.run(cmd, check=True, capture_output=True, text=True)
-            return True
-        except subprocess.CalledProcessError:
-            return False
-
     @staticmethod
-    def sync_video_audio_method1(looped_video_path, audio_path, output_path):
-        """Синхронизация видео и аудио. Метод 1"""
-        looped_duration = get_accurate_duration(looped_video_path)
-        audio_duration = get_accurate_duration(audio_path)
-
-        if abs(looped_duration - audio_duration) < 0.01:
-            cmd = [
-                'ffmpeg', '-i', looped_video_path,
-                '-i', audio_path,
-                '-c', 'copy',
-                '-map', '0:v:0',
-                '-map', '1:a:0',
-                '-shortest',
-                '-avoid_negative_ts', 'make_zero',
-                '-y', output_path
-            ]
-        elif looped_duration > audio_duration:
-            cmd = [
-                'ffmpeg', '-i', looped_video_path,
-                '-i', audio_path,
-                '-c', 'copy',
-                '-map', '0:v:0',
-                '-map', '1:a:0',
-                '-t', str(audio_duration),
-                '-avoid_negative_ts', 'make_zero',
-                '-y', output_path
-            ]
-        else:
-            cmd = [
-                'ffmpeg', '-i', looped_video_path,
-                '-i', audio_path,
-                '-c', 'copy',
-                '-map', '0:v:0',
-                '-map', '1:a:0',
-                '-t', str(looped_duration),
-                '-avoid_negative_ts', 'make_zero',
-                '-y', output_path
-            ]
-
-        try:
-            subprocess.run(cmd, check=True, capture_output=True, text=True)
-            return True
-        except subprocess.CalledProcessError:
-            return False
+    def _sync_precision(sync_method):
+        """Допустимое расхождение длительностей для метода синхронизации"""
+        if sync_method == 1:
+            return 0.01
+        return QUALITY_SETTINGS['PROCESSING']['SYNC_PRECISION']
 
     @staticmethod
-    def sync_video_audio_method2(looped_video_path, audio_path, output_path):
-        """Синхронизация видео и аудио. Метод 2"""
-        looped_duration = get_accurate_duration(looped_video_path)
-        audio_duration = get_accurate_duration(audio_path)
+    def _duration_args(looped_duration, audio_duration, precision):
+        """Аргументы обрезки по длительности: -shortest или -t"""
         difference = looped_duration - audio_duration
 
-        if abs(difference) < QUALITY_SETTINGS['PROCESSING']['SYNC_PRECISION']:
-            cmd = [
-                'ffmpeg', '-i', looped_video_path,
-                '-i', audio_path,
-                '-c', 'copy',
-                '-map', '0:v:0',
-                '-map', '1:a:0',
-                '-shortest',
-                '-movflags', '+faststart',
-                '-y', output_path
-            ]
+        if abs(difference) < precision:
+            return ['-shortest']
         elif difference > 0:
-            cmd = [
-                'ffmpeg', '-i', looped_video_path,
-                '-i', audio_path,
-                '-c', 'copy',
-                '-map', '0:v:0',
-                '-map', '1:a:0',
-                '-t', str(audio_duration),
-                '-movflags', '+faststart',
-                '-y', output_path
-            ]
+            return ['-t', str(audio_duration)]
+        else:
+            return ['-t', str(looped_duration)]
+
+    @staticmethod
+    def build_sync_cmd(sync_method, looped_video_path, audio_path, output_path,
+                       looped_duration, audio_duration):
+        """Команда синхронизации видео и аудио выбранным методом"""
+        cmd = [
+            'ffmpeg', '-i', looped_video_path,
+            '-i', audio_path,
+            '-c', 'copy',
+            '-map', '0:v:0',
+            '-map', '1:a:0',
+        ]
+        cmd.extend(VideoProcessor._duration_args(
+            looped_duration, audio_duration, VideoProcessor._sync_precision(sync_method)
+        ))
+
+        if sync_method == 1:
+            cmd.extend(['-avoid_negative_ts', 'make_zero'])
         else:
-            cmd = [
-                'ffmpeg', '-i', looped_video_path,
-                '-i', audio_path,
-                '-c', 'copy',
-                '-map', '0:v:0',
-                '-map', '1:a:0',
-                '-t', str(looped_duration),
-                '-movflags', '+faststart',
-                '-y', output_path
-            ]
-
-        try:
-            subprocess.run(cmd, check=True, capture_output=True, text=True)
-            return True
-        except subprocess.CalledProcessError:
-            return False
\ No newline at end of file
+            cmd.extend(['-movflags', '+faststart'])
+
+        cmd.extend(['-y', output_path])
+        return cmd
+
+    @staticmethod
+    def build_single_pass_cmd(video_path, audio_path, loops, loop_duration,
+                              audio_duration, output_path, sync_method, metadata_args=None,
+                              audio_format=None, codec_args=None):
+        """Команда зацикливания, синхронизации и метаданных за один проход
+
+        audio_format задает формат аудиовхода явно, например 'mp3'
+        для чтения из канала (audio_path='pipe:0'); codec_args - аргументы
+        перекодирования (см. core.encoding), по умолчанию потоки копируются.
+        """
+        cmd = [
+            'ffmpeg', '-fflags', '+genpts',
+            '-stream_loop', str(max(loops - 1, 0)),
+            '-i', video_path,
+        ]
+        if audio_format:
+            cmd.extend(['-f', audio_format])
+        cmd.extend([
+            '-i', audio_path,
+        ])
+        cmd.extend(codec_args or COPY_ARGS)
+        cmd.extend([
+            '-map', '0:v:0',
+            '-map', '1:a:0',
+        ])
+        cmd.extend(VideoProcessor._duration_args(
+            loops * loop_duration, audio_duration, VideoProcessor._sync_precision(sync_method)
+        ))
+
+        if sync_method == 1:
+            cmd.extend(['-avoid_negative_ts', 'make_zero'])
+
+        if metadata_args:
+            cmd.extend(metadata_args)
+
+        cmd.extend(container_args(output_path))
+        cmd.extend(['-y', output_path])
+        return cmd
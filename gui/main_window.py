@@ -18,29 +18,42 @@
 
 import os
 from PyQt5.QtWidgets import (QMainWindow, QWidget, QVBoxLayout,
-                             QLineEdit, QPushButton, QLabel,
+                             QPlainTextEdit, QPushButton, QLabel,
                              QProgressBar, QTextEdit, QMessageBox,
-                             QGroupBox, QApplication)
+                             QFileDialog,
+                             QTableWidget, QTableWidgetItem, QHeaderView)
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QFont
 
 from gui.widgets import SettingsGroup
-from threads.download_thread import DownloadThread
+from threads.batch_manager import BatchManager
+from core.jobs import JobState
+from core.ingest import SourceKind, parse_source
+from core.bandwidth import Priority
 from config.settings import APP_NAME, APP_VERSION
 
+JOB_STATE_TITLES = {
+    JobState.QUEUED: "В очереди",
+    JobState.DOWNLOADING: "Загрузка",
+    JobState.PROCESSING: "Обработка",
+    JobState.DONE: "Готово",
+    JobState.FAILED: "Ошибка",
+}
+
 
 class LoaderWindow(QMainWindow):
     """Главное окно приложения"""
 
     def __init__(self):
         super().__init__()
-        self.download_thread = None
+        self.batch_manager = None
+        self._job_rows = {}
         self.init_ui()
 
     def init_ui(self):
         """Инициализация интерфейса"""
         self.setWindowTitle(f"{APP_NAME} v{APP_VERSION}")
-        self.setGeometry(100, 100, 600, 500)
+        self.setGeometry(100, 100, 700, 700)
 
         # Центральный виджет
         central_widget = QWidget()
@@ -61,15 +74,21 @@ class LoaderWindow(QMainWindow):
         self.settings_group = SettingsGroup()
         main_layout.addWidget(self.settings_group)
 
-        # Поле для ссылки
-        url_label = QLabel("Ссылка на видео:")
+        # Поле для ссылок
+        url_label = QLabel("Ссылки на видео (по одной в строке):")
         main_layout.addWidget(url_label)
 
-        self.url_input = QLineEdit()
-        self.url_input.setPlaceholderText("https://site.com/view/<video_id>")
+        self.url_input = QPlainTextEdit()
+        self.url_input.setPlaceholderText("https://site.com/view/<video_id>\n"
+                                          "https://site.com/<канал>, https://site.com/tags/<тег>")
+        self.url_input.setMaximumHeight(100)
         self.url_input.setStyleSheet("padding: 8px; border: 1px solid #ccc; border-radius: 4px;")
         main_layout.addWidget(self.url_input)
 
+        self.import_btn = QPushButton("Импорт из файла...")
+        self.import_btn.clicked.connect(self.import_urls)
+        main_layout.addWidget(self.import_btn)
+
         # Кнопка загрузки
         self.download_btn = QPushButton("📥 Загрузить")
         self.download_btn.setStyleSheet("""
@@ -92,6 +111,21 @@ class LoaderWindow(QMainWindow):
         self.download_btn.clicked.connect(self.start_download)
         main_layout.addWidget(self.download_btn)
 
+        # Таблица заданий
+        self.jobs_table = QTableWidget(0, 3)
+        self.jobs_table.setHorizontalHeaderLabels(["#", "Ссылка", "Состояние"])
+        self.jobs_table.verticalHeader().setVisible(False)
+        self.jobs_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        header = self.jobs_table.horizontalHeader()
+        header.setSectionResizeMode(0, QHeaderView.ResizeToContents)
+        header.setSectionResizeMode(1, QHeaderView.Stretch)
+        header.setSectionResizeMode(2, QHeaderView.ResizeToContents)
+        main_layout.addWidget(self.jobs_table)
+
+        # Сводная статистика
+        self.stats_label = QLabel("")
+        main_layout.addWidget(self.stats_label)
+
         # Прогресс бар
         self.progress_bar = QProgressBar()
         self.progress_bar.setVisible(False)
@@ -121,66 +155,186 @@ class LoaderWindow(QMainWindow):
     def log_message(self, message):
         """Добавляет сообщение в лог"""
         self.log_text.append(message)
-        QApplication.processEvents()
+
+    def import_urls(self):
+        """Загружает список ссылок из текстового файла"""
+        path, _ = QFileDialog.getOpenFileName(self, "Импорт ссылок", "",
+                                              "Текстовые файлы (*.txt);;Все файлы (*)")
+        if not path:
+            return
+
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read().strip()
+
+        if text:
+            current = self.url_input.toPlainText().strip()
+            self.url_input.setPlainText(f"{current}\n{text}" if current else text)
 
     def start_download(self):
         """Начинает загрузку"""
-        url = self.url_input.text().strip()
-
-        if not url or 'coub.com/view/' not in url:
+        lines = [line.strip() for line in self.url_input.toPlainText().splitlines()]
+        sources = {line: parse_source(line) for line in lines if line}
+        urls = [line for line, source in sources.items()
+                if source and source[0] == SourceKind.MEDIA]
+        feeds = [line for line, source in sources.items()
+                 if source and source[0] in SourceKind.FEEDS]
+        skipped = [line for line, source in sources.items() if source is None]
+
+        if not urls and not feeds:
             QMessageBox.warning(self, "Ошибка", "Пожалуйста, введите корректную ссылку")
             return
 
-        # Блокируем кнопку
-        self.download_btn.setEnabled(False)
+        for line in skipped:
+            self.log_message(f"⚠️ Пропущена некорректная ссылка: {line}")
+
+        if self.batch_manager is None or not self.batch_manager.is_running():
+            self._create_batch_manager()
+
+        self.url_input.clear()
         self.progress_bar.setVisible(True)
-        self.progress_bar.setValue(0)
+        if urls:
+            self.batch_manager.add_urls(urls, None if not feeds else Priority.BATCH)
+        if feeds:
+            self.log_message(f"Обход лент: {len(feeds)}")
+            self.batch_manager.add_sources(feeds)
+
+    def _create_batch_manager(self):
+        """Создает менеджер пакетной загрузки с текущими настройками"""
+        if self.batch_manager is not None:
+            self.batch_manager.deleteLater()
+
+        self.jobs_table.setRowCount(0)
+        self._job_rows = {}
         self.log_text.clear()
+        self.progress_bar.setValue(0)
 
         # Получаем выбранные настройки
         sync_method = self.settings_group.get_sync_method()
         enable_loop_detection = self.settings_group.is_loop_detection_enabled()
+        max_workers = self.settings_group.get_max_workers()
+
+        self.batch_manager = BatchManager(sync_method, enable_loop_detection, max_workers)
+        self.batch_manager.job_changed.connect(self.update_job)
+        self.batch_manager.progress.connect(self.update_progress)
+        self.batch_manager.status.connect(self.job_status)
+        self.batch_manager.all_finished.connect(self.download_finished)
+
+    def job_status(self, job_id, message):
+        """Выводит сообщение задания в лог"""
+        if job_id:
+            message = f"[{job_id}] {message}"
+        self.log_message(message)
+
+    def update_job(self, job_id):
+        """Обновляет строку задания в таблице"""
+        job = self.batch_manager.queue.get(job_id)
+        if job is None:
+            return
 
-        # Создаем и запускаем поток
-        self.download_thread = DownloadThread(url, sync_method, enable_loop_detection)
-        self.download_thread.progress.connect(self.update_progress)
-        self.download_thread.status.connect(self.log_message)
-        self.download_thread.finished.connect(self.download_finished)
-        self.download_thread.error.connect(self.show_error)
-        self.download_thread.start()
-
-    def update_progress(self, desc, percent, downloaded, total):
-        """Обновляет прогресс"""
-        mb_downloaded = downloaded / (1024 * 1024)
-        mb_total = total / (1024 * 1024)
-
-        self.progress_bar.setValue(int(percent))
-        self.statusBar().showMessage(f"{desc}: {percent:.1f}% ({mb_downloaded:.1f}/{mb_total:.1f} MB)")
-
-    def download_finished(self, result_path, success):
-        """Завершение загрузки"""
-        self.download_btn.setEnabled(True)
+        row = self._job_rows.get(job_id)
+        if row is None:
+            row = self.jobs_table.rowCount()
+            self.jobs_table.insertRow(row)
+            self._job_rows[job_id] = row
+            self.jobs_table.setItem(row, 0, QTableWidgetItem(str(job_id)))
+            self.jobs_table.setItem(row, 1, QTableWidgetItem(job.url))
+
+        state_item = QTableWidgetItem(JOB_STATE_TITLES.get(job.state, job.state))
+        if job.state == JobState.DONE and job.result_path:
+            state_item.setToolTip(job.result_path)
+        elif job.state == JobState.FAILED and job.error:
+            state_item.setToolTip(job.error)
+        self.jobs_table.setItem(row, 2, state_item)
+
+        self.update_stats()
+
+    def update_stats(self):
+        """Обновляет сводную статистику и общий прогресс"""
+        stats = self.batch_manager.queue.stats()
+        counts = stats['counts']
+        finished = counts[JobState.DONE] + counts[JobState.FAILED]
+
+        if stats['total']:
+            self.progress_bar.setValue(int(finished * 100 / stats['total']))
+
+        mb_total = stats['bytes'] / (1024 * 1024)
+        speed = stats['bytes_per_sec'] / (1024 * 1024)
+        self.stats_label.setText(
+            f"Всего: {stats['total']} | "
+            f"В работе: {counts[JobState.DOWNLOADING] + counts[JobState.PROCESSING]} | "
+            f"Готово: {counts[JobState.DONE]} | Ошибок: {counts[JobState.FAILED]} | "
+            f"{mb_total:.1f} MB, {speed:.2f} MB/s, {stats['jobs_per_min']:.1f} видео/мин"
+        )
+
+    def update_progress(self, snapshot):
+        """Обновляет прогресс по снимку шины (не чаще PROGRESS_UPDATE_HZ)"""
+        mb_downloaded = snapshot['downloaded'] / (1024 * 1024)
+        mb_total = snapshot['total'] / (1024 * 1024)
+
+        message = (f"Активных: {snapshot['active']} | {snapshot['percent']:.1f}% "
+                   f"({mb_downloaded:.1f}/{mb_total:.1f} MB)")
+
+        # Этапы ffmpeg заданий, которые сейчас обрабатываются
+        stages = [
+            f"[{job_id}] {state['stage']} {state.get('stage_percent', 0):.0f}% "
+            f"({state.get('speed', 0):.1f}x)"
+            for job_id, state in sorted(snapshot['jobs'].items()) if state.get('stage')
+        ]
+        if stages:
+            message += " | " + ", ".join(stages[:3])
+
+        self.statusBar().showMessage(message)
+        self.update_stats()
+
+    def download_finished(self):
+        """Завершение всех заданий"""
         self.progress_bar.setVisible(False)
 
-        if success and result_path:
-            self.log_message(f"✅ Загрузка завершена успешно!")
-            self.log_message(f"📁 Файл сохранен: {result_path}")
-            # self.statusBar().showMessage(f"Готово! Файл: {os.path.basename(result_path)}")  КОМ
+        stats = self.batch_manager.queue.stats()
+        done = stats['counts'][JobState.DONE]
+        failed = stats['counts'][JobState.FAILED]
+        skipped = self.batch_manager.skipped
+
+        if failed == 0 and done == 0 and skipped > 0:
+            self.log_message(f"✅ Все видео уже скачаны: {skipped}")
+            self.statusBar().showMessage(f"Уже скачано: {skipped}")
+
+            msg = QMessageBox(self)
+            msg.setIcon(QMessageBox.Information)
+            msg.setWindowTitle("Загрузка не нужна")
+            msg.setText(f"Все видео уже скачаны ранее.\n\nУже скачано: {skipped}")
+            msg.setStandardButtons(QMessageBox.Ok)
+            msg.exec_()
+        elif failed == 0 and done > 0:
+            self.log_message(f"✅ Загрузка завершена успешно! Файлов: {done}")
+            for job in self.batch_manager.queue.jobs():
+                self.log_message(f"📁 Файл сохранен: {job.result_path}")
 
             msg = QMessageBox(self)
             msg.setIcon(QMessageBox.Information)
             msg.setWindowTitle("Успех")
-            msg.setText(f"Успешно загружен!\n\nФайл: {os.path.basename(result_path)}")
+            if done == 1:
+                result_path = self.batch_manager.queue.jobs()[0].result_path
+                text = f"Успешно загружен!\n\nФайл: {os.path.basename(result_path)}"
+            else:
+                text = f"Успешно загружено файлов: {done}"
+            if skipped:
+                text += f"\nУже скачано: {skipped}"
+            msg.setText(text)
             msg.setStandardButtons(QMessageBox.Ok)
             msg.exec_()
         else:
-            self.log_message("❌ Загрузка не удалась")
+            self.log_message(f"❌ Не удалось загрузить: {failed} из {done + failed}")
             self.statusBar().showMessage("Ошибка загрузки")
 
             msg = QMessageBox(self)
             msg.setIcon(QMessageBox.Warning)
             msg.setWindowTitle("Ошибка")
-            msg.setText("Не удалось загрузить видео. Проверьте ссылку и соединение с интернетом.")
+            text = (f"Не удалось загрузить видео: {failed} из {done + failed}. "
+                    "Проверьте ссылки и соединение с интернетом.")
+            if skipped:
+                text += f"\nУже скачано: {skipped}"
+            msg.setText(text)
             msg.setStandardButtons(QMessageBox.Ok)
             msg.exec_()
 
@@ -189,7 +343,6 @@ class LoaderWindow(QMainWindow):
 
     def closeEvent(self, event):
         """Обработка закрытия окна"""
-        if self.download_thread and self.download_thread.isRunning():
-            self.download_thread.terminate()
-            self.download_thread.wait()
+        if self.batch_manager is not None:
+            self.batch_manager.stop()
         event.accept()
\ No newline at end of file
@@ -16,8 +16,10 @@
 
 """Пользовательские виджеты"""
 
-from PyQt5.QtWidgets import (QGroupBox, QVBoxLayout, QLabel,
-                             QComboBox, QCheckBox)
+from PyQt5.QtWidgets import (QGroupBox, QVBoxLayout, QHBoxLayout, QLabel,
+                             QComboBox, QCheckBox, QSpinBox)
+
+from config.settings import BATCH_MAX_WORKERS
 
 
 class SettingsGroup(QGroupBox):
@@ -44,6 +46,16 @@ class SettingsGroup(QGroupBox):
         self.loop_checkbox.setChecked(True)
         settings_layout.addWidget(self.loop_checkbox)
 
+        # Количество одновременных загрузок
+        workers_layout = QHBoxLayout()
+        workers_layout.addWidget(QLabel("Одновременных загрузок:"))
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, 16)
+        self.workers_spin.setValue(BATCH_MAX_WORKERS)
+        workers_layout.addWidget(self.workers_spin)
+        workers_layout.addStretch(1)
+        settings_layout.addLayout(workers_layout)
+
         self.setLayout(settings_layout)
 
     def get_sync_method(self):
@@ -52,4 +64,8 @@ class SettingsGroup(QGroupBox):
 
     def is_loop_detection_enabled(self):
         """Возвращает, включена ли оптимизация циклов"""
-        return self.loop_checkbox.isChecked()
\ No newline at end of file
+        return self.loop_checkbox.isChecked()
+
+    def get_max_workers(self):
+        """Возвращает количество одновременных загрузок"""
+        return self.workers_spin.value()
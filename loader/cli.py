@@ -0,0 +1,471 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Консольный интерфейс: python -m loader"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config.settings import APP_NAME, APP_VERSION, BATCH_MAX_WORKERS, ASYNC_MAX_PROCESSES
+from core.variants import OutputVariant, parse_variant, unique_variants
+
+
+def _variant_arg(spec):
+    """Вариант результата из аргумента --variant"""
+    try:
+        return parse_variant(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def _profile_arg(spec):
+    """Профиль перекодирования из аргумента --profile"""
+    from core.encoding import parse_profile
+
+    try:
+        return parse_profile(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def parse_args(argv=None):
+    """Разбирает аргументы командной строки"""
+    parser = argparse.ArgumentParser(
+        prog='python -m loader',
+        description=f"{APP_NAME} v{APP_VERSION}: загрузка видео без графического интерфейса. "
+                    "Результаты выводятся в stdout в формате JSON Lines.",
+    )
+    parser.add_argument('urls', nargs='*',
+                        help="ссылки на видео, каналы (coub.com/<канал>), теги (coub.com/tags/<тег>) "
+                             "или разделы (coub.com/hot); '-' читает ссылки из stdin")
+    parser.add_argument('-i', '--input', action='append', default=[],
+                        help="файл со ссылками (по одной в строке), можно указать несколько раз")
+    parser.add_argument('-o', '--output-dir', default=os.getcwd(),
+                        help="каталог для готовых файлов (по умолчанию текущий)")
+    parser.add_argument('-s', '--sync-method', type=int, choices=(1, 2), default=1,
+                        help="метод синхронизации")
+    parser.add_argument('--variant', action='append', type=_variant_arg, default=[],
+                        metavar='МЕТОД[:КОНТЕЙНЕР[:КАЧЕСТВО[:ПРОФИЛЬ]]]',
+                        help="вариант результата, например 2:mkv, 1:mp4:med или 1:mkv::h265+opus; "
+                             "можно указать несколько раз - загрузка и замеры выполняются один "
+                             "раз, варианты собираются параллельно (заменяет -s)")
+    parser.add_argument('--profile', type=_profile_arg, default=(),
+                        help="перекодирование для вариантов без своего профиля: h264, h265, "
+                             "opus, aac или видео и аудио вместе, например h265+opus "
+                             "(без него потоки копируются)")
+    parser.add_argument('--max-encodes', type=int, default=None,
+                        help="одновременных перекодирований; ядра делятся между ними поровну")
+    parser.add_argument('--no-loop-detection', action='store_true',
+                        help="отключить оптимизацию циклов")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="не читать кэш метаданных API и исходных файлов")
+    parser.add_argument('--force', action='store_true',
+                        help="скачивать заново видео, уже записанные в индекс готовых загрузок")
+    parser.add_argument('--stream-audio', action='store_true',
+                        help="подавать аудио в ffmpeg во время загрузки (режим одного прохода)")
+    parser.add_argument('-w', '--workers', type=int, default=BATCH_MAX_WORKERS,
+                        help="количество одновременных загрузок")
+    parser.add_argument('--engine', choices=('threads', 'async'), default='threads',
+                        help="threads - пул потоков, async - один цикл событий asyncio "
+                             "(--workers задает число одновременных заданий)")
+    parser.add_argument('--max-processes', type=int, default=ASYNC_MAX_PROCESSES,
+                        help="не более стольких ffmpeg/ffprobe одновременно (для --engine async)")
+    parser.add_argument('--max-pages', type=int, default=None,
+                        help="не больше стольких страниц каждой ленты (0 - все)")
+    parser.add_argument('--limit-rate', type=float, default=None,
+                        help="общий лимит скорости загрузок, МБ/с (0 - без ограничения)")
+    parser.add_argument('--max-host-connections', type=int, default=None,
+                        help="одновременных соединений к одному хосту (0 - без ограничения)")
+    parser.add_argument('--max-size', type=float, default=None,
+                        help="бюджет задания, МБ: берется лучшее качество видео, которое вместе "
+                             "с аудио укладывается в него")
+    parser.add_argument('--target-time', type=float, default=None,
+                        help="целевое время загрузки задания, с (бюджет = время * скорость)")
+    parser.add_argument('--expected-rate', type=float, default=None,
+                        help="ожидаемая скорость для --target-time, МБ/с "
+                             "(по умолчанию --limit-rate)")
+    parser.add_argument('--metrics-jsonl', default='',
+                        help="дописывать замеры этапов каждого задания в файл JSON Lines")
+    parser.add_argument('--metrics-prom', default='',
+                        help="файл метрик для node_exporter textfile collector")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="выводить ход обработки в stderr")
+    args = parser.parse_args(argv)
+    variants = args.variant or [OutputVariant(args.sync_method)]
+    try:
+        variants = [
+            variant if variant.profile else OutputVariant(
+                variant.sync_method, variant.container, variant.quality, args.profile
+            )
+            for variant in variants
+        ]
+    except ValueError as e:
+        parser.error(str(e))
+    args.variants = unique_variants(variants)
+    return args
+
+
+def make_quality_policy(args):
+    """Политика выбора качества из аргументов; None - из настроек"""
+    from core.quality import QualityPolicy
+
+    if not (args.max_size or args.target_time):
+        return None
+    megabyte = 1024 * 1024
+    return QualityPolicy(
+        max_bytes=int((args.max_size or 0) * megabyte),
+        target_seconds=args.target_time or 0,
+        rate=int((args.expected_rate or 0) * megabyte),
+    )
+
+
+def read_urls(args, stdin=None):
+    """Собирает ссылки из аргументов, файлов и stdin"""
+    stdin = stdin or sys.stdin
+    lines = []
+    read_stdin = False
+
+    for url in args.urls:
+        if url == '-':
+            read_stdin = True
+        else:
+            lines.append(url)
+
+    for path in args.input:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines.extend(f.read().splitlines())
+
+    if not args.urls and not args.input and not stdin.isatty():
+        read_stdin = True
+
+    if read_stdin:
+        lines.extend(stdin.read().splitlines())
+
+    urls = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            urls.append(line)
+    return urls
+
+
+class _JsonWriter:
+    """Потокобезопасный вывод JSON Lines"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+class _JobContext:
+    """Конвейер задания и собранные им ошибки"""
+
+    def __init__(self, job, queue, args, log=None):
+        # Тяжелые модули загружаются только при реальной работе
+        from core.pipeline import MediaPipeline
+
+        self.job = job
+        self.queue = queue
+        self.errors = []
+        self.log = log
+        self.started = time.monotonic()
+        self.pipeline = MediaPipeline(
+            args.sync_method, not args.no_loop_detection, output_dir=args.output_dir,
+            use_cache=not args.no_cache,
+            stream_audio=True if args.stream_audio else None,
+            on_status=self.on_status, on_progress=self.on_progress, on_error=self.on_error,
+            on_stage=lambda state: queue.set_state(job.job_id, state),
+            on_ffmpeg_progress=self.on_ffmpeg_progress,
+            priority=job.priority,
+            skip_completed=not args.force,
+            variants=args.variants,
+            quality_policy=job.quality_policy,
+        )
+
+    def on_status(self, message):
+        if self.log:
+            self.log(f"[{self.job.job_id}] {message}")
+
+    def on_error(self, message):
+        self.errors.append(message)
+        self.on_status(f"Ошибка: {message}")
+
+    def on_progress(self, desc, percent, downloaded, total):
+        self.queue.update_progress(self.job.job_id, downloaded, total)
+
+    def on_ffmpeg_progress(self, stage, info):
+        if info['done']:
+            self.on_status(f"ffmpeg {stage}: {info['out_time']:.2f} с, "
+                           f"{info['speed']:.1f}x, {info['total_size']} байт")
+
+    def finish(self, result_path):
+        """Фиксирует итог задания и возвращает запись результата"""
+        from core.jobs import JobState
+
+        if result_path:
+            self.queue.set_state(self.job.job_id, JobState.DONE, result_path=result_path)
+        else:
+            self.queue.set_state(self.job.job_id, JobState.FAILED, error='; '.join(self.errors))
+
+        record = {
+            'url': self.job.url,
+            'success': bool(result_path),
+            'path': result_path or '',
+            'size': os.path.getsize(result_path) if result_path else 0,
+            'errors': self.errors,
+            'elapsed': round(time.monotonic() - self.started, 3),
+            'stages': self.pipeline.record.stage_durations(),
+        }
+        if len(self.pipeline.variants) > 1:
+            record['outputs'] = {
+                str(variant): path or '' for variant, path in self.pipeline.outputs.items()
+            }
+        return record
+
+
+def run_job(job, queue, args, log=None):
+    """Обрабатывает одно задание и возвращает запись результата"""
+    context = _JobContext(job, queue, args, log)
+    try:
+        result_path = context.pipeline.download_media_high_quality(job.url)
+    except Exception as e:
+        context.errors.append(str(e))
+        result_path = None
+    return context.finish(result_path)
+
+
+def skip_completed(urls, args, writer, log=None):
+    """Отбрасывает видео из индекса готовых загрузок, возвращает остальные ссылки
+
+    Для пропущенных в вывод пишется запись с 'skipped': True.
+    """
+    from core.api import API
+    from core.download_index import get_download_index
+    from config.settings import DOWNLOAD_INDEX
+
+    if args.force or not DOWNLOAD_INDEX['ENABLED'] or not urls:
+        return urls
+
+    pending, done = get_download_index().split_completed(
+        urls, args.variants, API().extract_media_id
+    )
+    for url, path in done.items():
+        writer.write({
+            'url': url,
+            'success': True,
+            'skipped': True,
+            'path': path,
+            'size': os.path.getsize(path),
+            'errors': [],
+            'elapsed': 0,
+        })
+    if done and log:
+        log(f"Уже скачано, пропущено: {len(done)}")
+    return pending
+
+
+def ingest_feeds(queue, feeds, args, writer, log=None, cancel_event=None):
+    """Обходит ленты в фоне и добавляет найденные видео в очередь
+
+    Возвращает поток обхода; очередь считает его источником до завершения.
+    Установленный cancel_event прекращает запрос новых страниц.
+    """
+    from core.api import API
+    from core.ingest import FeedIngestor
+    from config.settings import INGEST
+
+    def on_error(message):
+        if log:
+            log(f"Ошибка: {message}")
+
+    ingestor = FeedIngestor(
+        API(use_cache=not args.no_cache),
+        max_pages=INGEST['MAX_PAGES'] if args.max_pages is None else args.max_pages,
+        on_error=on_error,
+    )
+    ingestor.mark_seen(ingestor.api.extract_media_id(job.url) for job in queue.jobs())
+    quality_policy = make_quality_policy(args)
+
+    if cancel_event is None:
+        cancel_event = threading.Event()
+
+    def run():
+        try:
+            for url in feeds:
+                if cancel_event.is_set():
+                    break
+                found = 0
+                for batch in ingestor.iter_batches(url, cancel_event):
+                    found += len(batch)
+                    queue.add_urls(skip_completed(batch, args, writer, log),
+                                   quality_policy=quality_policy)
+                if log:
+                    log(f"{url}: найдено видео: {found}")
+        finally:
+            queue.producer_done()
+
+    queue.add_producer()
+    thread = threading.Thread(target=run, name='ingest', daemon=True)
+    thread.start()
+    return thread
+
+
+def run_threads(queue, args, writer, log=None):
+    """Обрабатывает очередь пулом потоков"""
+    def worker():
+        while True:
+            job = queue.take_next(wait=True)
+            if job is None:
+                return
+            writer.write(run_job(job, queue, args, log))
+
+    workers = args.workers if queue.is_producing() else min(args.workers, len(queue.jobs()))
+    workers = max(1, workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(worker) for _ in range(workers)]:
+            future.result()
+
+
+def run_async(queue, args, writer, log=None):
+    """Обрабатывает очередь асинхронным движком"""
+    from core.async_engine import AsyncEngine
+
+    contexts = {}
+    # Ошибки заданий, для которых не удалось создать конвейер
+    setup_errors = {}
+
+    def items():
+        # Движок берет следующее задание, только когда есть свободное место,
+        # поэтому задание считается начатым в момент выдачи
+        while True:
+            job = queue.take_next(wait=True)
+            if job is None:
+                return
+            yield job.job_id, job.url
+
+    def make_pipeline(job_id):
+        contexts[job_id] = _JobContext(queue.get(job_id), queue, args, log)
+        return contexts[job_id].pipeline
+
+    def on_error(job_id, error):
+        setup_errors[job_id] = str(error)
+        if log:
+            log(f"[{job_id}] Ошибка: {error}")
+
+    def on_result(job_id, path):
+        context = contexts.get(job_id)
+        if context is not None:
+            writer.write(context.finish(path))
+            return
+
+        from core.jobs import JobState
+
+        job = queue.get(job_id)
+        error = setup_errors.get(job_id, '')
+        queue.set_state(job_id, JobState.FAILED, error=error)
+        writer.write({
+            'url': job.url,
+            'success': False,
+            'path': '',
+            'size': 0,
+            'errors': [error] if error else [],
+            'elapsed': 0,
+        })
+
+    engine = AsyncEngine(max_jobs=args.workers, max_processes=args.max_processes)
+    engine.run(items(), make_pipeline, on_result=on_result, on_error=on_error)
+
+
+def main(argv=None):
+    """Точка входа консольного режима"""
+    args = parse_args(argv)
+    urls = read_urls(args)
+    if not urls:
+        print("Ошибка: не указаны ссылки", file=sys.stderr)
+        return 2
+
+    from core.utils import check_ffmpeg
+    from core.jobs import JobQueue, JobState
+    from core.metrics import get_metrics
+    from core.bandwidth import Priority, get_scheduler
+    from core.encoding import get_encode_scheduler
+    from core.ingest import SourceKind, parse_source
+
+    if not check_ffmpeg():
+        print("Ошибка: ffmpeg не найден. Установите ffmpeg и добавьте в PATH.", file=sys.stderr)
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    get_scheduler().configure(
+        rate=None if args.limit_rate is None else int(args.limit_rate * 1024 * 1024),
+        host_limit=args.max_host_connections,
+    )
+    get_encode_scheduler().configure(max_encodes=args.max_encodes)
+
+    metrics = get_metrics()
+    if args.metrics_jsonl:
+        metrics.jsonl_path = args.metrics_jsonl
+    if args.metrics_prom:
+        metrics.prometheus_path = args.metrics_prom
+
+    def log(message):
+        if args.verbose:
+            print(message, file=sys.stderr, flush=True)
+
+    # Каналы, теги и разделы раскрываются в фоне, видео из них идут в очередь сразу
+    feeds = [url for url in urls if (parse_source(url) or (None,))[0] in SourceKind.FEEDS]
+    direct = [url for url in urls if url not in feeds]
+
+    writer = _JsonWriter(sys.stdout)
+    queue = JobQueue()
+    single = len(direct) == 1 and not feeds
+    queue.add_urls(skip_completed(direct, args, writer, log),
+                   Priority.INTERACTIVE if single else Priority.BATCH,
+                   make_quality_policy(args))
+    cancel_event = threading.Event()
+    if feeds:
+        ingest_feeds(queue, feeds, args, writer, log, cancel_event)
+
+    try:
+        if args.engine == 'async':
+            run_async(queue, args, writer, log)
+        else:
+            run_threads(queue, args, writer, log)
+    finally:
+        # При выходе (в том числе по Ctrl+C) обход лент больше не запрашивает страниц
+        cancel_event.set()
+
+    try:
+        metrics.write_prometheus()
+    except OSError as e:
+        print(f"Ошибка записи метрик Prometheus: {e}", file=sys.stderr)
+
+    stats = queue.stats()
+    stats['stages'] = metrics.stage_summary()
+    log(json.dumps({'summary': stats}, ensure_ascii=False))
+    return 0 if stats['counts'][JobState.FAILED] == 0 else 1
@@ -0,0 +1,94 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Лимит соединений к хосту: смена лимита на ходу"""
+
+import threading
+import unittest
+
+from core.bandwidth import HostLimiter
+
+HOST = 'media.example'
+
+
+class HostLimiterTest(unittest.TestCase):
+    def _acquire_in_thread(self, limiter):
+        """Запускает acquire в потоке, возвращает (поток, событие получения места)"""
+        acquired = threading.Event()
+
+        def run():
+            limiter.acquire(HOST)
+            acquired.set()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        return thread, acquired
+
+    def test_raising_limit_wakes_waiter(self):
+        limiter = HostLimiter(limit=1)
+        limiter.acquire(HOST)
+        _, acquired = self._acquire_in_thread(limiter)
+        self.assertFalse(acquired.wait(0.2))
+
+        limiter.configure(2)
+        self.assertTrue(acquired.wait(5))
+        self.assertEqual(limiter.active(HOST), 2)
+
+    def test_removing_limit_wakes_waiter(self):
+        limiter = HostLimiter(limit=1)
+        limiter.acquire(HOST)
+        _, acquired = self._acquire_in_thread(limiter)
+        self.assertFalse(acquired.wait(0.2))
+
+        limiter.configure(0)
+        self.assertTrue(acquired.wait(5))
+        self.assertEqual(limiter.active(HOST), 2)
+
+    def test_limit_counts_connections_opened_without_limit(self):
+        limiter = HostLimiter(limit=0)
+        limiter.acquire(HOST)
+        limiter.acquire(HOST)
+        self.assertEqual(limiter.active(HOST), 2)
+
+        limiter.configure(1)
+        _, acquired = self._acquire_in_thread(limiter)
+        limiter.release(HOST)
+        self.assertFalse(acquired.wait(0.2))
+
+        limiter.release(HOST)
+        self.assertTrue(acquired.wait(5))
+        self.assertEqual(limiter.active(HOST), 1)
+
+    def test_lowering_limit_applies_to_new_connections(self):
+        limiter = HostLimiter(limit=3)
+        limiter.acquire(HOST)
+        limiter.acquire(HOST)
+
+        limiter.configure(1)
+        _, acquired = self._acquire_in_thread(limiter)
+        self.assertFalse(acquired.wait(0.2))
+
+        limiter.release(HOST)
+        self.assertFalse(acquired.wait(0.2))
+        limiter.release(HOST)
+        self.assertTrue(acquired.wait(5))
+        limiter.release(HOST)
+        self.assertEqual(limiter.active(HOST), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Докачка: запись по смещению, продолжение по журналу, смена файла на сервере"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import core.downloader as downloader_module
+import core.resume as resume_module
+from core.bandwidth import DownloadScheduler
+from core.downloader import FileDownloader
+from core.resume import PartialDownload
+
+URL = 'http://media.example/video.mp4'
+
+
+class _Response:
+    """Потоковый ответ; cut_at - разрыв соединения после стольких байт тела"""
+
+    def __init__(self, status_code, body, headers, cut_at=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers
+        self.cut_at = cut_at
+
+    def iter_content(self, chunk_size):
+        body = self.body if self.cut_at is None else self.body[:self.cut_at]
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _Server:
+    """Файл на сервере с ETag и поддержкой Range; запоминает заголовки Range"""
+
+    def __init__(self, body, etag):
+        self.body = body
+        self.etag = etag
+        self.ranges = []
+        self.cuts = []  # разрывы для очередных GET: число байт или None
+
+    def head(self, url, allow_redirects=True, timeout=None):
+        return _Response(200, b'', self._headers(len(self.body)))
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        value = (headers or {}).get('Range')
+        self.ranges.append(value)
+        cut_at = self.cuts.pop(0) if self.cuts else None
+        if value is None:
+            return _Response(200, self.body, self._headers(len(self.body)), cut_at)
+
+        start, end = value[len('bytes='):].split('-')
+        start = int(start)
+        end = int(end) if end else len(self.body) - 1
+        headers = self._headers(end - start + 1)
+        headers['content-range'] = f"bytes {start}-{end}/{len(self.body)}"
+        return _Response(206, self.body[start:end + 1], headers, cut_at)
+
+    def _headers(self, length):
+        return {'content-length': str(length), 'etag': self.etag, 'accept-ranges': 'bytes'}
+
+
+class WriteAtTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir, True)
+        self.path = os.path.join(self.temp_dir, 'data.part')
+        with open(self.path, 'wb') as f:
+            f.write(b'.' * 16)
+
+    @unittest.skipUnless(hasattr(os, 'pwrite'), "нет os.pwrite")
+    def test_short_pwrite_is_retried(self):
+        real_pwrite = os.pwrite
+        calls = []
+
+        def short_pwrite(fd, data, offset):
+            # Не больше трех байт за вызов, как при записи, прерванной сигналом
+            calls.append(offset)
+            return real_pwrite(fd, bytes(data[:3]), offset)
+
+        with mock.patch.object(os, 'pwrite', side_effect=short_pwrite):
+            with open(self.path, 'r+b') as f:
+                FileDownloader._write_at(f, b'abcdefghij', 4)
+
+        self.assertEqual(calls, [4, 7, 10, 13])
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b'....abcdefghij..')
+
+    @unittest.skipUnless(hasattr(os, 'pwrite'), "нет os.pwrite")
+    def test_no_progress_raises(self):
+        with mock.patch.object(os, 'pwrite', return_value=0):
+            with open(self.path, 'r+b') as f:
+                with self.assertRaises(OSError):
+                    FileDownloader._write_at(f, b'abc', 0)
+
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir, True)
+        self.resume_dir = os.path.join(self.temp_dir, 'partial')
+        self.target = os.path.join(self.temp_dir, 'video.mp4')
+        self.body = bytes(range(256)) * 64
+        self.server = _Server(self.body, '"v1"')
+        patches = [
+            mock.patch.object(downloader_module, 'get_session', return_value=self.server),
+            mock.patch.object(downloader_module, 'get_scheduler',
+                              return_value=DownloadScheduler(rate=0, host_limit=0)),
+            mock.patch.object(downloader_module, 'DOWNLOAD_SEGMENTS', 1),
+            mock.patch.object(downloader_module, 'DOWNLOAD_CHUNK_SIZE', 1024),
+            mock.patch.object(FileDownloader, '_backoff_delay', return_value=0),
+            mock.patch.object(resume_module, 'RESUME_DIR', self.resume_dir),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def _read_target(self):
+        with open(self.target, 'rb') as f:
+            return f.read()
+
+    def _interrupted(self, etag, body, done):
+        """Журнал и .part прошлого запуска, оборванного на done байтах"""
+        with PartialDownload(URL, self.resume_dir) as partial:
+            partial.plan(etag, len(body), [(0, len(body) - 1)])
+            with open(partial.part_path, 'r+b') as f:
+                f.write(body[:done])
+            partial.advance(0, done)
+
+    def test_resume_after_cut_connection(self):
+        # Соединение рвется на 5000 байт, повтор продолжает с этого места
+        self.server.cuts = [5000]
+        self.assertTrue(FileDownloader.download_file(URL, self.target, 'видео'))
+
+        self.assertEqual(self._read_target(), self.body)
+        self.assertEqual(self.server.ranges, [None, 'bytes=5000-16383'])
+        self.assertFalse(os.listdir(self.resume_dir))
+
+    def test_resume_from_journal_of_previous_run(self):
+        self._interrupted('"v1"', self.body, 3000)
+
+        self.assertTrue(FileDownloader.download_file(URL, self.target, 'видео'))
+
+        self.assertEqual(self._read_target(), self.body)
+        self.assertEqual(self.server.ranges, ['bytes=3000-16383'])
+
+    def test_journal_ahead_of_truncated_part_is_discarded(self):
+        # Размер неизвестен, а .part короче, чем записано в журнале
+        with PartialDownload(URL, self.resume_dir) as partial:
+            partial.plan('"v1"', 0, [(0, None)])
+            with open(partial.part_path, 'wb') as f:
+                f.write(self.body[:1000])
+            partial.advance(0, 4000)
+
+        with PartialDownload(URL, self.resume_dir) as partial:
+            self.assertEqual(partial.ranges, [])
+            self.assertFalse(os.path.exists(partial.part_path))
+
+    def test_etag_change_restarts_file(self):
+        self._interrupted('"v1"', self.body, 3000)
+        new_body = bytes(reversed(self.body))
+        self.server.body = new_body
+        self.server.etag = '"v2"'
+
+        self.assertTrue(FileDownloader.download_file(URL, self.target, 'видео'))
+
+        self.assertEqual(self._read_target(), new_body)
+        # Старый .part не продолжается: файл качается с начала
+        self.assertEqual(self.server.ranges, [None])
+
+
+if __name__ == '__main__':
+    unittest.main()
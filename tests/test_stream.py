@@ -0,0 +1,110 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Потоковый один проход: лимит соединений хоста не приводит к взаимоблокировке"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import core.pipeline as pipeline_module
+from core.bandwidth import DownloadScheduler
+from core.pipeline import MediaPipeline
+
+HOST = 'http://media.example'
+# MPEG-1 Layer III, 128 кбит/с, 44,1 кГц: кадр 417 байт
+FRAME = b'\xff\xfb\x90\x00' + b'\x00' * 413
+# Первый кадр с заголовком Info (число кадров): длительность известна по началу потока
+INFO_FRAME = (b'\xff\xfb\x90\x00' + b'\x00' * 32 + b'Info'
+              + (1).to_bytes(4, 'big') + (200).to_bytes(4, 'big') + b'\x00' * 369)
+
+
+class _Response:
+    """Потоковый ответ с аудио"""
+
+    def __init__(self, body):
+        self.body = body
+        self.headers = {'content-length': str(len(body)), 'etag': '"a"'}
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class StreamHostLimitTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.scheduler = DownloadScheduler(rate=0, host_limit=1)
+        patches = [
+            mock.patch.object(pipeline_module, 'get_scheduler', return_value=self.scheduler),
+            mock.patch.dict(pipeline_module.MEDIA_CACHE, {'ENABLED': False}),
+            mock.patch.object(pipeline_module, 'run_ffmpeg', side_effect=self._fake_ffmpeg),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(shutil.rmtree, self.temp_dir, True)
+
+    @staticmethod
+    def _fake_ffmpeg(cmd, stage='', duration=0, stall_timeout=None, stdin=None):
+        for _ in stdin:
+            pass
+        with open(cmd[-1], 'wb') as f:
+            f.write(b'out')
+
+    def _fetch_video(self, url, path, *args):
+        # Как и настоящая загрузка, занимает место в лимите соединений хоста,
+        # но не сразу (запрос заголовков, проверка кэша)
+        time.sleep(0.2)
+        with self.scheduler.connection(url):
+            with open(path, 'wb') as f:
+                f.write(b'video')
+        return True
+
+    def test_single_host_slot(self):
+        audio = INFO_FRAME + FRAME * 199
+        pipeline = MediaPipeline(1, output_dir=self.temp_dir)
+        pipeline._fetch_file = self._fetch_video
+        pipeline.downloader.open_stream = lambda url: _Response(audio)
+        pipeline.processor.find_exact_loop_duration = lambda path, temp_dir: 1.0
+
+        output = os.path.join(self.temp_dir, 'out.mp4')
+        result = []
+        thread = threading.Thread(target=lambda: result.append(pipeline._stream_single_pass(
+            f'{HOST}/video.mp4', f'{HOST}/audio.mp3',
+            os.path.join(self.temp_dir, 'video.mp4'), os.path.join(self.temp_dir, 'audio.mp3'),
+            output, [], self.temp_dir, 1
+        )), daemon=True)
+        thread.start()
+        thread.join(10)
+
+        self.assertFalse(thread.is_alive(), "загрузка видео ждет место, занятое аудио")
+        self.assertEqual(result, [True])
+        self.assertEqual(self.scheduler.hosts.active('media.example'), 0)
+        with open(os.path.join(self.temp_dir, 'audio.mp3'), 'rb') as f:
+            self.assertEqual(f.read(), audio)
+
+
+if __name__ == '__main__':
+    unittest.main()
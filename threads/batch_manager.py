@@ -0,0 +1,195 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Пакетная загрузка с ограниченным числом потоков"""
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+from threads.download_thread import DownloadThread
+from threads.ingest_thread import IngestThread
+from core.jobs import JobQueue, JobState
+from core.events import ProgressBus
+from core.bandwidth import Priority
+from core.api import API
+from core.download_index import get_download_index
+from core.variants import OutputVariant, unique_variants
+from core.metrics import get_metrics
+from config.settings import BATCH_MAX_WORKERS, PROGRESS_UPDATE_HZ, DOWNLOAD_INDEX
+
+
+class BatchManager(QObject):
+    """Запускает задания очереди, не более max_workers одновременно"""
+    job_changed = pyqtSignal(int)  # job_id
+    progress = pyqtSignal(dict)  # снимок ProgressBus, не чаще PROGRESS_UPDATE_HZ
+    status = pyqtSignal(int, str)  # job_id, message; 0 - сообщение обхода лент
+    all_finished = pyqtSignal()
+
+    def __init__(self, sync_method, enable_loop_detection=True, max_workers=BATCH_MAX_WORKERS,
+                 variants=None):
+        super().__init__()
+        self.sync_method = sync_method
+        # Варианты результата каждого задания (OutputVariant)
+        self.variants = unique_variants(variants or [OutputVariant(sync_method)])
+        self.enable_loop_detection = enable_loop_detection
+        self.max_workers = max(1, max_workers)
+        self.queue = JobQueue()
+        self.progress_bus = ProgressBus()
+        self._threads = {}
+        self._ingest_threads = []
+        self._bus_version = None
+        # Ссылки, пропущенные по индексу готовых загрузок (в очередь не попадают)
+        self.skipped = 0
+
+        # Прогресс опрашивается с фиксированной частотой
+        self._progress_timer = QTimer(self)
+        self._progress_timer.setInterval(int(1000 / PROGRESS_UPDATE_HZ))
+        self._progress_timer.timeout.connect(self._poll_progress)
+
+    def add_urls(self, urls, priority=None, quality_policy=None):
+        """Добавляет ссылки в очередь и запускает свободные потоки
+
+        По умолчанию одна ссылка - интерактивное задание, несколько - пакет.
+        quality_policy (QualityPolicy) задает выбор качества для пакета.
+        """
+        if priority is None:
+            priority = Priority.INTERACTIVE if len(urls) == 1 else Priority.BATCH
+
+        if DOWNLOAD_INDEX['ENABLED']:
+            # Один запрос к индексу на всю пачку, до любых сетевых запросов
+            urls, done = get_download_index().split_completed(
+                urls, self.variants, API().extract_media_id
+            )
+            self.skipped += len(done)
+            for url, path in done.items():
+                self.status.emit(0, f"Уже скачано: {url} -> {path}")
+
+        jobs = self.queue.add_urls(urls, priority, quality_policy)
+        for job in jobs:
+            self.job_changed.emit(job.job_id)
+        self._fill_workers()
+        return jobs
+
+    def add_sources(self, urls, quality_policy=None):
+        """Обходит каналы, теги и разделы в фоне, добавляя видео по мере нахождения"""
+        thread = IngestThread(urls, [job.url for job in self.queue.jobs()])
+        thread.media_found.connect(
+            lambda batch: self.add_urls(batch, Priority.BATCH, quality_policy)
+        )
+        thread.status.connect(lambda message: self.status.emit(0, message))
+        thread.error.connect(lambda message: self.status.emit(0, f"Ошибка: {message}"))
+        thread.finished.connect(lambda: self._on_ingest_finished(thread))
+
+        self._ingest_threads.append(thread)
+        thread.start()
+
+    def _on_ingest_finished(self, thread):
+        if thread in self._ingest_threads:
+            self._ingest_threads.remove(thread)
+            thread.deleteLater()
+        self._fill_workers()
+
+    def is_running(self):
+        """Есть ли активные или ожидающие задания"""
+        return bool(self._threads) or bool(self._ingest_threads) or self.queue.has_pending()
+
+    def stop(self):
+        """Останавливает все активные потоки"""
+        for thread in self._ingest_threads:
+            thread.cancel()
+            thread.wait()
+        self._ingest_threads.clear()
+
+        for thread in list(self._threads.values()):
+            if thread.isRunning():
+                thread.terminate()
+                thread.wait()
+        self._threads.clear()
+
+    def _fill_workers(self):
+        """Запускает задания, пока есть свободные места"""
+        while len(self._threads) < self.max_workers:
+            job = self.queue.take_next()
+            if job is None:
+                break
+            self._start_job(job)
+
+        # Интерактивные задания не ждут, пока освободится место
+        while True:
+            job = self.queue.take_next(Priority.INTERACTIVE)
+            if job is None:
+                break
+            self._start_job(job)
+
+        if not self._threads and not self._ingest_threads and not self.queue.has_pending():
+            try:
+                get_metrics().write_prometheus()
+            except OSError:
+                pass
+            self.all_finished.emit()
+
+    def _start_job(self, job):
+        """Создает и запускает поток для задания"""
+        job_id = job.job_id
+        thread = DownloadThread(job.url, self.sync_method, self.enable_loop_detection,
+                                progress_bus=self.progress_bus, job_id=job_id,
+                                priority=job.priority, variants=self.variants,
+                                quality_policy=job.quality_policy)
+        thread.status.connect(lambda message: self.status.emit(job_id, message))
+        thread.error.connect(lambda message: self._on_error(job_id, message))
+        thread.stage.connect(lambda state: self._on_stage(job_id, state))
+        thread.finished.connect(lambda path, success: self._on_finished(job_id, path, success))
+
+        self._threads[job_id] = thread
+        self.job_changed.emit(job_id)
+        if not self._progress_timer.isActive():
+            self._progress_timer.start()
+        thread.start()
+
+    def _poll_progress(self):
+        """Переносит снимок шины в очередь и отправляет один сигнал на все задания"""
+        snapshot = self.progress_bus.snapshot(self._bus_version)
+        if snapshot is None:
+            return
+
+        self._bus_version = snapshot['version']
+        for job_id, state in snapshot['jobs'].items():
+            self.queue.update_progress(job_id, state.get('downloaded', 0), state.get('total', 0))
+        self.progress.emit(snapshot)
+
+    def _on_stage(self, job_id, state):
+        self.queue.set_state(job_id, state)
+        self.job_changed.emit(job_id)
+
+    def _on_error(self, job_id, message):
+        self.queue.set_state(job_id, self.queue.get(job_id).state, error=message)
+        self.status.emit(job_id, f"Ошибка: {message}")
+
+    def _on_finished(self, job_id, result_path, success):
+        state = JobState.DONE if success and result_path else JobState.FAILED
+        self.queue.set_state(job_id, state, result_path=result_path)
+
+        thread = self._threads.pop(job_id, None)
+        if thread is not None:
+            thread.wait()
+            thread.deleteLater()
+
+        self._poll_progress()
+        self.progress_bus.remove(job_id)
+        if not self._threads:
+            self._progress_timer.stop()
+
+        self.job_changed.emit(job_id)
+        self._fill_workers()
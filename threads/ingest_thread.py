@@ -0,0 +1,52 @@
+# Loader
+# Copyright (C) rb1b
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Поток обхода лент (каналы, теги, разделы)"""
+
+import threading
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from core.ingest import FeedIngestor
+
+
+class IngestThread(QThread):
+    """Обходит ленты и отдает найденные видео по одной странице за раз"""
+    media_found = pyqtSignal(list)  # ссылки на видео
+    status = pyqtSignal(str)
+    error = pyqtSignal(str)
+
+    def __init__(self, urls, known_urls=()):
+        super().__init__()
+        self.urls = list(urls)
+        self._cancel_event = threading.Event()
+        self.ingestor = FeedIngestor(on_error=self.error.emit)
+        # Видео, уже стоящие в очереди, повторно не добавляются
+        self.ingestor.mark_seen(self.ingestor.api.extract_media_id(url) for url in known_urls)
+
+    def cancel(self):
+        """Прекращает обход: новые страницы не запрашиваются"""
+        self._cancel_event.set()
+
+    def run(self):
+        for url in self.urls:
+            found = 0
+            for batch in self.ingestor.iter_batches(url, self._cancel_event):
+                if self._cancel_event.is_set():
+                    return
+                self.media_found.emit(batch)
+                found += len(batch)
+            self.status.emit(f"{url}: найдено видео: {found}")